@@ -14,13 +14,13 @@ import paramiko
 import pathlib
 import io
 import base64
-import yaml
 import itertools
 import html
 import email.utils
 from typing import  List, Any, Tuple
 from lxml import etree as ET
 from datetime import datetime, timedelta, timezone
+from changelog_lib import ChangelogEntry, load_entries_since
 
 MAX_ITEM_AGE = timedelta(days=30)
 
@@ -64,30 +64,11 @@ XML_NS_ATOM_B = f"{{{XML_NS_ATOM}}}"
 ET.register_namespace("ss14", XML_NS)
 ET.register_namespace("atom", XML_NS_ATOM)
 
-# From https://stackoverflow.com/a/37958106/4678631
-class NoDatesSafeLoader(yaml.SafeLoader):
-    @classmethod
-    def remove_implicit_resolver(cls, tag_to_remove):
-        if not 'yaml_implicit_resolvers' in cls.__dict__:
-            cls.yaml_implicit_resolvers = cls.yaml_implicit_resolvers.copy()
-
-        for first_letter, mappings in cls.yaml_implicit_resolvers.items():
-            cls.yaml_implicit_resolvers[first_letter] = [(tag, regexp)
-                                                         for tag, regexp in mappings
-                                                         if tag != tag_to_remove]
-
-# Hrm yes let's make the fucking default of our serialization library to PARSE ISO-8601
-# but then output garbage when re-serializing.
-NoDatesSafeLoader.remove_implicit_resolver('tag:yaml.org,2002:timestamp')
-
 def main():
     if not CHANGELOG_RSS_KEY:
         print("::notice ::CHANGELOG_RSS_KEY not set, skipping RSS changelogs")
         return
 
-    with open(CHANGELOG_FILE, "r") as f:
-        changelog = yaml.load(f, Loader=NoDatesSafeLoader)
-
     with paramiko.SSHClient() as client:
         load_host_keys(client.get_host_keys())
         client.connect(SSH_HOST, SSH_PORT, SSH_USER, pkey=load_key(CHANGELOG_RSS_KEY))
@@ -95,6 +76,9 @@ def main():
 
         last_feed_items = load_last_feed_items(sftp)
 
+        # Only what's new since the feed was last updated, which usually doesn't reach into the archive at all.
+        changelog = load_entries_since(CHANGELOG_FILE, find_last_changelog_id(last_feed_items))
+
         feed, any_new = create_feed(changelog, last_feed_items)
 
         if not any_new:
@@ -119,7 +103,7 @@ def main():
             f.write(fh.read())
 
 
-def create_feed(changelog: Any, previous_items: List[Any]) -> Tuple[Any, bool]:
+def create_feed(changelog: Tuple[ChangelogEntry, ...], previous_items: List[Any]) -> Tuple[Any, bool]:
     rss = ET.Element("rss", attrib={"version": "2.0"})
     channel = ET.SubElement(rss, "channel")
 
@@ -142,9 +126,9 @@ def create_feed(changelog: Any, previous_items: List[Any]) -> Tuple[Any, bool]:
 
     return rss, any
 
-def create_new_item_since(changelog: Any, channel: Any, since: int, now: datetime) -> bool:
-    entries_for_item = [entry for entry in changelog["Entries"] if entry["id"] > since]
-    top_entry_id = max(map(lambda e: e["id"], entries_for_item), default=0)
+def create_new_item_since(changelog: Tuple[ChangelogEntry, ...], channel: Any, since: int, now: datetime) -> bool:
+    entries_for_item = [entry for entry in changelog if entry.id > since]
+    top_entry_id = max(map(lambda e: e.id, entries_for_item), default=0)
 
     if not entries_for_item:
         return False
@@ -160,28 +144,28 @@ def create_new_item_since(changelog: Any, channel: Any, since: int, now: datetim
     # Like the website!
     for entry in entries_for_item:
         xml_entry = ET.SubElement(new_item, XML_NS_B + "entry")
-        ET.SubElement(xml_entry, XML_NS_B + "id").text = str(entry["id"])
-        ET.SubElement(xml_entry, XML_NS_B + "time").text = entry["time"]
-        ET.SubElement(xml_entry, XML_NS_B + "author").text = entry["author"]
+        ET.SubElement(xml_entry, XML_NS_B + "id").text = str(entry.id)
+        ET.SubElement(xml_entry, XML_NS_B + "time").text = entry.time
+        ET.SubElement(xml_entry, XML_NS_B + "author").text = entry.author
 
-        for change in entry["changes"]:
-            attrs = {XML_NS_B + "type": change["type"]}
-            ET.SubElement(xml_entry, XML_NS_B + "change", attrs).text = change["message"]
+        for change in entry.changes:
+            attrs = {XML_NS_B + "type": change.type}
+            ET.SubElement(xml_entry, XML_NS_B + "change", attrs).text = change.message
 
     return True
 
-def generate_description_for_entries(entries: List[Any]) -> str:
+def generate_description_for_entries(entries: List[ChangelogEntry]) -> str:
     desc = io.StringIO()
 
-    keyfn = lambda x: x["author"]
+    keyfn = lambda x: x.author
     sorted_author = sorted(entries, key=keyfn)
     for author, group in itertools.groupby(sorted_author, keyfn):
         desc.write(f"<h3>{html.escape(author)} updated:</h3>\n")
         desc.write("<ul>\n")
-        for entry in sorted(group, key=lambda x: x["time"]):
-            for change in entry["changes"]:
-                emoji = TYPES_TO_EMOJI.get(change["type"], "")
-                msg = change["message"]
+        for entry in sorted(group, key=lambda x: x.time):
+            for change in entry.changes:
+                emoji = TYPES_TO_EMOJI.get(change.type, "")
+                msg = change.message
                 desc.write(f"<li>{emoji} {html.escape(msg)}</li>")
 
         desc.write("</ul>\n")
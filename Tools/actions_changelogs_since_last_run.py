@@ -12,8 +12,8 @@ from pathlib import Path
 from typing import Any, Iterable
 
 import requests
-import yaml
 import time
+from changelog_lib import ChangelogEntry, load_entries, parse_entries
 
 DEBUG = False
 DEBUG_CHANGELOG_FILE_OLD = Path("Resources/Changelog/Old.yml")
@@ -27,8 +27,6 @@ CHANGELOG_FILE = "Resources/Changelog/Changelog.yml"
 
 TYPES_TO_EMOJI = {"Fix": "🐛", "Add": "🆕", "Remove": "❌", "Tweak": "⚒️"}
 
-ChangelogEntry = dict[str, Any]
-
 
 def main():
     if not DISCORD_WEBHOOK_URL:
@@ -44,9 +42,8 @@ def main():
         # it will get the old changelog from the GitHub API
         last_changelog_stream = get_last_changelog()
 
-    last_changelog = yaml.safe_load(last_changelog_stream)
-    with open(CHANGELOG_FILE, "r") as f:
-        cur_changelog = yaml.safe_load(f)
+    last_changelog = parse_entries(last_changelog_stream)
+    cur_changelog = load_entries(CHANGELOG_FILE)
 
     diff = diff_changelog(last_changelog, cur_changelog)
     message_lines = changelog_entries_to_message_lines(diff)
@@ -127,13 +124,13 @@ def get_last_changelog_by_sha(
 
 
 def diff_changelog(
-    old: dict[str, Any], cur: dict[str, Any]
+    old: Iterable[ChangelogEntry], cur: Iterable[ChangelogEntry]
 ) -> Iterable[ChangelogEntry]:
     """
     Find all new entries not present in the previous publish.
     """
-    old_entry_ids = {e["id"] for e in old["Entries"]}
-    return (e for e in cur["Entries"] if e["id"] not in old_entry_ids)
+    old_entry_ids = {e.id for e in old}
+    return (e for e in cur if e.id not in old_entry_ids)
 
 
 def get_discord_body(content: str):
@@ -172,18 +169,18 @@ def changelog_entries_to_message_lines(entries: Iterable[ChangelogEntry]) -> lis
     """Process structured changelog entries into a list of lines making up a formatted message."""
     message_lines = []
 
-    for contributor_name, group in itertools.groupby(entries, lambda x: x["author"]):
+    for contributor_name, group in itertools.groupby(entries, lambda x: x.author):
         message_lines.append("\n")
         message_lines.append(f"**{contributor_name}** updated:\n")
 
         for entry in group:
-            url = entry.get("url")
+            url = entry.url
             if url and not url.strip():
                 url = None
 
-            for change in entry["changes"]:
-                emoji = TYPES_TO_EMOJI.get(change["type"], "❓")
-                message = change["message"]
+            for change in entry.changes:
+                emoji = TYPES_TO_EMOJI.get(change.type, "❓")
+                message = change.message
 
                 # if a single line is longer than the limit, it needs to be truncated
                 if len(message) > DISCORD_SPLIT_LIMIT:
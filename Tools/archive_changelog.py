@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# Moves old changelog entries out of the changelogs into shard files under Resources/Changelog/Archive,
+# and keeps an index of which shard holds which IDs, so the changelog scripts only read the shards they need.
+# The changelogs themselves are edited line by line, so the entries that stay are left exactly as they were.
+
+import argparse
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone
+import yaml
+from changelog_lib import ARCHIVE_INDEX, archive_dir, load_yaml, read_archive_index
+
+CHANGELOG_FILES = [
+    "Resources/Changelog/Changelog.yml",
+    "Resources/Changelog/Sector-vestige.yml",
+    "Resources/Changelog/Maps.yml",
+    "Resources/Changelog/Admin.yml",
+]
+
+TIME_REGEX = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})[T ](\d{1,2}):(\d{2})(?::(\d{2}))?(?:\.\d+)?\s*(Z|[+-]\d{2}:?\d{2})?$")
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old changelog entries into shards.")
+    parser.add_argument("changelogs", nargs="*", default=CHANGELOG_FILES, help="Changelog files to archive entries of")
+    parser.add_argument("--older-than", type=int, default=365, help="Archive entries older than this many days")
+    parser.add_argument("--shard-by", choices=["year", "id"], default="year", help="Shard on the year of an entry, or on ID ranges")
+    parser.add_argument("--shard-size", type=int, default=1000, help="Number of IDs per shard with --shard-by id")
+    parser.add_argument("--dry-run", action="store_true", help="Only print what would be archived")
+
+    args = parser.parse_args()
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=args.older_than)
+
+    for path in args.changelogs:
+        archive_changelog(path, cutoff, args.shard_by, args.shard_size, args.dry_run)
+
+
+def archive_changelog(path: str, cutoff: datetime, shard_by: str, shard_size: int, dry_run: bool):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        lines = f.readlines()
+
+    entries = load_yaml("".join(lines)).get("Entries") or []
+    head, blocks, tail = split_entries(lines)
+    if len(blocks) != len(entries):
+        print(f"{path}: can't tell the entries apart line by line, skipping")
+        return
+
+    # Only ever a run of the oldest entries, so the shards and what's left don't overlap. The newest entry
+    # always stays, the scripts adding entries number on from it.
+    order = sorted(range(len(entries)), key=lambda i: entries[i]["id"])
+    archived = []
+    shards = {}
+    shard = None
+    for i in order[:-1]:
+        # A few old entries have no time, those go along with the entries before them.
+        if "time" in entries[i]:
+            if parse_time(entries[i]["time"]) >= cutoff:
+                break
+            shard = shard_name(entries[i], shard_by, shard_size)
+        elif shard_by == "id" or shard is None:
+            shard = shard_name(entries[i], "id", shard_size) if shard_by == "id" else shard_name(entries[order[0]], shard_by, shard_size)
+
+        archived.append(i)
+        shards.setdefault(shard, []).append(entries[i])
+
+    if not archived:
+        print(f"{path}: nothing to archive")
+        return
+
+    print(f"{path}: archiving {len(archived)} entries into {', '.join(sorted(shards))}")
+    if dry_run:
+        return
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    directory = os.path.join(archive_dir(path), name)
+    os.makedirs(directory, exist_ok=True)
+
+    index = read_archive_index(path)
+    shard_index = {shard["file"]: shard for shard in index.get(name, [])}
+
+    for shard, shard_entries in shards.items():
+        file = f"{name}/{shard}.yml"
+        shard_entries = merge_shard(os.path.join(archive_dir(path), file), shard_entries)
+        times = [entry["time"] for entry in shard_entries if "time" in entry] or [""]
+        shard_index[file] = {
+            "file": file,
+            "first_id": shard_entries[0]["id"],
+            "last_id": shard_entries[-1]["id"],
+            "first_time": min(times),
+            "last_time": max(times),
+            "count": len(shard_entries),
+        }
+
+    index[name] = sorted(shard_index.values(), key=lambda shard: shard["first_id"])
+    write_file(os.path.join(archive_dir(path), ARCHIVE_INDEX), json.dumps(index, indent=4) + "\n")
+
+    # Changelog last, if anything above fails the entries are still in there.
+    archived = set(archived)
+    write_file(path, "".join(head + [line for i, block in enumerate(blocks) if i not in archived for line in block] + tail))
+
+
+def split_entries(lines: list) -> tuple:
+    """
+    Splits a changelog's lines into the ones before its entries, the lines of each entry and the ones after.
+    """
+    start = next((i for i, line in enumerate(lines) if line.lstrip("\ufeff").rstrip() == "Entries:"), None)
+    if start is None:
+        return lines, [], []
+
+    head = lines[:start + 1]
+    blocks = []
+    for i in range(start + 1, len(lines)):
+        line = lines[i]
+        if line.startswith("- "):
+            blocks.append([line])
+        elif line.strip() and not line[0].isspace():
+            # Next key after the Entries list.
+            return head, blocks, lines[i:]
+        elif blocks:
+            blocks[-1].append(line)
+        else:
+            head.append(line)
+
+    return head, blocks, []
+
+
+def parse_time(time: str) -> datetime:
+    # Hand-written entries don't always zero-pad, and the generated ones have more fractional digits than Python takes.
+    match = TIME_REGEX.match(time)
+    if not match:
+        raise ValueError(f"can't read entry time '{time}'")
+
+    year, month, day, hour, minute, second, offset = match.groups()
+    parsed = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second or 0))
+    if offset and offset != "Z":
+        sign = -1 if offset[0] == "-" else 1
+        offset = offset[1:].replace(":", "")
+        return parsed.replace(tzinfo=timezone(sign * timedelta(hours=int(offset[:2]), minutes=int(offset[2:]))))
+    return parsed.replace(tzinfo=timezone.utc)
+
+
+def shard_name(entry: dict, shard_by: str, shard_size: int) -> str:
+    if shard_by == "year":
+        return entry["time"][:4]
+
+    start = entry["id"] // shard_size * shard_size
+    return f"{start}-{start + shard_size - 1}"
+
+
+def merge_shard(path: str, entries: list) -> list:
+    """
+    Adds entries to a shard, writing it out. Returns all of the shard's entries, in ID order.
+    """
+    merged = []
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            merged = load_yaml(f).get("Entries") or []
+
+    # Entries already in there are from a run that was interrupted before it got to the changelog. Compared
+    # whole, some old changelogs have the same ID twice.
+    existing = {json.dumps(entry, sort_keys=True) for entry in merged}
+    merged += [entry for entry in entries if json.dumps(entry, sort_keys=True) not in existing]
+    merged.sort(key=lambda entry: entry["id"])
+
+    write_file(path, yaml.safe_dump({"Entries": merged}, default_flow_style=False, sort_keys=False, allow_unicode=True, width=120))
+    return merged
+
+
+def write_file(path: str, contents: str):
+    with open(path + ".tmp", "w", encoding="utf-8", newline="") as f:
+        f.write(contents)
+    os.replace(path + ".tmp", path)
+
+
+if __name__ == "__main__":
+    main()
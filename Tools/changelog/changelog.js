@@ -12,6 +12,9 @@ const HeaderRegex = /^\s*(?::cl:|🆑) *([a-z0-9_\- ,]+)?\s+/im; // :cl: or 🆑
 const EntryRegex = /^ *[*-]? *(add|remove|tweak|fix): *([^\n\r]+)\r?$/img; // * or - followed by change type [0] and change message [1]
 const CommentRegex = /<!--.*?-->/gs; // HTML comments
 
+// Bytes read from the end of the changelogs file at a time when looking for its last entry
+const TailBlockSize = 16 * 1024;
+
 // Main function
 async function main() {
     // Get PR details
@@ -52,18 +55,25 @@ async function main() {
     }
 
 
+    // Entries are appended in order, so the last one has the highest number
+    const path = `../../${process.env.CHANGELOG_DIR}`;
+    const lastEntry = fs.existsSync(path) ? readLastEntry(path) : null;
+
     // Construct changelog yml entry
     const entry = {
         author: author,
         changes: entries,
-        id: getHighestCLNumber() + 1,
+        id: (lastEntry ? lastEntry.id : getHighestCLNumber()) + 1,
         time: time,
     };
 
     console.log('entry (line 63): ', entry);
 
     // Write changelogs
-    writeChangelog(entry);
+    if (lastEntry)
+        appendChangelog(path, entry);
+    else
+        writeChangelog(entry);
 
     console.log(`Changelog updated with changes from PR #${process.env.PR_NUMBER}`);
 }
@@ -133,6 +143,57 @@ function getHighestCLNumber() {
     return Math.max(...clNumbers, 0);
 }
 
+// Read the last entry by scanning back from the end of the changelogs file, so this doesn't get slower as it grows.
+// Returns null if entries can't just be appended, like when Entries isn't the last key.
+function readLastEntry(path) {
+    const fd = fs.openSync(path, "r");
+    try {
+        const size = fs.fstatSync(fd).size;
+        for (let blockSize = TailBlockSize; ; blockSize *= 4) {
+            const start = Math.max(size - blockSize, 0);
+            const buffer = Buffer.alloc(size - start);
+            fs.readSync(fd, buffer, 0, buffer.length, start);
+
+            let lines = buffer.toString("utf8").split("\n");
+            if (start > 0)
+                lines = lines.slice(1); // Probably cut off halfway
+
+            // The last unindented line starts the last entry, if the file ends in the Entries list
+            let last = lines.length - 1;
+            while (last >= 0 && !/^\S/.test(lines[last]))
+                last--;
+
+            if (last >= 0) {
+                if (!lines[last].startsWith("- "))
+                    return null;
+                return yaml.load(lines.slice(last).join("\n"))[0];
+            }
+
+            if (start === 0)
+                return null;
+        }
+    } finally {
+        fs.closeSync(fd);
+    }
+}
+
+// Append an entry to the end of the changelogs file, leaving everything before it untouched
+function appendChangelog(path, entry) {
+    const file = fs.openSync(path, "r+");
+    try {
+        const size = fs.fstatSync(file).size;
+        const last = Buffer.alloc(1);
+        if (size > 0)
+            fs.readSync(file, last, 0, 1, size - 1);
+
+        // Make sure the entry starts on a line of its own
+        const separator = size > 0 && last.toString() !== "\n" ? "\n" : "";
+        fs.writeSync(file, separator + yaml.dump([entry], { indent: 2 }), size);
+    } finally {
+        fs.closeSync(file);
+    }
+}
+
 function writeChangelog(entry) {
     let data = { Entries: [] };
 
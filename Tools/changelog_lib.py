@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# Shared changelog loading for the changelog scripts.
+# Parses with libyaml when it's there, and keeps the parsed entries in a sidecar cache so a changelog that
+# hasn't changed since the last run isn't parsed again.
+
+import hashlib
+import json
+import marshal
+import os
+from dataclasses import dataclass
+import yaml
+
+# Bump when the cache layout changes, so old caches get thrown away.
+CACHE_VERSION = 1
+
+
+def user_cache_dir() -> str:
+    """Where the changelog scripts keep their caches: the user's cache directory, outside the repo."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "ss14-changelog")
+
+
+CACHE_DIR = os.environ.get("CHANGELOG_CACHE_DIR") or os.path.join(user_cache_dir(), "entries")
+
+# Where archive_changelog.py moves old entries, next to the changelogs. The game only loads the changelogs
+# themselves, not what's in here.
+ARCHIVE_DIR = "Archive"
+ARCHIVE_INDEX = "index.json"
+
+# libyaml's parser is a lot faster, PyYAML falls back to pure Python without it.
+BaseLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+class NoDatesLoader(BaseLoader):
+    """
+    Safe loader that leaves timestamps as the strings they are, so they come out the same when written back.
+    """
+    # From https://stackoverflow.com/a/37958106/4678631
+    @classmethod
+    def remove_implicit_resolver(cls, tag_to_remove):
+        if not 'yaml_implicit_resolvers' in cls.__dict__:
+            cls.yaml_implicit_resolvers = cls.yaml_implicit_resolvers.copy()
+
+        for first_letter, mappings in cls.yaml_implicit_resolvers.items():
+            cls.yaml_implicit_resolvers[first_letter] = [(tag, regexp)
+                                                         for tag, regexp in mappings
+                                                         if tag != tag_to_remove]
+
+NoDatesLoader.remove_implicit_resolver('tag:yaml.org,2002:timestamp')
+
+
+@dataclass(frozen=True, slots=True)
+class Change:
+    type: str
+    message: str
+
+
+@dataclass(frozen=True, slots=True)
+class ChangelogEntry:
+    id: int
+    author: str
+    time: str
+    url: str | None
+    changes: tuple[Change, ...]
+
+
+def load_yaml(data):
+    """Parse a YAML document (string, bytes or file) with the fast loader."""
+    return yaml.load(data, Loader=NoDatesLoader)
+
+
+def parse_entries(data) -> tuple[ChangelogEntry, ...]:
+    """Parse the entries of a changelog document, without any caching."""
+    changelog = load_yaml(data) or {}
+    return tuple(
+        ChangelogEntry(entry["id"], entry["author"], entry.get("time", ""), entry.get("url"),
+                       tuple(Change(change["type"], change["message"]) for change in entry["changes"]))
+        for entry in changelog.get("Entries") or []
+    )
+
+
+def load_entries(path: str) -> tuple[ChangelogEntry, ...]:
+    """
+    The entries of a changelog file, from the sidecar cache if the file hasn't changed since it was written.
+    The file's size and mtime are checked first, and if those differ (say, on a fresh checkout) its hash.
+    """
+    stat = os.stat(path)
+    # Named after the whole path: archive shards of different changelogs have the same file names, and the cache
+    # is shared by every checkout.
+    cache_path = os.path.join(CACHE_DIR, os.path.abspath(path).replace(os.sep, "_").replace(":", "").strip("._") + ".cache")
+    cached = read_cache(cache_path)
+
+    if cached and cached[1:3] == (stat.st_size, stat.st_mtime_ns):
+        return cached_entries(cached[4])
+
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).digest()
+
+    if cached and cached[3] == digest:
+        rows = cached[4]
+    else:
+        # Plain tuples, which marshal can store.
+        rows = tuple((e.id, e.author, e.time, e.url, tuple((c.type, c.message) for c in e.changes)) for e in parse_entries(data))
+
+    write_cache(cache_path, (CACHE_VERSION, stat.st_size, stat.st_mtime_ns, digest, rows))
+    return cached_entries(rows)
+
+
+def cached_entries(rows: tuple) -> tuple[ChangelogEntry, ...]:
+    return tuple(ChangelogEntry(id, author, time, url, tuple(Change(*change) for change in changes))
+                 for id, author, time, url, changes in rows)
+
+
+def read_cache(path: str):
+    """(version, size, mtime, hash, entry rows) from the cache, or None if there's no usable one."""
+    try:
+        with open(path, "rb") as f:
+            cached = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    if not isinstance(cached, tuple) or len(cached) != 5 or cached[0] != CACHE_VERSION:
+        return None
+    return cached
+
+
+def write_cache(path: str, cached: tuple):
+    # Only ever a speedup, not being able to write it is fine.
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            marshal.dump(cached, f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"Couldn't write changelog cache {path}: {e}")
+
+
+def archive_dir(path: str) -> str:
+    """The archive directory of a changelog."""
+    return os.path.join(os.path.dirname(path), ARCHIVE_DIR)
+
+
+def read_archive_index(path: str) -> dict:
+    """
+    The archive index of the changelogs next to path: {changelog name: [shard, ...]}, each shard a dict of its
+    file (relative to the archive directory), first_id, last_id, first_time, last_time and count.
+    """
+    index_path = os.path.join(archive_dir(path), ARCHIVE_INDEX)
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_entries_since(path: str, since_id: int) -> tuple[ChangelogEntry, ...]:
+    """
+    The entries after since_id, from the changelog and only those archive shards that have any, in ID order.
+    """
+    entries = [entry for entry in load_entries(path) if entry.id > since_id]
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    for shard in read_archive_index(path).get(name, []):
+        if shard["last_id"] > since_id:
+            entries += [entry for entry in load_entries(os.path.join(archive_dir(path), shard["file"])) if entry.id > since_id]
+
+    return tuple(sorted(entries, key=lambda entry: entry.id))
@@ -4,439 +4,525 @@
 # Intended to service GDPR data requests or what have you.
 
 import argparse
+import contextlib
+import datetime
+import functools
+import hashlib
+import io
+import json
 import os
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from uuid import UUID
+from user_data_lib import ADMIN_LOG_PAGE_INDEX, USER_TABLES, UserTable, admin_log_page_query, analyze_step, check_schema, dump_query, explain_analyze, write_analysis
 
-LATEST_DB_MIGRATION = "20230725193102_AdminNotesImprovementsForeignKeys"
+# How many rows a server-side cursor fetches per round-trip.
+FETCH_SIZE = 500
+
+# Default number of admin_log rows per keyset page.
+ADMIN_LOG_PAGE_SIZE = 10000
+
+# Tables bigger than this get spooled to disk rather than memory before going into a tar archive.
+SPOOL_SIZE = 64 * 1024 * 1024
+
+# Tables up to this size are buffered in memory and added to a zip archive whole, so they don't wait on each other.
+ZIP_BUFFER_SIZE = 16 * 1024 * 1024
+
+ARCHIVE_FORMATS = {"zip": ".zip", "tar.zst": ".tar.zst"}
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("output", help="Directory to output data dumps into.")
-    parser.add_argument("user", help="User name/ID to dump data into.")
+    parser.add_argument("output", help="Directory to output data dumps into, or the archive file with --archive.")
+    parser.add_argument("users", nargs="*", help="User names/IDs to dump data of. With more than one, each gets a subdirectory named after their user ID.")
+    parser.add_argument("--users-file", help="File with more user names/IDs to dump, one per line.")
     parser.add_argument("--ignore-schema-mismatch", action="store_true")
+    parser.add_argument("--ignore-case", action="store_true", help="Match user names case-insensitively. Create an index on lower(last_seen_user_name) for this to be fast on a big player table.")
+    parser.add_argument("--jobs", type=int, default=4, help="Number of tables to dump at once, each over its own connection.")
+    parser.add_argument("--admin-log-page-size", type=int, default=ADMIN_LOG_PAGE_SIZE, help="Number of admin_log rows to fetch per query.")
+    parser.add_argument("--admin-log-format", choices=["json", "ndjson"], default="json", help="Write admin_log as a JSON array or as newline delimited JSON.")
+    parser.add_argument("--resume", action="store_true", help="Continue interrupted admin_log exports from their last checkpoint.")
+    parser.add_argument("--archive", choices=ARCHIVE_FORMATS.keys(), help="Write everything into a single compressed archive instead of a directory.")
+    parser.add_argument("--analyze", metavar="REPORT", help="Also run every query under EXPLAIN (ANALYZE, BUFFERS) and write timings, row counts, sizes and index suggestions to this JSON file.")
     parser.add_argument("--connection-string", required=True, help="Database connection string to use. See https://www.postgresql.org/docs/current/libpq-connect.html#LIBPQ-CONNSTRING")
 
     args = parser.parse_args()
 
     arg_output: str = args.output
+    users = list(args.users)
 
-    if not os.path.exists(arg_output):
-        print("Creating output directory (doesn't exist yet)")
-        os.mkdir(arg_output)
-
-    conn = psycopg2.connect(args.connection_string)
-    cur = conn.cursor()
-
-    check_schema_version(cur, args.ignore_schema_mismatch)
-    user_id = normalize_user_id(cur, args.user)
-
-    dump_admin(cur, user_id, arg_output)
-    dump_admin_log(cur, user_id, arg_output)
-    dump_admin_messages(cur, user_id, arg_output)
-    dump_admin_notes(cur, user_id, arg_output)
-    dump_admin_watchlists(cur, user_id, arg_output)
-    dump_connection_log(cur, user_id, arg_output)
-    dump_play_time(cur, user_id, arg_output)
-    dump_player(cur, user_id, arg_output)
-    dump_preference(cur, user_id, arg_output)
-    dump_server_ban(cur, user_id, arg_output)
-    dump_server_ban_exemption(cur, user_id, arg_output)
-    dump_server_role_ban(cur, user_id, arg_output)
-    dump_uploaded_resource_log(cur, user_id, arg_output)
-    dump_whitelist(cur, user_id, arg_output)
-
-
-def check_schema_version(cur: "psycopg2.cursor", ignore_mismatch: bool):
-    cur.execute('SELECT "MigrationId" FROM "__EFMigrationsHistory" ORDER BY "__EFMigrationsHistory" DESC LIMIT 1')
-    schema_version = cur.fetchone()
-    if schema_version == None:
-        print("Unable to read database schema version.")
-        exit(1)
-
-    if schema_version[0] != LATEST_DB_MIGRATION:
-        print(f"Unsupport schema version of DB: '{schema_version[0]}'. Supported: {LATEST_DB_MIGRATION}")
-        if ignore_mismatch:
-            return
-        exit(1)
-
-
-def normalize_user_id(cur: "psycopg2.cursor", name_or_uid: str) -> str:
-    try:
-        return str(UUID(name_or_uid))
-    except ValueError:
-        # Must be a name, get UUID from DB.
-        pass
-
-    cur.execute("SELECT user_id FROM player WHERE last_seen_user_name = %s ORDER BY last_seen_time DESC LIMIT 1", (name_or_uid,))
-    row = cur.fetchone()
-    if row == None:
-        print(f"Unable to find user '{name_or_uid}' in DB.")
-        exit(1)
-
-    print(f"Found user ID: {row[0]}")
-    return row[0]
+    if args.users_file:
+        users += read_users_file(args.users_file)
 
+    if not users:
+        parser.error("no users given")
 
-def dump_admin(cur: "psycopg2.cursor", user_id: str, outdir: str):
-    print("Dumping admin...")
+    if args.archive and args.resume:
+        parser.error("--resume only works when dumping into a directory")
 
-    # #>> '{}' is to turn it into a string.
+    if args.archive:
+        if not arg_output.endswith(ARCHIVE_FORMATS[args.archive]):
+            arg_output += ARCHIVE_FORMATS[args.archive]
+        print(f"Writing archive {arg_output}")
+        output = ArchiveOutput(arg_output, args.archive)
+    else:
+        if not os.path.exists(arg_output):
+            print("Creating output directory (doesn't exist yet)")
+            os.mkdir(arg_output)
+        output = DirectoryOutput(arg_output)
 
-    cur.execute("""
-SELECT
-    COALESCE(json_agg(to_jsonb(data) - 'admin_rank_id'), '[]') #>> '{}'
-FROM (
-    SELECT
-        *,
-        (SELECT to_json(rank) FROM (
-            SELECT * FROM admin_rank WHERE admin_rank.admin_rank_id = admin.admin_rank_id
-        ) rank)
-        as admin_rank,
-        (SELECT COALESCE(json_agg(to_jsonb(flagg) - 'admin_id'), '[]') FROM (
-            SELECT * FROM admin_flag WHERE admin_id = %s
-        ) flagg)
-        as admin_flags
-    FROM
-        admin
-    WHERE
-        user_id = %s
-) as data
-""", (user_id, user_id))
-
-    json_data = cur.fetchall()[0][0]
-
-    with open(os.path.join(outdir, "admin.json"), "w", encoding="utf-8") as f:
-        f.write(json_data)
-
-
-def dump_admin_log(cur: "psycopg2.cursor", user_id: str, outdir: str):
-    print("Dumping admin_log...")
-
-    cur.execute("""
-SELECT
-    COALESCE(json_agg(to_jsonb(data) - 'admin_log_id'), '[]') #>> '{}'
-FROM (
-    SELECT
-        *
-    FROM
-        admin_log_player alp
-    INNER JOIN
-        admin_log al
-    ON
-        al.admin_log_id = alp.log_id AND al.round_id = alp.round_id
-    WHERE
-        player_user_id = %s
-) as data
-""", (user_id,))
-
-    json_data = cur.fetchall()[0][0]
-
-    with open(os.path.join(outdir, "admin_log.json"), "w", encoding="utf-8") as f:
-        f.write(json_data)
-
-
-def dump_admin_notes(cur: "psycopg2.cursor", user_id: str, outdir: str):
-    print("Dumping admin_notes...")
-
-    cur.execute("""
-SELECT
-    COALESCE(json_agg(to_json(data)), '[]') #>> '{}'
-FROM (
-    SELECT
-        *
-    FROM
-        admin_notes
-    WHERE
-        player_user_id = %s
-) as data
-""", (user_id,))
+    conn = psycopg2.connect(args.connection_string)
+    conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+    cur = conn.cursor()
 
-    json_data = cur.fetchall()[0][0]
+    migration = check_schema(cur, args.ignore_schema_mismatch)
 
-    with open(os.path.join(outdir, "admin_notes.json"), "w", encoding="utf-8") as f:
-        f.write(json_data)
+    # Resolve everyone up front so a typo fails the batch before anything is written.
+    user_ids = resolve_users(cur, users, args.ignore_case)
 
+    dumps = [
+        functools.partial(dump_admin_log, page_size=args.admin_log_page_size, ndjson=args.admin_log_format == "ndjson", resume=args.resume)
+        if table.name == "admin_log" else functools.partial(dump_table, table)
+        for table in USER_TABLES
+    ]
 
-def dump_connection_log(cur: "psycopg2.cursor", user_id: str, outdir: str):
-    print("Dumping connection_log...")
+    if args.analyze:
+        # Each dump is followed by an EXPLAIN ANALYZE of its query; admin_log's is its first page.
+        dumps = [
+            functools.partial(analyze_dump, dump, table.name, admin_log_page_query(False), (args.admin_log_page_size,), sort_index=ADMIN_LOG_PAGE_INDEX)
+            if table.name == "admin_log" else functools.partial(analyze_dump, dump, table.name, dump_query(table), ())
+            for dump, table in zip(dumps, USER_TABLES)
+        ]
 
-    cur.execute("""
-SELECT
-    COALESCE(json_agg(to_jsonb(data)), '[]') #>> '{}'
-FROM (
-    SELECT
-        *,
-        (SELECT COALESCE(json_agg(to_jsonb(ban_hit)), '[]') FROM (
-            SELECT * FROM server_ban_hit WHERE connection_id = connection_log_id
-        ) ban_hit)
-        as ban_hits
-    FROM
-        connection_log
-    WHERE
-        user_id = %s
-) as data
-""", (user_id,))
-
-    json_data = cur.fetchall()[0][0]
-
-    with open(os.path.join(outdir, "connection_log.json"), "w", encoding="utf-8") as f:
-        f.write(json_data)
-
-
-def dump_play_time(cur: "psycopg2.cursor", user_id: str, outdir: str):
-    print("Dumping play_time...")
-
-    cur.execute("""
-SELECT
-    COALESCE(json_agg(to_jsonb(data)), '[]') #>> '{}'
-FROM (
-    SELECT
-        *
-    FROM
-        play_time
-    WHERE
-        player_id = %s
-) as data
-""", (user_id,))
+    tasks = []
+    for user_id in user_ids:
+        user_output = output.subdir(user_id) if len(user_ids) > 1 else output
+        tasks += [(dump, user_id, user_output) for dump in dumps]
 
-    json_data = cur.fetchall()[0][0]
+    if args.jobs > 1:
+        results = dump_parallel(conn, args.connection_string, tasks, args.jobs)
+    else:
+        results = [dump(conn, user_id, user_output) for dump, user_id, user_output in tasks]
 
-    with open(os.path.join(outdir, "play_time.json"), "w", encoding="utf-8") as f:
-        f.write(json_data)
+    conn.rollback()
+    conn.close()
 
+    info = {
+        "migration": migration,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "users": user_ids,
+    }
+    output.close(info)
 
-def dump_player(cur: "psycopg2.cursor", user_id: str, outdir: str):
-    print("Dumping player...")
+    if args.analyze:
+        write_analysis(args.analyze, results, info)
 
-    cur.execute("""
-SELECT
-    COALESCE(json_agg(to_jsonb(data)), '[]') #>> '{}'
-FROM (
-    SELECT
-        *,
-        (SELECT COALESCE(json_agg(to_jsonb(player_round_subquery) - 'players_id'), '[]') FROM (
-            SELECT * FROM player_round WHERE players_id = player_id
-        ) player_round_subquery)
-        as player_rounds
-    FROM
-        player
-    WHERE
-        user_id = %s
-) as data
-""", (user_id,))
 
-    json_data = cur.fetchall()[0][0]
+def read_users_file(path: str) -> list[str]:
+    users = []
 
-    with open(os.path.join(outdir, "player.json"), "w", encoding="utf-8") as f:
-        f.write(json_data)
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                users.append(line)
 
+    return users
 
-def dump_preference(cur: "psycopg2.cursor", user_id: str, outdir: str):
-    print("Dumping preference...")
 
-    # God have mercy on my soul.
+def dump_parallel(conn: "psycopg2.connection", connection_string: str, tasks: list, jobs: int) -> list:
+    """
+    Runs the dumps on a pool of connections. Every one of them imports the snapshot of conn's transaction,
+    so the dump is as consistent as if it had all been read by that one transaction. Returns what each dump returned.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT pg_export_snapshot()")
+    snapshot = cur.fetchone()[0]
+
+    pool = psycopg2.pool.ThreadedConnectionPool(1, jobs, connection_string)
+
+    def run(dump, user_id: str, output: "DumpOutput"):
+        worker = pool.getconn()
+        try:
+            worker.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+            with worker.cursor() as worker_cur:
+                # Has to be the first statement of the transaction.
+                worker_cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+            return dump(worker, user_id, output)
+        finally:
+            worker.rollback()
+            pool.putconn(worker)
 
-    cur.execute("""
-SELECT
-    COALESCE(json_agg(to_jsonb(data)), '[]') #>> '{}'
-FROM (
-    SELECT
-        *,
-        (SELECT json_agg(to_jsonb(profile_subq) - 'preference_id') FROM (
-            SELECT
-                *,
-                (SELECT COALESCE(json_agg(to_jsonb(job_subq) - 'profile_id'), '[]') FROM (
-                    SELECT * FROM job WHERE job.profile_id = profile.profile_id
-                ) job_subq)
-                as jobs,
-                (SELECT COALESCE(json_agg(to_jsonb(antag_subq) - 'profile_id'), '[]') FROM (
-                    SELECT * FROM antag WHERE antag.profile_id = profile.profile_id
-                ) antag_subq)
-                as antags,
-                (SELECT COALESCE(json_agg(to_jsonb(trait_subq) - 'profile_id'), '[]') FROM (
-                    SELECT * FROM trait WHERE trait.profile_id = profile.profile_id
-                ) trait_subq)
-                as traits
-            FROM
-                profile
-            WHERE
-                profile.preference_id = preference.preference_id
-        ) profile_subq)
-        as profiles
-    FROM
-        preference
-    WHERE
-        user_id = %s
-) as data
-""", (user_id,))
-
-    json_data = cur.fetchall()[0][0]
-
-    with open(os.path.join(outdir, "preference.json"), "w", encoding="utf-8") as f:
-        f.write(json_data)
-
-
-def dump_server_ban(cur: "psycopg2.cursor", user_id: str, outdir: str):
-    print("Dumping server_ban...")
-
-    cur.execute("""
-SELECT
-    COALESCE(json_agg(to_json(data)), '[]') #>> '{}'
-FROM (
-    SELECT
-        *,
-        (SELECT to_jsonb(unban_sq) - 'ban_id' FROM (
-            SELECT * FROM server_unban WHERE server_unban.ban_id = server_ban.server_ban_id
-        ) unban_sq)
-        as unban
-    FROM
-        server_ban
-    WHERE
-        player_user_id = %s
-) as data
-""", (user_id,))
-
-    json_data = cur.fetchall()[0][0]
-
-    with open(os.path.join(outdir, "server_ban.json"), "w", encoding="utf-8") as f:
-        f.write(json_data)
-
-
-def dump_server_ban_exemption(cur: "psycopg2.cursor", user_id: str, outdir: str):
-    print("Dumping server_ban_exemption...")
-
-    cur.execute("""
-SELECT
-    COALESCE(json_agg(to_json(data)), '[]') #>> '{}'
-FROM (
-    SELECT
-        *
-    FROM
-        server_ban_exemption
-    WHERE
-        user_id = %s
-) as data
-""", (user_id,))
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(run, *task) for task in tasks]
+            return [future.result() for future in futures]
+    finally:
+        pool.closeall()
+
+
+def dump_rows(conn: "psycopg2.connection", query: str, params: tuple, output: "DumpOutput", name: str) -> dict:
+    """
+    Runs a query returning one JSON document per row and writes them out as a JSON array, fetching rows in
+    batches through a server-side cursor so no table is ever held in memory whole. Returns the file's manifest record.
+    """
+    with conn.cursor(name="dump_rows") as cur:
+        cur.itersize = FETCH_SIZE
+        cur.execute(query, params)
+
+        with output.create(name) as f:
+            f.write(b"[")
+            separator = b""
+            for row in cur:
+                f.write(separator)
+                f.write(row[0].encode("utf-8"))
+                f.rows += 1
+                separator = b", \n "
+            f.write(b"]")
+
+    return f.record()
+
+
+class DumpFile:
+    """
+    A table being written out. Keeps track of its row count, size and checksum for the manifest.
+    """
+    def __init__(self, name: str, stream, size: int = 0, sha256 = None):
+        self.name = name
+        self.stream = stream
+        self.rows = 0
+        self.size = size
+        self.sha256 = sha256 or hashlib.sha256()
+
+    def write(self, data: bytes):
+        self.stream.write(data)
+        self.size += len(data)
+        self.sha256.update(data)
+
+    def record(self) -> dict:
+        return {"name": self.name, "rows": self.rows, "bytes": self.size, "sha256": self.sha256.hexdigest()}
+
+
+class DumpOutput:
+    """
+    Where dumped tables go. Collects the manifest entries of everything written through it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = []
+
+    def subdir(self, name: str) -> "DumpOutput":
+        return SubdirOutput(self, name)
+
+    def path(self, name: str):
+        """
+        Path of the file on disk, if tables are written to files that can be resumed.
+        """
+        return None
+
+    def add_record(self, record: dict):
+        with self.lock:
+            self.files.append(record)
+
+    def manifest(self, info: dict) -> bytes:
+        manifest = dict(info, files=sorted(self.files, key=lambda record: record["name"]))
+        return json.dumps(manifest, indent=4).encode("utf-8")
+
+
+class SubdirOutput(DumpOutput):
+    def __init__(self, parent: DumpOutput, prefix: str):
+        self.parent = parent
+        self.prefix = prefix
+
+    def create(self, name: str, resume_offset: int = None):
+        return self.parent.create(f"{self.prefix}/{name}", resume_offset)
+
+    def path(self, name: str):
+        return self.parent.path(f"{self.prefix}/{name}")
+
+
+class DirectoryOutput(DumpOutput):
+    def __init__(self, root: str):
+        super().__init__()
+        self.root = root
+
+    def path(self, name: str):
+        return os.path.join(self.root, *name.split("/"))
+
+    @contextlib.contextmanager
+    def create(self, name: str, resume_offset: int = None):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if resume_offset is None:
+            with open(path, "wb") as stream:
+                f = DumpFile(name, stream)
+                yield f
+        else:
+            with open(path, "r+b") as stream:
+                # Carry on after what's already there, which still has to be part of the checksum.
+                sha256 = hashlib.sha256()
+                while stream.tell() < resume_offset:
+                    sha256.update(stream.read(min(resume_offset - stream.tell(), 1 << 20)))
+                stream.truncate()
+                f = DumpFile(name, stream, resume_offset, sha256)
+                yield f
+
+        self.add_record(f.record())
+
+    def close(self, info: dict):
+        with open(os.path.join(self.root, "manifest.json"), "wb") as f:
+            f.write(self.manifest(info))
+
+
+class ArchiveOutput(DumpOutput):
+    """
+    Writes tables into a .zip or .tar.zst as they're dumped. A zip takes one entry at a time, so tables dumped
+    alongside each other go through a ZipEntryWriter: small ones are added whole when done, a big one gets the archive
+    to itself and streams in. Tar needs an entry's size before its data, so there each table is spooled
+    (in memory, or on disk past SPOOL_SIZE) and then copied in.
+    """
+    def __init__(self, path: str, archive_format: str):
+        super().__init__()
+        self.zip = None
+        self.tar = None
+        self.archive_lock = threading.Lock()
+
+        if archive_format == "zip":
+            self.zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        else:
+            self.compressed = open_zstd(path)
+            self.tar = tarfile.open(fileobj=self.compressed, mode="w|")
+
+    @contextlib.contextmanager
+    def create(self, name: str, resume_offset: int = None):
+        if self.zip:
+            stream = ZipEntryWriter(self, name)
+            try:
+                f = DumpFile(name, stream)
+                yield f
+            finally:
+                stream.close()
+        else:
+            with tempfile.SpooledTemporaryFile(SPOOL_SIZE) as stream:
+                f = DumpFile(name, stream)
+                yield f
+                stream.seek(0)
+                with self.archive_lock:
+                    self.add_entry(name, stream, f.size)
+
+        self.add_record(f.record())
+
+    def add_entry(self, name: str, stream, size: int):
+        if self.zip:
+            with self.zip.open(name, "w", force_zip64=True) as entry:
+                shutil.copyfileobj(stream, entry)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = int(datetime.datetime.now().timestamp())
+            self.tar.addfile(info, stream)
+
+    def close(self, info: dict):
+        manifest = self.manifest(info)
+        self.add_entry("manifest.json", io.BytesIO(manifest), len(manifest))
+
+        if self.zip:
+            self.zip.close()
+        else:
+            self.tar.close()
+            self.compressed.close()
+
+
+class ZipEntryWriter:
+    """
+    A table on its way into a zip. Buffered in memory up to ZIP_BUFFER_SIZE, then it waits for the archive, writes
+    out what it has and streams the rest straight into its entry, holding the archive until it's closed.
+    """
+    def __init__(self, archive: ArchiveOutput, name: str):
+        self.archive = archive
+        self.name = name
+        self.buffer = io.BytesIO()
+        self.entry = None
+
+    def write(self, data: bytes):
+        if self.entry is not None:
+            self.entry.write(data)
+            return
 
-    json_data = cur.fetchall()[0][0]
+        self.buffer.write(data)
+        if self.buffer.tell() > ZIP_BUFFER_SIZE:
+            self.archive.archive_lock.acquire()
+            self.entry = self.archive.zip.open(self.name, "w", force_zip64=True)
+            self.entry.write(self.buffer.getbuffer())
+            self.buffer = None
+
+    def close(self):
+        if self.entry is None:
+            with self.archive.archive_lock, self.archive.zip.open(self.name, "w", force_zip64=True) as entry:
+                entry.write(self.buffer.getbuffer())
+            return
 
-    with open(os.path.join(outdir, "server_ban_exemption.json"), "w", encoding="utf-8") as f:
-        f.write(json_data)
+        try:
+            self.entry.close()
+        finally:
+            self.archive.archive_lock.release()
 
 
-def dump_server_role_ban(cur: "psycopg2.cursor", user_id: str, outdir: str):
-    print("Dumping server_role_ban...")
+def open_zstd(path: str):
+    try:
+        import zstandard
+    except ImportError:
+        print("Writing .tar.zst archives needs the zstandard package (pip install zstandard).")
+        exit(1)
 
-    cur.execute("""
+    return zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+
+
+def resolve_users(cur: "psycopg2.cursor", users: list[str], ignore_case: bool) -> list[str]:
+    """
+    Resolves user names and IDs to user IDs, in order and without duplicates, looking up all names in one query.
+    A name matches the players last seen with it; if there are several, the one seen most recently wins.
+    Names that can't be found are all reported at once, before exiting.
+    """
+    user_ids = {}
+    for user in users:
+        try:
+            user_ids[user] = str(UUID(user))
+        except ValueError:
+            # Must be a name, get UUID from DB.
+            pass
+
+    names = [user for user in dict.fromkeys(users) if user not in user_ids]
+    if names:
+        match = "lower(p.last_seen_user_name) = lower(n.name)" if ignore_case else "p.last_seen_user_name = n.name"
+        cur.execute(f"""
 SELECT
-    COALESCE(json_agg(to_json(data)), '[]') #>> '{}'
-FROM (
-    SELECT
-        *,
-        (SELECT to_jsonb(role_unban_sq) - 'ban_id' FROM (
-            SELECT * FROM server_role_unban WHERE server_role_unban.ban_id = server_role_ban.server_role_ban_id
-        ) role_unban_sq)
-        as unban
-    FROM
-        server_role_ban
-    WHERE
-        player_user_id = %s
-) as data
-""", (user_id,))
-
-    json_data = cur.fetchall()[0][0]
-
-    with open(os.path.join(outdir, "server_role_ban.json"), "w", encoding="utf-8") as f:
-        f.write(json_data)
-
-
-def dump_uploaded_resource_log(cur: "psycopg2.cursor", user_id: str, outdir: str):
-    print("Dumping uploaded_resource_log...")
-
-    cur.execute("""
-SELECT
-    COALESCE(json_agg(to_json(data)), '[]') #>> '{}'
-FROM (
-    SELECT
-        *
-    FROM
-        uploaded_resource_log
-    WHERE
-        user_id = %s
-) as data
-""", (user_id,))
+    n.name, p.user_id::text, p.last_seen_user_name
+FROM
+    unnest(%s::text[]) AS n(name)
+INNER JOIN
+    player p
+ON
+    {match}
+ORDER BY
+    n.name, p.last_seen_time DESC
+""", (names,))
 
-    json_data = cur.fetchall()[0][0]
+        candidates = {}
+        for name, user_id, seen_name in cur.fetchall():
+            candidates.setdefault(name, []).append((user_id, seen_name))
 
-    with open(os.path.join(outdir, "uploaded_resource_log.json"), "w", encoding="utf-8") as f:
-        f.write(json_data)
+        for name in names:
+            found = candidates.get(name)
+            if found is None:
+                print(f"Unable to find user '{name}' in DB.")
+                continue
 
+            user_ids[name] = found[0][0]
+            print(f"Found user ID: {found[0][0]}")
+            if len(found) > 1:
+                others = ", ".join(f"{user_id} ({seen_name})" for user_id, seen_name in found[1:])
+                print(f"  '{name}' is ambiguous, picked the most recently seen {found[0][0]} ({found[0][1]}) over {others}")
 
-def dump_whitelist(cur: "psycopg2.cursor", user_id: str, outdir: str):
-    print("Dumping whitelist...")
+        if len(user_ids) < len(dict.fromkeys(users)):
+            exit(1)
 
-    cur.execute("""
-SELECT
-    COALESCE(json_agg(to_json(data)), '[]') #>> '{}'
-FROM (
-    SELECT
-        *
-    FROM
-        whitelist
-    WHERE
-        user_id = %s
-) as data
-""", (user_id,))
+    return list(dict.fromkeys(user_ids[user] for user in users))
 
-    json_data = cur.fetchall()[0][0]
 
-    with open(os.path.join(outdir, "whitelist.json"), "w", encoding="utf-8") as f:
-        f.write(json_data)
+def dump_table(table: UserTable, conn: "psycopg2.connection", user_id: str, output: "DumpOutput") -> dict:
+    print(f"Dumping {table.name}...")
 
+    return dump_rows(conn, dump_query(table), (user_id,), output, f"{table.name}.json")
 
-def dump_admin_messages(cur: "psycopg2.cursor", user_id: str, outdir: str):
-    print("Dumping admin_messages...")
 
-    cur.execute("""
-SELECT
-    COALESCE(json_agg(to_json(data)), '[]') #>> '{}'
-FROM (
-    SELECT
-        *
-    FROM
-        admin_messages
-    WHERE
-        player_user_id = %s
-) as data
-""", (user_id,))
-
-    json_data = cur.fetchall()[0][0]
-
-    with open(os.path.join(outdir, "admin_messages.json"), "w", encoding="utf-8") as f:
-        f.write(json_data)
+def dump_admin_log(conn: "psycopg2.connection", user_id: str, output: "DumpOutput", page_size: int = ADMIN_LOG_PAGE_SIZE, ndjson: bool = False, resume: bool = False) -> dict:
+    print("Dumping admin_log...")
 
+    # Veterans can have millions of log rows, so this goes in pages keyed on (round_id, log_id) instead of
+    # one big query. After every page the last key and file offset are checkpointed, to be able to resume.
 
-def dump_admin_watchlists(cur: "psycopg2.cursor", user_id: str, outdir: str):
-    print("Dumping admin_watchlists...")
+    name = "admin_log.ndjson" if ndjson else "admin_log.json"
+    path = output.path(name)
+    checkpoint_path = path + ".checkpoint" if path else None
 
-    cur.execute("""
-SELECT
-    COALESCE(json_agg(to_json(data)), '[]') #>> '{}'
-FROM (
-    SELECT
-        *
-    FROM
-        admin_watchlists
-    WHERE
-        player_user_id = %s
-) as data
-""", (user_id,))
-
-    json_data = cur.fetchall()[0][0]
-
-    with open(os.path.join(outdir, "admin_watchlists.json"), "w", encoding="utf-8") as f:
-        f.write(json_data)
+    cur = conn.cursor()
+    cur.execute("SELECT count(*) FROM admin_log_player WHERE player_user_id = %s", (user_id,))
+    total = cur.fetchone()[0]
+
+    key = None
+    offset = None
+    written = 0
+    if resume and path and os.path.exists(checkpoint_path) and os.path.exists(path):
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        key = tuple(checkpoint["key"])
+        offset = checkpoint["offset"]
+        written = checkpoint["rows"]
+        print(f"Resuming admin_log after round {key[0]}, log {key[1]} ({written} rows already written)")
+
+    with output.create(name, offset) as f:
+        f.rows = written
+        if key is None and not ndjson:
+            f.write(b"[")
+
+        while True:
+            cur.execute(admin_log_page_query(key is not None), (user_id, *(key or ()), page_size))
+
+            rows = cur.fetchall()
+            if not rows:
+                break
+
+            for row in rows:
+                if ndjson:
+                    f.write(row[0].encode("utf-8") + b"\n")
+                else:
+                    f.write((b", \n " if f.rows else b"") + row[0].encode("utf-8"))
+                f.rows += 1
+
+            key = rows[-1][1:]
+            if checkpoint_path:
+                write_checkpoint(checkpoint_path, key, f)
+            print(f"  admin_log: {f.rows}/{total} rows ({f.rows * 100 // max(total, 1)}%)")
+
+        if not ndjson:
+            f.write(b"]")
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    return f.record()
+
+
+def analyze_dump(dump, name: str, query: str, params: tuple, conn: "psycopg2.connection", user_id: str, output: "DumpOutput", sort_index: str = None) -> dict:
+    """
+    Runs a dump, then its query again under EXPLAIN ANALYZE, for the --analyze report.
+    """
+    start = time.monotonic()
+    record = dump(conn, user_id, output)
+    elapsed = time.monotonic() - start
+
+    with conn.cursor() as cur:
+        plan = explain_analyze(cur, query, (user_id, *params))
+
+    return dict(analyze_step(name, plan, sort_index), user_id=user_id, seconds=elapsed, rows_written=record["rows"], bytes=record["bytes"])
+
+
+def write_checkpoint(path: str, key: tuple, f: DumpFile):
+    f.stream.flush()
+    os.fsync(f.stream.fileno())
+
+    with open(path + ".tmp", "w", encoding="utf-8") as checkpoint:
+        json.dump({"key": list(key), "rows": f.rows, "offset": f.size}, checkpoint)
+    os.replace(path + ".tmp", path)
 
 
 main()
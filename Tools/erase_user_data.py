@@ -8,206 +8,346 @@
 # You would need to do this *before* running this script, to avoid losing the IP/HWID of the user entirely.
 
 import argparse
+import csv
+import datetime
 import os
 import psycopg2
+import psycopg2.pool
+import time
+from concurrent.futures import ThreadPoolExecutor
 from uuid import UUID
+from user_data_lib import ERASE_PROGRESS_TABLE, USER_TABLES, analyze_step, check_schema, collect_log_keys, erase_query, erase_steps, explain_analyze, load_erase_users, write_analysis
 
-LATEST_DB_MIGRATION = "20250211131539_LoadoutNames"
+# admin_log lines pseudonymized per transaction by default.
+ADMIN_LOG_CHUNK_SIZE = 5000
+
+# Seconds between progress reports.
+PROGRESS_INTERVAL = 2
 
 def main():
     parser = argparse.ArgumentParser()
     # Yes we need both to reliably pseudonymize the admin_log table.
-    parser.add_argument("user_id", help="User ID to erase data for")
-    parser.add_argument("user_name", help="User name to erase data for")
+    parser.add_argument("user_id", nargs="?", help="User ID to erase data for")
+    parser.add_argument("user_name", nargs="?", help="User name to erase data for")
+    parser.add_argument("--users-file", help="CSV file of more users to erase, as user_id,user_name lines")
+    parser.add_argument("--chunk-size", type=int, default=ADMIN_LOG_CHUNK_SIZE, help="Number of admin_log lines to pseudonymize per transaction")
+    parser.add_argument("--throttle", type=float, default=0, help="Seconds to wait between admin_log chunks, to go easy on a live server")
+    parser.add_argument("--dry-run", action="store_true", help="Only report how many rows every step would touch, and how")
+    parser.add_argument("--analyze", metavar="REPORT", help="Run every step under EXPLAIN (ANALYZE, BUFFERS) and roll it back, writing timings, row counts and index suggestions to this JSON file. Nothing is erased")
+    parser.add_argument("--jobs", type=int, default=4, help="Number of connections to count and verify with in parallel")
     parser.add_argument("--ignore-schema-mismatch", action="store_true")
     parser.add_argument("--connection-string", required=True, help="Database connection string to use. See https://www.postgresql.org/docs/current/libpq-connect.html#LIBPQ-CONNSTRING")
 
     args = parser.parse_args()
 
-    conn = psycopg2.connect(args.connection_string)
-    cur = conn.cursor()
-
-    check_schema_version(cur, args.ignore_schema_mismatch)
-    user_id = args.user_id
-    user_name = args.user_name
-
-    clear_admin(cur, user_id)
-    pseudonymize_admin_log(cur, user_name, user_id)
-    clear_assigned_user_id(cur, user_id)
-    clear_connection_log(cur, user_id)
-    clear_play_time(cur, user_id)
-    clear_player(cur, user_id)
-    clear_preference(cur, user_id)
-    clear_server_ban(cur, user_id)
-    clear_server_ban_exemption(cur, user_id)
-    clear_server_role_ban(cur, user_id)
-    clear_uploaded_resource_log(cur, user_id)
-    clear_whitelist(cur, user_id)
-    clear_blacklist(cur, user_id)
-
-    print("Committing...")
-    conn.commit()
-
-
-def check_schema_version(cur: "psycopg2.cursor", ignore_mismatch: bool):
-    cur.execute('SELECT "MigrationId" FROM "__EFMigrationsHistory" ORDER BY "__EFMigrationsHistory" DESC LIMIT 1')
-    schema_version = cur.fetchone()
-    if schema_version == None:
-        print("Unable to read database schema version.")
-        exit(1)
-
-    if schema_version[0] != LATEST_DB_MIGRATION:
-        print(f"Unsupport schema version of DB: '{schema_version[0]}'. Supported: {LATEST_DB_MIGRATION}")
-        if ignore_mismatch:
-            return
-        exit(1)
-
-
-def clear_admin(cur: "psycopg2.cursor", user_id: str):
-    print("Clearing admin...")
-
-    cur.execute("""
-DELETE FROM
-    admin
-WHERE
-    user_id = %s
-""", (user_id,))
-
-
-def pseudonymize_admin_log(cur: "psycopg2.cursor", user_name: str, user_id: str):
-    print("Pseudonymizing admin_log...")
-
-    cur.execute("""
-UPDATE
-    admin_log l
-SET
-    message = replace(message, %s, %s)
-FROM
-    admin_log_player lp
-WHERE
-    lp.round_id = l.round_id AND lp.log_id = l.admin_log_id AND player_user_id = %s;
-""", (user_name, user_id, user_id,))
-
-
-def clear_assigned_user_id(cur: "psycopg2.cursor", user_id: str):
-    print("Clearing assigned_user_id...")
-
-    cur.execute("""
-DELETE FROM
-    assigned_user_id
-WHERE
-    user_id = %s
-""", (user_id,))
-
+    users = {}
+    if args.user_id or args.user_name:
+        if not (args.user_id and args.user_name):
+            parser.error("both user_id and user_name are needed")
+        users[normalize_user_id(parser, args.user_id)] = args.user_name
 
-def clear_connection_log(cur: "psycopg2.cursor", user_id: str):
-    print("Clearing connection_log...")
+    if args.users_file:
+        for user_id, user_name in read_users_file(parser, args.users_file):
+            users[user_id] = user_name
 
-    cur.execute("""
-DELETE FROM
-    connection_log
-WHERE
-    user_id = %s
-""", (user_id,))
-
-
-def clear_play_time(cur: "psycopg2.cursor", user_id: str):
-    print("Clearing play_time...")
-
-    cur.execute("""
-DELETE FROM
-    play_time
-WHERE
-    player_id = %s
-""", (user_id,))
-
-
-def clear_player(cur: "psycopg2.cursor", user_id: str):
-    print("Clearing player...")
-
-    cur.execute("""
-DELETE FROM
-    player
-WHERE
-    user_id = %s
-""", (user_id,))
+    if not users:
+        parser.error("no users given")
 
+    conn = psycopg2.connect(args.connection_string)
+    cur = conn.cursor()
 
-def clear_preference(cur: "psycopg2.cursor", user_id: str):
-    print("Clearing preference...")
+    migration = check_schema(cur, args.ignore_schema_mismatch)
 
-    cur.execute("""
-DELETE FROM
-    preference
-WHERE
-    user_id = %s
-""", (user_id,))
+    # Every mode works off these, so --dry-run and --analyze look at the very statements an erasure runs.
+    load_erase_users(cur, users)
+    collect_log_keys(cur)
+    conn.commit()
 
+    if args.analyze:
+        analyze_erasure(conn, users, args.analyze, args.chunk_size, migration)
+        return
 
-def clear_server_ban(cur: "psycopg2.cursor", user_id: str):
-    print("Clearing server_ban...")
+    if args.dry_run:
+        report_impact(conn, args.connection_string, users, args.chunk_size, args.jobs)
+        return
 
-    cur.execute("""
-DELETE FROM
-    server_ban
-WHERE
-    player_user_id = %s
-""", (user_id,))
+    print(f"Erasing {len(users)} user(s)...")
 
+    pseudonymize_admin_log(conn, args.chunk_size, args.throttle)
+    clear_tables(cur)
 
-def clear_server_ban_exemption(cur: "psycopg2.cursor", user_id: str):
-    print("Clearing server_ban_exemption...")
+    # Done with these users, their progress can go along with the rest.
+    cur.execute(f"DELETE FROM {ERASE_PROGRESS_TABLE} p USING erase_users e WHERE p.user_id = e.user_id")
 
-    cur.execute("""
-DELETE FROM
-    server_ban_exemption
-WHERE
-    user_id = %s
-""", (user_id,))
+    print("Committing...")
+    conn.commit()
 
+    if not verify_erasure(conn, args.connection_string, users, args.jobs):
+        exit(1)
 
-def clear_server_role_ban(cur: "psycopg2.cursor", user_id: str):
-    print("Clearing server_role_ban...")
 
-    cur.execute("""
-DELETE FROM
-    server_role_ban
-WHERE
-    player_user_id = %s
-""", (user_id,))
+def normalize_user_id(parser: argparse.ArgumentParser, user_id: str) -> str:
+    try:
+        return str(UUID(user_id))
+    except ValueError:
+        parser.error(f"'{user_id}' is not a user ID")
 
 
-def clear_uploaded_resource_log(cur: "psycopg2.cursor", user_id: str):
-    print("Clearing uploaded_resource_log...")
+def read_users_file(parser: argparse.ArgumentParser, path: str) -> list:
+    users = []
 
-    cur.execute("""
-DELETE FROM
-    uploaded_resource_log
-WHERE
-    user_id = %s
-""", (user_id,))
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith("#"):
+                continue
+            if len(row) != 2:
+                parser.error(f"{path}: expected user_id,user_name but got {','.join(row)}")
+            users.append((normalize_user_id(parser, row[0].strip()), row[1].strip()))
 
+    return users
 
-def clear_whitelist(cur: "psycopg2.cursor", user_id: str):
-    print("Clearing whitelist...")
 
-    cur.execute("""
-DELETE FROM
-    whitelist
-WHERE
-    user_id = %s
-""", (user_id,))
-
-def clear_blacklist(cur: "psycopg2.cursor", user_id: str):
-    print("Clearing blacklist...")
+def pseudonymize_admin_log(conn: "psycopg2.connection", chunk_size: int, throttle: float):
+    """
+    Replaces the users' names with their IDs in admin_log, in chunks of log lines committed one at a time so no
+    locks are held for long on a live server. How far along each user is gets committed with each chunk into
+    ERASE_PROGRESS_TABLE, so an interrupted run picks up where it stopped. Nothing else is deleted until this is done.
+    """
+    print("Pseudonymizing admin_log...")
+    cur = conn.cursor()
 
-    cur.execute("""
-DELETE FROM
-    blacklist
+    cur.execute(f"""
+CREATE TABLE IF NOT EXISTS {ERASE_PROGRESS_TABLE} (
+    user_id uuid PRIMARY KEY,
+    round_id integer NOT NULL,
+    log_id integer NOT NULL
+)
+""")
+
+    cur.execute(f"""
+SELECT
+    count(*)
+FROM
+    erase_log_keys k
+LEFT JOIN
+    {ERASE_PROGRESS_TABLE} p
+ON
+    p.user_id = k.user_id
 WHERE
-    user_id = %s
-""", (user_id,))
+    p.user_id IS NULL OR (k.round_id, k.log_id) > (p.round_id, p.log_id)
+""")
+    total = cur.fetchone()[0]
+    cur.execute(f"SELECT e.user_id, e.user_name, p.round_id, p.log_id FROM erase_users e LEFT JOIN {ERASE_PROGRESS_TABLE} p ON p.user_id = e.user_id")
+    users = cur.fetchall()
+    conn.commit()
 
+    if total == 0:
+        return
+
+    print(f"  {total} log lines to go")
+    chunk_query = next(statement for name, _, statement in erase_steps() if name == "admin_log")
+    updated = 0
+    start = time.monotonic()
+    last_report = start
+
+    for user_id, user_name, round_id, log_id in users:
+        if round_id is not None:
+            print(f"  Resuming {user_id} after round {round_id}, log {log_id}")
+        key = (round_id if round_id is not None else -1, log_id if log_id is not None else -1)
+
+        while True:
+            cur.execute(chunk_query, {"user_id": user_id, "user_name": user_name, "round_id": key[0], "log_id": key[1], "chunk_size": chunk_size})
+
+            row = cur.fetchone()
+            if row is None:
+                break
+
+            key = row[:2]
+            cur.execute(f"""
+INSERT INTO {ERASE_PROGRESS_TABLE} (user_id, round_id, log_id) VALUES (%s, %s, %s)
+ON CONFLICT (user_id) DO UPDATE SET round_id = excluded.round_id, log_id = excluded.log_id
+""", (user_id, *key))
+            conn.commit()
+
+            updated += row[2]
+            now = time.monotonic()
+            if now - last_report >= PROGRESS_INTERVAL:
+                print(f"  {updated}/{total} log lines, {updated / (now - start):.0f} rows/s")
+                last_report = now
+
+            if throttle:
+                time.sleep(throttle)
+
+    elapsed = time.monotonic() - start
+    print(f"  {updated} log lines in {elapsed:.1f}s, {updated / max(elapsed, 0.001):.0f} rows/s")
+
+
+def clear_tables(cur: "psycopg2.cursor"):
+    tables = [table for table in USER_TABLES if table.erase == "delete" and not table.custom]
+    for table in tables:
+        print(f"Clearing {table.name}...")
+
+    # All in one go, it's one round-trip.
+    cur.execute(erase_query())
+
+
+
+def run_parallel(conn: "psycopg2.connection", connection_string: str, jobs: int, queries: list, users: dict) -> list:
+    """
+    Runs read-only queries, given as (query, parameters, whether to run it on conn). Returns (first row, seconds
+    taken) of each, in order. Queries on conn can use its erase_log_keys, the rest go over a small pool of
+    connections that each load the users into an erase_users of their own first.
+    """
+    pool = psycopg2.pool.ThreadedConnectionPool(1, jobs, connection_string)
+    loaded = set()
+
+    def execute(worker: "psycopg2.connection", query: str, params):
+        start = time.monotonic()
+        with worker.cursor() as cur:
+            cur.execute(query, params)
+            row = cur.fetchone()
+        return row, time.monotonic() - start
+
+    def run(query: str, params):
+        worker = pool.getconn()
+        try:
+            if id(worker) not in loaded:
+                with worker.cursor() as cur:
+                    load_erase_users(cur, users)
+                worker.commit()
+                worker.set_session(readonly=True)
+                loaded.add(id(worker))
+            return execute(worker, query, params)
+        finally:
+            worker.rollback()
+            pool.putconn(worker)
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [None if own else executor.submit(run, query, params) for query, params, own in queries]
+            results = [execute(conn, query, params) if own else future.result()
+                       for (query, params, own), future in zip(queries, futures)]
+            conn.rollback()
+            return results
+    finally:
+        pool.closeall()
+
+
+def chunk_params(conn: "psycopg2.connection", chunk_size: int) -> dict:
+    """
+    Parameters of the first admin_log chunk of the user with the most log lines, the one --dry-run and --analyze
+    look at.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+SELECT
+    e.user_id, e.user_name
+FROM
+    erase_users e
+LEFT JOIN
+    erase_log_keys k
+ON
+    k.user_id = e.user_id
+GROUP BY
+    e.user_id, e.user_name
+ORDER BY
+    count(k.user_id) DESC
+LIMIT 1
+""")
+        user_id, user_name = cur.fetchone()
+    conn.rollback()
+
+    return {"user_id": user_id, "user_name": user_name, "round_id": -1, "log_id": -1, "chunk_size": chunk_size}
+
+
+def plan_summary(plan: dict) -> str:
+    """
+    The scans an EXPLAIN (FORMAT JSON) plan does, e.g. "Index Scan on connection_log, Seq Scan on admin_log".
+    """
+    scans = []
+
+    def walk(node):
+        if "Scan" in node["Node Type"] and "Relation Name" in node:
+            scans.append(f"{node['Node Type']} on {node['Relation Name']}")
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan)
+    return ", ".join(scans)
+
+
+def report_impact(conn: "psycopg2.connection", connection_string: str, users: dict, chunk_size: int, jobs: int):
+    """
+    Counts the rows every step would touch and explains its statement, admin_log's being its first chunk.
+    """
+    print("Dry run, nothing will be changed.")
+
+    steps = erase_steps()
+    params = chunk_params(conn, chunk_size)
+    queries = []
+    for name, count, statement in steps:
+        own = name == "admin_log"
+        queries += [(count, None, own), (f"EXPLAIN (FORMAT JSON) {statement}", params if own else None, own)]
+
+    start = time.monotonic()
+    results = run_parallel(conn, connection_string, jobs, queries, users)
+    elapsed = time.monotonic() - start
+
+    print(f"{'Step':<24}{'Rows':>10}{'Cost':>12}{'Time':>9}  Scans")
+    total = 0
+    for i, (name, _, _) in enumerate(steps):
+        (count,), count_time = results[2 * i]
+        (plan,), _ = results[2 * i + 1]
+        total += count
+        plan = plan[0]["Plan"]
+        print(f"{name:<24}{count:>10}{plan['Total Cost']:>12.0f}{count_time:>8.2f}s  {plan_summary(plan)}")
+
+    print(f"{total} rows over {len(steps)} steps, counted in {elapsed:.2f}s. Rows in child tables go with their parents.")
+    print(f"admin_log is explained as one chunk of {chunk_size} lines of {params['user_id']}.")
+
+
+def analyze_erasure(conn: "psycopg2.connection", users: dict, path: str, chunk_size: int, migration: str):
+    """
+    Runs each step for real under EXPLAIN ANALYZE, each in a transaction of its own that's rolled back, so every
+    step is measured against the untouched tables. admin_log is measured as the first chunk of the user with the
+    most log lines.
+    """
+    print("Analyzing, nothing will be changed.")
+
+    params = chunk_params(conn, chunk_size)
+    steps = []
+    for name, _, statement in erase_steps():
+        print(f"Analyzing {name}...")
+        with conn.cursor() as cur:
+            plan = explain_analyze(cur, statement, params)
+        conn.rollback()
+        steps.append(analyze_step(name, plan))
+
+    write_analysis(path, steps, {
+        "migration": migration,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "users": list(users.keys()),
+        "chunk": params,
+    })
+
+
+def verify_erasure(conn: "psycopg2.connection", connection_string: str, users: dict, jobs: int) -> bool:
+    """
+    Counts what's left of the users. admin_log is checked on conn, against the log keys collected before anything
+    was deleted.
+    """
+    print("Verifying...")
+
+    steps = erase_steps()
+    results = run_parallel(conn, connection_string, jobs, [(count, None, name == "admin_log") for name, count, _ in steps], users)
+
+    remaining = [(name, count) for (name, _, _), ((count,), _) in zip(steps, results) if count]
+    for name, count in remaining:
+        print(f"{name}: {count} rows still there!")
+
+    if not remaining:
+        print("Nothing left.")
+    return not remaining
 
 main()
 
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+# Bulk export of log tables from an SS14 postgres database, for investigations and offline analysis.
+# Rows are streamed straight out of COPY into the output file, so this runs at disk speed in constant memory.
+
+import argparse
+import importlib.util
+import os
+import psycopg2
+import psycopg2.extensions
+import threading
+import time
+from dataclasses import dataclass
+from uuid import UUID
+
+# Bytes read from COPY per write.
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Seconds between progress reports.
+PROGRESS_INTERVAL = 2
+
+# Types other than text that are worth keeping in Parquet, by PostgreSQL type OID.
+PARQUET_TYPES = {16: "bool", 20: "int64", 21: "int16", 23: "int32", 700: "float32", 701: "float64", 1184: "timestamp"}
+
+@dataclass(frozen=True)
+class ExportTable:
+    name: str
+    # Columns the filters apply to, None if the table can't be filtered that way.
+    time: str = None
+    round: str = None
+    # Condition matching the rows of the users given as the user_ids parameter.
+    users: str = None
+
+
+EXPORT_TABLES = {table.name: table for table in [
+    ExportTable("admin_log", time="date", round="round_id", users="""EXISTS (
+    SELECT 1 FROM admin_log_player alp
+    WHERE alp.round_id = t.round_id AND alp.log_id = t.admin_log_id AND alp.player_user_id = ANY(%(user_ids)s::uuid[]))"""),
+    ExportTable("admin_log_player", round="round_id", users="player_user_id = ANY(%(user_ids)s::uuid[])"),
+    ExportTable("connection_log", time="time", users="user_id = ANY(%(user_ids)s::uuid[])"),
+    ExportTable("play_time", users="player_id = ANY(%(user_ids)s::uuid[])"),
+]}
+
+FORMATS = {"csv": ".csv", "ndjson": ".ndjson", "parquet": ".parquet"}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("table", choices=EXPORT_TABLES.keys(), help="Table to export")
+    parser.add_argument("output", help="File to write the export to")
+    parser.add_argument("--format", choices=FORMATS.keys(), help="Output format, guessed from the output file's extension by default")
+    parser.add_argument("--round-from", type=int, help="First round to export")
+    parser.add_argument("--round-to", type=int, help="Last round to export")
+    parser.add_argument("--since", help="Export rows from this time on, e.g. 2025-01-31 or '2025-01-31 18:00+01'")
+    parser.add_argument("--until", help="Export rows from before this time")
+    parser.add_argument("--users", nargs="+", default=[], help="Only export rows about these user IDs")
+    parser.add_argument("--users-file", help="File with more user IDs to filter on, one per line")
+    parser.add_argument("--connection-string", required=True, help="Database connection string to use. See https://www.postgresql.org/docs/current/libpq-connect.html#LIBPQ-CONNSTRING")
+
+    args = parser.parse_args()
+
+    table = EXPORT_TABLES[args.table]
+    export_format = args.format or next((name for name, extension in FORMATS.items() if args.output.endswith(extension)), None)
+    if export_format is None:
+        parser.error("can't tell the format from the output file name, pass --format")
+
+    users = list(args.users)
+    if args.users_file:
+        users += read_users_file(args.users_file)
+
+    conditions = []
+    params = {}
+    for value, kind, column, condition in [
+        (args.round_from, "round", table.round, "{0} >= %(round_from)s"),
+        (args.round_to, "round", table.round, "{0} <= %(round_to)s"),
+        (args.since, "time", table.time, "{0} >= %(since)s::timestamptz"),
+        (args.until, "time", table.time, "{0} < %(until)s::timestamptz"),
+    ]:
+        if value is None:
+            continue
+        if column is None:
+            parser.error(f"{table.name} can't be filtered by {kind}")
+        conditions.append(condition.format(column))
+
+    if users:
+        if table.users is None:
+            parser.error(f"{table.name} can't be filtered by user")
+        conditions.append(table.users)
+        params["user_ids"] = [normalize_user_id(parser, user) for user in users]
+
+    params.update(round_from=args.round_from, round_to=args.round_to, since=args.since, until=args.until)
+
+    conn = psycopg2.connect(args.connection_string)
+    conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+    cur = conn.cursor()
+    # Timestamps come out the same wherever this is run.
+    cur.execute("SET TIME ZONE 'UTC'")
+
+    columns = table_columns(cur, table.name)
+    query = cur.mogrify(select_query(table.name, columns, conditions), params).decode("utf-8")
+
+    print(f"Exporting {table.name} to {args.output}...")
+    start = time.monotonic()
+
+    if export_format == "parquet":
+        size = export_parquet(cur, query, columns, args.output)
+    else:
+        with open(args.output, "wb") as f:
+            progress = ProgressFile(f)
+            cur.copy_expert(copy_statement(query, export_format), progress, COPY_BUFFER_SIZE)
+            size = progress.size
+
+    elapsed = time.monotonic() - start
+    print(f"  {size / 1024 / 1024:.1f} MiB in {elapsed:.1f}s")
+
+    conn.rollback()
+    conn.close()
+
+
+def read_users_file(path: str) -> list[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def normalize_user_id(parser: argparse.ArgumentParser, user_id: str) -> str:
+    try:
+        return str(UUID(user_id))
+    except ValueError:
+        parser.error(f"'{user_id}' is not a user ID")
+
+
+def table_columns(cur: "psycopg2.cursor", table: str) -> list:
+    """
+    (name, type OID) of every column of the table.
+    """
+    cur.execute(f"SELECT * FROM {table} LIMIT 0")
+    return [(column.name, column.type_code) for column in cur.description]
+
+
+def select_query(table: str, columns: list, conditions: list) -> str:
+    """
+    SELECT of the rows to export. Left unordered, sorting would cost more than the export itself.
+    Timestamps come out as is, with their +00 offset, which pyarrow's CSV reader parses for Parquet too.
+    """
+    select = ", ".join(f'"{name}"' for name, _ in columns)
+    where = "\nWHERE\n    " + "\n    AND ".join(conditions) if conditions else ""
+    return f"SELECT\n    {select}\nFROM\n    {table} t{where}"
+
+
+def copy_statement(query: str, export_format: str) -> str:
+    if export_format == "ndjson":
+        # row_to_json escapes every control character, so with these as quote and delimiter CSV mode never
+        # quotes anything and the JSON comes out as is (text mode would escape its backslashes).
+        return f"COPY (SELECT row_to_json(r) FROM ({query}) r) TO STDOUT WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"
+
+    return f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)"
+
+
+class ProgressFile:
+    """
+    Passes COPY output on to a file, reporting how much went through every now and then.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+        self.start = time.monotonic()
+        self.last_report = self.start
+
+    def write(self, data: bytes):
+        self.stream.write(data)
+        self.size += len(data)
+
+        now = time.monotonic()
+        if now - self.last_report >= PROGRESS_INTERVAL:
+            print(f"  {self.size / 1024 / 1024:.0f} MiB, {self.size / 1024 / 1024 / (now - self.start):.0f} MiB/s")
+            self.last_report = now
+
+
+def export_parquet(cur: "psycopg2.cursor", query: str, columns: list, path: str) -> int:
+    """
+    Streams COPY's CSV through a pipe from another thread into write_parquet, so only a batch is held in memory at
+    a time. Returns the bytes read from COPY.
+    """
+    if importlib.util.find_spec("pyarrow") is None:
+        print("Writing Parquet needs the pyarrow package (pip install pyarrow).")
+        exit(1)
+
+    read_fd, write_fd = os.pipe()
+    # Bytes copied, or what went wrong.
+    result = []
+
+    def copy():
+        try:
+            with open(write_fd, "wb") as pipe:
+                progress = ProgressFile(pipe)
+                cur.copy_expert(copy_statement(query, "csv"), progress, COPY_BUFFER_SIZE)
+            result.append(progress.size)
+        except Exception as e:
+            result.append(e)
+
+    thread = threading.Thread(target=copy)
+    thread.start()
+
+    try:
+        with open(read_fd, "rb") as pipe:
+            write_parquet(pipe, columns, path)
+    finally:
+        # With the reading end closed, a COPY stuck writing into the pipe fails instead of blocking forever.
+        thread.join()
+
+    if isinstance(result[0], Exception):
+        raise result[0]
+
+    return result[0]
+
+
+def write_parquet(stream, columns: list, path: str):
+    """
+    Reads COPY's CSV from a stream with pyarrow's CSV reader, and writes each batch it reads as a Parquet row group.
+    """
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+
+    types = {
+        name: pyarrow.timestamp("us", tz="UTC") if PARQUET_TYPES.get(type_code) == "timestamp" else pyarrow.type_for_alias(PARQUET_TYPES.get(type_code, "string"))
+        for name, type_code in columns
+    }
+    convert_options = pyarrow.csv.ConvertOptions(
+        column_types=types,
+        true_values=["t"],
+        false_values=["f"],
+        # COPY writes NULL as an empty field and an empty string as "".
+        strings_can_be_null=True,
+        quoted_strings_can_be_null=False,
+    )
+
+    reader = pyarrow.csv.open_csv(stream, convert_options=convert_options)
+    with pyarrow.parquet.ParquetWriter(path, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+
+
+if __name__ == "__main__":
+    main()
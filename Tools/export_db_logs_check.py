@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# Round-trip check for export_db_logs.py's Parquet output.
+# Writes rows the way COPY does, timestamptz with its +00 offset included, through the same CSV reader and Parquet
+# writer as an export, and checks every value reads back the same. With --connection-string the rows go into a temp
+# table first and come out of a real COPY instead.
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+import pyarrow.parquet
+import export_db_logs
+
+# (name, PostgreSQL type, type OID) of the checked columns, a timestamptz one among them.
+COLUMNS = [("round_id", "integer", 23), ("impact", "smallint", 21), ("date", "timestamp with time zone", 1184), ("message", "text", 25)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Check Parquet exports read back the values that went in.")
+    parser.add_argument("--rows", type=int, default=1000, help="Number of rows to check")
+    parser.add_argument("--connection-string", help="Round-trip through a temp table on this database instead of generated COPY output")
+
+    args = parser.parse_args()
+
+    rows = generate_rows(args.rows)
+    columns = [(name, type_code) for name, _, type_code in COLUMNS]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "export.parquet")
+
+        if args.connection_string:
+            export_from_database(args.connection_string, rows, columns, path)
+        else:
+            export_db_logs.write_parquet(io.BytesIO(copy_csv(rows)), columns, path)
+
+        table = pyarrow.parquet.read_table(path)
+        print(f"{table.num_rows} rows, schema: {', '.join(f'{field.name} {field.type}' for field in table.schema)}")
+        actual = [tuple(row.values()) for row in table.to_pylist()]
+
+    mismatched = [(expected, got) for expected, got in zip(rows, actual) if expected != got]
+    if len(actual) != len(rows):
+        print(f"Read back {len(actual)} rows, expected {len(rows)}.")
+        sys.exit(1)
+    if mismatched:
+        for expected, got in mismatched[:10]:
+            print(f"expected {expected}, got {got}")
+        print(f"{len(mismatched)} rows mismatched.")
+        sys.exit(1)
+
+    print("All rows read back the same.")
+
+
+def generate_rows(count: int) -> list:
+    """
+    Rows with timestamps of every fractional second precision COPY prints, some of them NULL, and messages that need quoting.
+    """
+    start = datetime(2025, 1, 31, 18, 0, tzinfo=timezone.utc)
+    rows = []
+    for i in range(count):
+        date = start + timedelta(seconds=i * 37, microseconds=(i * 123457) % 1000000 // 10 ** (i % 7) * 10 ** (i % 7))
+        message = ["", "plain", 'quoted "name", with a comma', "line\nbreak", None][i % 5]
+        rows.append((i, i % 3 - 1, None if i % 11 == 10 else date, message))
+    return rows
+
+
+def copy_csv(rows: list) -> bytes:
+    """
+    The rows as COPY ... WITH (FORMAT csv, HEADER) writes them with the time zone set to UTC.
+    """
+    lines = [",".join(name for name, _, _ in COLUMNS)]
+    for round_id, impact, date, message in rows:
+        fields = [str(round_id), str(impact), copy_timestamp(date) if date else ""]
+        fields.append("" if message is None else '"' + message.replace('"', '""') + '"')
+        lines.append(",".join(fields))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def copy_timestamp(date: datetime) -> str:
+    # Fractional seconds without trailing zeros, and none at all when whole.
+    text = date.strftime("%Y-%m-%d %H:%M:%S")
+    if date.microsecond:
+        text += f".{date.microsecond:06d}".rstrip("0")
+    return text + "+00"
+
+
+def export_from_database(connection_string: str, rows: list, columns: list, path: str):
+    import psycopg2
+
+    conn = psycopg2.connect(connection_string)
+    cur = conn.cursor()
+    cur.execute("SET TIME ZONE 'UTC'")
+    cur.execute(f"CREATE TEMP TABLE export_check ({', '.join(f'{name} {sql_type}' for name, sql_type, _ in COLUMNS)}, row_order serial)")
+    cur.executemany(f"INSERT INTO export_check ({', '.join(name for name, _, _ in COLUMNS)}) VALUES (%s, %s, %s, %s)", rows)
+
+    # Ordered here so the rows can be compared one by one, the export itself leaves them unordered.
+    query = export_db_logs.select_query("export_check", columns, []) + "\nORDER BY\n    row_order"
+    export_db_logs.export_parquet(cur, query, columns, path)
+    conn.rollback()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
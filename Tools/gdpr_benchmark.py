@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+
+# Benchmark for dump_user_data.py and erase_user_data.py.
+# Spins up a throwaway PostgreSQL (initdb in a temp directory), creates the tables those scripts touch, fills them
+# with synthetic data at a configurable scale, then times every dump and erase step and records its query plan.
+# Compare the JSON report against an earlier one with --baseline to catch SQL regressions before they hit a live server.
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import psycopg2
+from user_data_lib import ADMIN_LOG_PAGE_INDEX, LATEST_DB_MIGRATION, USER_TABLES, admin_log_page_query, analyze_step, collect_log_keys, dump_query, erase_steps, explain_analyze, load_erase_users
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The tables and primary keys of the user data tables, as EF Core creates them.
+# Indexes and foreign keys come after the data is in, like a restore would.
+SCHEMA = """
+CREATE TABLE "__EFMigrationsHistory" ("MigrationId" character varying(150) PRIMARY KEY, "ProductVersion" character varying(32) NOT NULL);
+CREATE TABLE server (server_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, name text NOT NULL);
+CREATE TABLE round (round_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, server_id integer NOT NULL, start_date timestamp with time zone);
+CREATE TABLE player (
+    player_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, user_id uuid NOT NULL, first_seen_time timestamp with time zone NOT NULL,
+    last_seen_user_name text NOT NULL, last_seen_time timestamp with time zone NOT NULL, last_seen_address inet NOT NULL,
+    last_read_rules timestamp with time zone, last_seen_hwid bytea, last_seen_hwid_type integer);
+CREATE TABLE player_round (players_id integer NOT NULL, rounds_id integer NOT NULL, PRIMARY KEY (players_id, rounds_id));
+CREATE TABLE admin_rank (admin_rank_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, name text NOT NULL);
+CREATE TABLE admin (user_id uuid PRIMARY KEY, admin_rank_id integer, title text, deadminned boolean NOT NULL DEFAULT false, suspended boolean NOT NULL DEFAULT false);
+CREATE TABLE admin_flag (admin_flag_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, flag text NOT NULL, negative boolean NOT NULL, admin_id uuid NOT NULL);
+CREATE TABLE admin_log (
+    round_id integer NOT NULL, admin_log_id integer NOT NULL, type integer NOT NULL, impact smallint NOT NULL,
+    date timestamp with time zone NOT NULL, message text NOT NULL, json jsonb NOT NULL, PRIMARY KEY (round_id, admin_log_id));
+CREATE TABLE admin_log_player (round_id integer NOT NULL, log_id integer NOT NULL, player_user_id uuid NOT NULL, PRIMARY KEY (round_id, log_id, player_user_id));
+CREATE TABLE admin_messages (
+    admin_messages_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, round_id integer, player_user_id uuid, playtime_at_note interval NOT NULL,
+    expiration_time timestamp with time zone, message character varying(4096) NOT NULL, created_by_id uuid, created_at timestamp with time zone NOT NULL,
+    last_edited_by_id uuid, last_edited_at timestamp with time zone, deleted boolean NOT NULL, deleted_by_id uuid, deleted_at timestamp with time zone,
+    seen boolean NOT NULL, dismissed boolean NOT NULL);
+CREATE TABLE admin_notes (
+    admin_notes_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, round_id integer, player_user_id uuid, playtime_at_note interval NOT NULL,
+    expiration_time timestamp with time zone, message character varying(4096) NOT NULL, severity integer NOT NULL, secret boolean NOT NULL,
+    created_by_id uuid, created_at timestamp with time zone NOT NULL, last_edited_by_id uuid, last_edited_at timestamp with time zone,
+    deleted boolean NOT NULL, deleted_by_id uuid, deleted_at timestamp with time zone);
+CREATE TABLE admin_watchlists (
+    admin_watchlists_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, round_id integer, player_user_id uuid, playtime_at_note interval NOT NULL,
+    expiration_time timestamp with time zone, message character varying(4096) NOT NULL, created_by_id uuid, created_at timestamp with time zone NOT NULL,
+    last_edited_by_id uuid, last_edited_at timestamp with time zone, deleted boolean NOT NULL, deleted_by_id uuid, deleted_at timestamp with time zone);
+CREATE TABLE assigned_user_id (assigned_user_id_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, user_name text NOT NULL, user_id uuid NOT NULL);
+CREATE TABLE blacklist (user_id uuid PRIMARY KEY);
+CREATE TABLE whitelist (user_id uuid PRIMARY KEY);
+CREATE TABLE role_whitelists (player_user_id uuid NOT NULL, role_id text NOT NULL, PRIMARY KEY (player_user_id, role_id));
+CREATE TABLE connection_log (
+    connection_log_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, user_id uuid NOT NULL, user_name text NOT NULL,
+    time timestamp with time zone NOT NULL, address inet NOT NULL, hwid bytea, hwid_type integer, denied smallint, server_id integer NOT NULL, trust real NOT NULL);
+CREATE TABLE server_ban (
+    server_ban_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, round_id integer, player_user_id uuid, playtime_at_note interval NOT NULL,
+    address inet, hwid bytea, hwid_type integer, ban_time timestamp with time zone NOT NULL, expiration_time timestamp with time zone,
+    reason text NOT NULL, severity integer NOT NULL, banning_admin uuid, last_edited_by_id uuid, last_edited_at timestamp with time zone,
+    exempt_flags integer NOT NULL, auto_delete boolean NOT NULL, hidden boolean NOT NULL);
+CREATE TABLE server_unban (unban_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, ban_id integer NOT NULL, unbanning_admin uuid, unban_time timestamp with time zone NOT NULL);
+CREATE TABLE server_ban_hit (server_ban_hit_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, ban_id integer NOT NULL, connection_id integer NOT NULL);
+CREATE TABLE server_ban_exemption (user_id uuid PRIMARY KEY, flags integer NOT NULL);
+CREATE TABLE server_role_ban (
+    server_role_ban_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, round_id integer, player_user_id uuid, playtime_at_note interval NOT NULL,
+    address inet, hwid bytea, hwid_type integer, ban_time timestamp with time zone NOT NULL, expiration_time timestamp with time zone,
+    reason text NOT NULL, severity integer NOT NULL, banning_admin uuid, last_edited_by_id uuid, last_edited_at timestamp with time zone,
+    hidden boolean NOT NULL, role_id text NOT NULL);
+CREATE TABLE server_role_unban (role_unban_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, ban_id integer NOT NULL, unbanning_admin uuid, unban_time timestamp with time zone NOT NULL);
+CREATE TABLE play_time (play_time_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, player_id uuid NOT NULL, tracker text NOT NULL, time_spent interval NOT NULL);
+CREATE TABLE preference (preference_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, user_id uuid NOT NULL, selected_character_slot integer NOT NULL, admin_ooc_color text NOT NULL);
+CREATE TABLE profile (
+    profile_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, slot integer NOT NULL, char_name text NOT NULL, flavor_text text NOT NULL,
+    age integer NOT NULL, sex text NOT NULL, gender text NOT NULL, species text NOT NULL, markings jsonb, preference_id integer NOT NULL);
+CREATE TABLE job (job_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, profile_id integer NOT NULL, job_name text NOT NULL, priority integer NOT NULL);
+CREATE TABLE antag (antag_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, profile_id integer NOT NULL, antag_name text NOT NULL);
+CREATE TABLE trait (trait_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, profile_id integer NOT NULL, trait_name text NOT NULL);
+CREATE TABLE uploaded_resource_log (uploaded_resource_log_id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, date timestamp with time zone NOT NULL, user_id uuid NOT NULL, path text NOT NULL, data bytea NOT NULL);
+"""
+
+# (name, DDL) of the secondary indexes and foreign keys, as in the current migration.
+# Indexes can be left out with --drop-index to see what a step costs without them.
+CONSTRAINTS = [
+    ("IX_player_user_id", 'CREATE UNIQUE INDEX "IX_player_user_id" ON player (user_id)'),
+    ("IX_player_last_seen_user_name", 'CREATE INDEX "IX_player_last_seen_user_name" ON player (last_seen_user_name)'),
+    ("IX_player_round_rounds_id", 'CREATE INDEX "IX_player_round_rounds_id" ON player_round (rounds_id)'),
+    ("IX_admin_admin_rank_id", 'CREATE INDEX "IX_admin_admin_rank_id" ON admin (admin_rank_id)'),
+    ("IX_admin_flag_admin_id", 'CREATE INDEX "IX_admin_flag_admin_id" ON admin_flag (admin_id)'),
+    ("IX_admin_log_date", 'CREATE INDEX "IX_admin_log_date" ON admin_log (date)'),
+    ("IX_admin_log_type", 'CREATE INDEX "IX_admin_log_type" ON admin_log (type)'),
+    ("IX_admin_log_player_player_user_id", 'CREATE INDEX "IX_admin_log_player_player_user_id" ON admin_log_player (player_user_id)'),
+    ("IX_admin_messages_player_user_id", 'CREATE INDEX "IX_admin_messages_player_user_id" ON admin_messages (player_user_id)'),
+    ("IX_admin_notes_player_user_id", 'CREATE INDEX "IX_admin_notes_player_user_id" ON admin_notes (player_user_id)'),
+    ("IX_admin_watchlists_player_user_id", 'CREATE INDEX "IX_admin_watchlists_player_user_id" ON admin_watchlists (player_user_id)'),
+    ("IX_assigned_user_id_user_id", 'CREATE UNIQUE INDEX "IX_assigned_user_id_user_id" ON assigned_user_id (user_id)'),
+    ("IX_assigned_user_id_user_name", 'CREATE UNIQUE INDEX "IX_assigned_user_id_user_name" ON assigned_user_id (user_name)'),
+    ("IX_connection_log_user_id", 'CREATE INDEX "IX_connection_log_user_id" ON connection_log (user_id)'),
+    ("IX_connection_log_time", 'CREATE INDEX "IX_connection_log_time" ON connection_log (time)'),
+    ("IX_server_ban_player_user_id", 'CREATE INDEX "IX_server_ban_player_user_id" ON server_ban (player_user_id)'),
+    ("IX_server_ban_hit_ban_id", 'CREATE INDEX "IX_server_ban_hit_ban_id" ON server_ban_hit (ban_id)'),
+    ("IX_server_ban_hit_connection_id", 'CREATE INDEX "IX_server_ban_hit_connection_id" ON server_ban_hit (connection_id)'),
+    ("IX_server_unban_ban_id", 'CREATE UNIQUE INDEX "IX_server_unban_ban_id" ON server_unban (ban_id)'),
+    ("IX_server_role_ban_player_user_id", 'CREATE INDEX "IX_server_role_ban_player_user_id" ON server_role_ban (player_user_id)'),
+    ("IX_server_role_unban_ban_id", 'CREATE UNIQUE INDEX "IX_server_role_unban_ban_id" ON server_role_unban (ban_id)'),
+    ("IX_play_time_player_id_tracker", 'CREATE UNIQUE INDEX "IX_play_time_player_id_tracker" ON play_time (player_id, tracker)'),
+    ("IX_preference_user_id", 'CREATE UNIQUE INDEX "IX_preference_user_id" ON preference (user_id)'),
+    ("IX_profile_preference_id", 'CREATE INDEX "IX_profile_preference_id" ON profile (preference_id)'),
+    ("IX_job_profile_id", 'CREATE INDEX "IX_job_profile_id" ON job (profile_id)'),
+    ("IX_antag_profile_id_antag_name", 'CREATE UNIQUE INDEX "IX_antag_profile_id_antag_name" ON antag (profile_id, antag_name)'),
+    ("IX_trait_profile_id_trait_name", 'CREATE UNIQUE INDEX "IX_trait_profile_id_trait_name" ON trait (profile_id, trait_name)'),
+    ("FK_player_round_player_players_id", "ALTER TABLE player_round ADD FOREIGN KEY (players_id) REFERENCES player ON DELETE CASCADE"),
+    ("FK_player_round_round_rounds_id", "ALTER TABLE player_round ADD FOREIGN KEY (rounds_id) REFERENCES round ON DELETE CASCADE"),
+    ("FK_admin_flag_admin_admin_id", "ALTER TABLE admin_flag ADD FOREIGN KEY (admin_id) REFERENCES admin ON DELETE CASCADE"),
+    ("FK_admin_log_round_round_id", "ALTER TABLE admin_log ADD FOREIGN KEY (round_id) REFERENCES round ON DELETE CASCADE"),
+    ("FK_admin_log_player_player_player_user_id", "ALTER TABLE admin_log_player ADD FOREIGN KEY (player_user_id) REFERENCES player (user_id) ON DELETE CASCADE"),
+    ("FK_admin_log_player_admin_log_round_id_log_id", "ALTER TABLE admin_log_player ADD FOREIGN KEY (round_id, log_id) REFERENCES admin_log ON DELETE CASCADE"),
+    ("FK_admin_messages_player_player_user_id", "ALTER TABLE admin_messages ADD FOREIGN KEY (player_user_id) REFERENCES player (user_id) ON DELETE CASCADE"),
+    ("FK_admin_notes_player_player_user_id", "ALTER TABLE admin_notes ADD FOREIGN KEY (player_user_id) REFERENCES player (user_id) ON DELETE CASCADE"),
+    ("FK_admin_watchlists_player_player_user_id", "ALTER TABLE admin_watchlists ADD FOREIGN KEY (player_user_id) REFERENCES player (user_id) ON DELETE CASCADE"),
+    ("FK_role_whitelists_player_player_user_id", "ALTER TABLE role_whitelists ADD FOREIGN KEY (player_user_id) REFERENCES player (user_id) ON DELETE CASCADE"),
+    ("FK_server_ban_hit_server_ban_ban_id", "ALTER TABLE server_ban_hit ADD FOREIGN KEY (ban_id) REFERENCES server_ban ON DELETE CASCADE"),
+    ("FK_server_ban_hit_connection_log_connection_id", "ALTER TABLE server_ban_hit ADD FOREIGN KEY (connection_id) REFERENCES connection_log ON DELETE CASCADE"),
+    ("FK_server_unban_server_ban_ban_id", "ALTER TABLE server_unban ADD FOREIGN KEY (ban_id) REFERENCES server_ban ON DELETE CASCADE"),
+    ("FK_server_role_unban_server_role_ban_ban_id", "ALTER TABLE server_role_unban ADD FOREIGN KEY (ban_id) REFERENCES server_role_ban ON DELETE CASCADE"),
+    ("FK_profile_preference_preference_id", "ALTER TABLE profile ADD FOREIGN KEY (preference_id) REFERENCES preference ON DELETE CASCADE"),
+    ("FK_job_profile_profile_id", "ALTER TABLE job ADD FOREIGN KEY (profile_id) REFERENCES profile ON DELETE CASCADE"),
+    ("FK_antag_profile_profile_id", "ALTER TABLE antag ADD FOREIGN KEY (profile_id) REFERENCES profile ON DELETE CASCADE"),
+    ("FK_trait_profile_profile_id", "ALTER TABLE trait ADD FOREIGN KEY (profile_id) REFERENCES profile ON DELETE CASCADE"),
+]
+
+# Player n's user ID and name.
+USER_ID = "md5('bench-player-' || {0})::uuid"
+USER_NAME = "'Player' || {0}"
+
+# Everything except admin_log, one statement per table, for players p = 1..{players}.
+PLAYER_DATA = [
+    "INSERT INTO server (name) VALUES ('bench')",
+    "INSERT INTO round (server_id, start_date) SELECT 1, now() - r * interval '1 hour' FROM generate_series(1, {rounds}) r",
+    f"""INSERT INTO player (user_id, first_seen_time, last_seen_user_name, last_seen_time, last_seen_address)
+SELECT {USER_ID.format("p")}, now() - interval '1 year', {USER_NAME.format("p")}, now(), '10.0.0.1' FROM generate_series(1, {{players}}) p""",
+    """INSERT INTO player_round (players_id, rounds_id)
+SELECT DISTINCT p, 1 + (p * 31 + k * 997) % {rounds} FROM generate_series(1, {players}) p, generate_series(1, 5) k""",
+    f"""INSERT INTO assigned_user_id (user_name, user_id)
+SELECT {USER_NAME.format("p")}, {USER_ID.format("p")} FROM generate_series(1, {{players}}) p""",
+    f"""INSERT INTO connection_log (user_id, user_name, time, address, server_id, trust)
+SELECT {USER_ID.format("p")}, {USER_NAME.format("p")}, now() - k * interval '1 day', '10.0.0.1', 1, 0.5
+FROM generate_series(1, {{players}}) p, generate_series(1, {{connections}}) k""",
+    f"""INSERT INTO play_time (player_id, tracker, time_spent)
+SELECT {USER_ID.format("p")}, tracker, interval '10 hours' FROM generate_series(1, {{players}}) p, unnest(ARRAY['Overall', 'JobPassenger']) tracker""",
+    f"""INSERT INTO preference (user_id, selected_character_slot, admin_ooc_color)
+SELECT {USER_ID.format("p")}, 0, '#ff0000' FROM generate_series(1, {{players}}) p""",
+    """INSERT INTO profile (slot, char_name, flavor_text, age, sex, gender, species, preference_id)
+SELECT 0, 'Character ' || p, '', 30, 'Male', 'Male', 'Human', p FROM generate_series(1, {players}) p""",
+    """INSERT INTO job (profile_id, job_name, priority)
+SELECT p, job_name, priority FROM generate_series(1, {players}) p, (VALUES ('Passenger', 3), ('Chef', 1)) jobs(job_name, priority)""",
+    "INSERT INTO antag (profile_id, antag_name) SELECT p, 'Traitor' FROM generate_series(1, {players}) p",
+    "INSERT INTO trait (profile_id, trait_name) SELECT p, 'Pacifist' FROM generate_series(1, {players}) p",
+    f"INSERT INTO whitelist (user_id) SELECT {USER_ID.format('p')} FROM generate_series(10, {{players}}, 10) p",
+    f"INSERT INTO blacklist (user_id) SELECT {USER_ID.format('p')} FROM generate_series(1000, {{players}}, 1000) p",
+    f"INSERT INTO role_whitelists (player_user_id, role_id) SELECT {USER_ID.format('p')}, 'Captain' FROM generate_series(20, {{players}}, 20) p",
+    f"INSERT INTO server_ban_exemption (user_id, flags) SELECT {USER_ID.format('p')}, 1 FROM generate_series(200, {{players}}, 200) p",
+    "INSERT INTO admin_rank (name) VALUES ('Game Admin')",
+    f"INSERT INTO admin (user_id, admin_rank_id, title) SELECT {USER_ID.format('p')}, 1, 'Admin' FROM generate_series(1, {{players}}, 1000) p",
+    "INSERT INTO admin_flag (flag, negative, admin_id) SELECT flag, false, user_id FROM admin, unnest(ARRAY['ADMIN', 'BAN']) flag",
+    *(f"""INSERT INTO {table} (round_id, player_user_id, playtime_at_note, message, created_by_id, created_at, deleted{extra_columns})
+SELECT 1, {USER_ID.format("p")}, interval '5 hours', 'Note about ' || {USER_NAME.format("p")}, {USER_ID.format(1)}, now(), false{extra_values}
+FROM generate_series(100, {{players}}, 100) p"""
+      for table, extra_columns, extra_values in [
+          ("admin_notes", ", severity, secret", ", 1, false"),
+          ("admin_messages", ", seen, dismissed", ", false, false"),
+          ("admin_watchlists", "", ""),
+      ]),
+    f"""INSERT INTO server_ban (round_id, player_user_id, playtime_at_note, address, ban_time, reason, severity, banning_admin, exempt_flags, auto_delete, hidden)
+SELECT 1, {USER_ID.format("p")}, interval '5 hours', '10.0.0.1', now(), 'Griefing', 2, {USER_ID.format(1)}, 0, false, false
+FROM generate_series(100, {{players}}, 100) p""",
+    "INSERT INTO server_unban (ban_id, unban_time) SELECT server_ban_id, now() FROM server_ban WHERE server_ban_id % 2 = 0",
+    """INSERT INTO server_ban_hit (ban_id, connection_id)
+SELECT b.server_ban_id, c.connection_log_id
+FROM server_ban b
+INNER JOIN (SELECT DISTINCT ON (user_id) user_id, connection_log_id FROM connection_log ORDER BY user_id, connection_log_id) c
+ON c.user_id = b.player_user_id""",
+    f"""INSERT INTO server_role_ban (round_id, player_user_id, playtime_at_note, ban_time, reason, severity, banning_admin, hidden, role_id)
+SELECT 1, {USER_ID.format("p")}, interval '5 hours', now(), 'Bad at the job', 1, {USER_ID.format(1)}, false, 'Captain'
+FROM generate_series(50, {{players}}, 100) p""",
+    "INSERT INTO server_role_unban (ban_id, unban_time) SELECT server_role_ban_id, now() FROM server_role_ban WHERE server_role_ban_id % 2 = 0",
+    f"""INSERT INTO uploaded_resource_log (date, user_id, path, data)
+SELECT now(), {USER_ID.format("p")}, '/Uploaded/bench.ogg', '\\x00' FROM generate_series(1000, {{players}}, 1000) p""",
+]
+
+# One batch of admin_log lines {start}..{end}, each about a player picked with a power law, so a few players
+# have most of the logs like veterans do.
+ADMIN_LOG_DATA = f"""
+WITH logs AS MATERIALIZED (
+    SELECT
+        i / {{per_round}} + 1 AS round_id,
+        i % {{per_round}} + 1 AS log_id,
+        1 + floor({{players}} * power(random(), {{skew}}))::integer AS p
+    FROM
+        generate_series({{start}}, {{end}} - 1) i
+), inserted AS (
+    INSERT INTO admin_log (round_id, admin_log_id, type, impact, date, message, json)
+    SELECT round_id, log_id, 0, 0, now(), {USER_NAME.format("p")} || ' used the Fire Extinguisher', '{{{{}}}}' FROM logs
+)
+INSERT INTO admin_log_player (round_id, log_id, player_user_id)
+SELECT round_id, log_id, {USER_ID.format("p")} FROM logs
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the GDPR scripts against a throwaway local PostgreSQL.")
+    parser.add_argument("--players", type=int, default=10000, help="Number of players to generate")
+    parser.add_argument("--rounds", type=int, default=1000, help="Number of rounds to generate")
+    parser.add_argument("--admin-logs", type=int, default=1000000, help="Number of admin_log lines to generate")
+    parser.add_argument("--connections", type=int, default=10, help="connection_log entries per player")
+    parser.add_argument("--skew", type=float, default=3.0, help="How much admin_log lines pile up on a few players, 1 for evenly")
+    parser.add_argument("--batch-size", type=int, default=1000000, help="admin_log lines to generate per statement")
+    parser.add_argument("--sample", type=int, default=3, help="Number of users to dump and erase, the ones with the most logs")
+    parser.add_argument("--page-size", type=int, default=10000, help="admin_log page size to explain")
+    parser.add_argument("--drop-index", action="append", default=[], help="Leave out an index, by name. Can be repeated")
+    parser.add_argument("--page-index", action="store_true", help="Also create the admin_log paging index the game's schema doesn't have")
+    parser.add_argument("--no-erase", action="store_true", help="Don't run erase_user_data.py at the end")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="--chunk-size to explain and run erase_user_data.py with")
+    parser.add_argument("--jobs", type=int, default=4, help="--jobs to run dump_user_data.py with")
+    parser.add_argument("--pg-bin", help="Directory with initdb and pg_ctl, if not on the PATH")
+    parser.add_argument("--keep", action="store_true", help="Leave the database directory behind")
+    parser.add_argument("--report", default="gdpr_benchmark.json", help="File to write the JSON report to")
+    parser.add_argument("--baseline", help="Earlier report to compare step timings against")
+    parser.add_argument("--tolerance", type=float, default=2.0, help="Fail if a step got more than this many times slower than the baseline")
+
+    args = parser.parse_args()
+
+    unknown = set(args.drop_index) - {name for name, _ in CONSTRAINTS}
+    if unknown:
+        parser.error(f"unknown index: {', '.join(sorted(unknown))}")
+
+    pg_bin = find_pg_bin(args.pg_bin)
+    if pg_bin is None:
+        parser.error("can't find initdb and pg_ctl, pass --pg-bin")
+
+    with LocalPostgres(pg_bin, args.keep) as connection_string:
+        conn = psycopg2.connect(connection_string)
+        conn.autocommit = True
+        cur = conn.cursor()
+
+        print("Creating schema...")
+        cur.execute(SCHEMA)
+        cur.execute('INSERT INTO "__EFMigrationsHistory" VALUES (%s, %s)', (LATEST_DB_MIGRATION, "9.0.0"))
+
+        timed("Generating players", lambda: generate_players(cur, args))
+        timed("Generating admin_log", lambda: generate_admin_log(cur, args))
+        timed("Creating indexes and foreign keys", lambda: create_constraints(cur, args.drop_index, args.page_index))
+        timed("Analyzing", lambda: cur.execute("VACUUM ANALYZE"))
+
+        users = sample_users(cur, args.sample)
+        conn.autocommit = False
+
+        report = {
+            "scale": {
+                "players": args.players,
+                "rounds": args.rounds,
+                "admin_logs": args.admin_logs,
+                "connections": args.connections,
+                "skew": args.skew,
+                "dropped_indexes": args.drop_index,
+                "page_index": args.page_index,
+            },
+            "users": [{"user_id": user_id, "admin_logs": logs} for user_id, _, logs in users],
+            "steps": explain_dump_steps(conn, users[0][0], args.page_size) + explain_erase_steps(conn, users, args.chunk_size),
+        }
+        conn.close()
+
+        print_steps(report["steps"])
+
+        report["runs"] = run_tools(connection_string, users, args)
+
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"Report written to {args.report}")
+
+    if args.baseline and not compare_baseline(report, args.baseline, args.tolerance):
+        exit(1)
+
+
+def find_pg_bin(pg_bin: str):
+    candidates = [pg_bin] if pg_bin else []
+    if shutil.which("initdb"):
+        candidates.append(os.path.dirname(shutil.which("initdb")))
+    if shutil.which("pg_config"):
+        candidates.append(subprocess.run(["pg_config", "--bindir"], capture_output=True, text=True).stdout.strip())
+    candidates += sorted(glob.glob("/usr/lib/postgresql/*/bin"), reverse=True)
+
+    for candidate in candidates:
+        if os.path.exists(os.path.join(candidate, "initdb")) and os.path.exists(os.path.join(candidate, "pg_ctl")):
+            return candidate
+
+    return None
+
+
+class LocalPostgres:
+    """
+    A PostgreSQL server in a temp directory, only reachable through a Unix socket in there, with durability
+    turned off since it's thrown away anyway. Yields the connection string.
+    """
+    def __init__(self, pg_bin: str, keep: bool):
+        self.pg_bin = pg_bin
+        self.keep = keep
+
+    def __enter__(self) -> str:
+        self.dir = tempfile.mkdtemp(prefix="ss14-gdpr-")
+        self.data = os.path.join(self.dir, "data")
+
+        print(f"Starting PostgreSQL in {self.dir}...")
+        subprocess.run([os.path.join(self.pg_bin, "initdb"), "-D", self.data, "-U", "postgres", "-A", "trust", "-E", "UTF8", "--no-locale"],
+                       check=True, stdout=subprocess.DEVNULL)
+
+        options = f"-k {self.dir} -c listen_addresses='' -c fsync=off -c synchronous_commit=off -c full_page_writes=off"
+        subprocess.run([os.path.join(self.pg_bin, "pg_ctl"), "-D", self.data, "-o", options, "-l", os.path.join(self.dir, "postgres.log"), "-w", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+
+        return f"host={self.dir} dbname=postgres user=postgres"
+
+    def __exit__(self, *exc):
+        subprocess.run([os.path.join(self.pg_bin, "pg_ctl"), "-D", self.data, "-m", "fast", "-w", "stop"], stdout=subprocess.DEVNULL)
+
+        if self.keep:
+            print(f"Kept database in {self.data}")
+        else:
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def timed(label: str, action):
+    print(f"{label}...")
+    start = time.monotonic()
+    action()
+    print(f"  {time.monotonic() - start:.1f}s")
+
+
+def generate_players(cur: "psycopg2.cursor", args):
+    for statement in PLAYER_DATA:
+        cur.execute(statement.format(players=args.players, rounds=args.rounds, connections=args.connections))
+
+
+def generate_admin_log(cur: "psycopg2.cursor", args):
+    per_round = -(-args.admin_logs // args.rounds)
+    cur.execute("SELECT setseed(0.14)")
+
+    for start in range(0, args.admin_logs, args.batch_size):
+        end = min(start + args.batch_size, args.admin_logs)
+        cur.execute(ADMIN_LOG_DATA.format(start=start, end=end, per_round=per_round, players=args.players, skew=args.skew))
+        print(f"  {end}/{args.admin_logs}")
+
+
+def create_constraints(cur: "psycopg2.cursor", dropped: list, page_index: bool):
+    for name, ddl in CONSTRAINTS:
+        if name in dropped:
+            print(f"  Leaving out {name}")
+            continue
+        cur.execute(ddl)
+
+    if page_index:
+        cur.execute(ADMIN_LOG_PAGE_INDEX)
+
+
+def sample_users(cur: "psycopg2.cursor", count: int) -> list:
+    """
+    (user ID, name, admin_log lines) of the users with the most admin_log lines, the worst case for both scripts.
+    """
+    cur.execute("""
+SELECT
+    p.user_id::text, p.last_seen_user_name, logs.count
+FROM (
+    SELECT player_user_id, count(*) FROM admin_log_player GROUP BY player_user_id ORDER BY count(*) DESC LIMIT %s
+) logs
+INNER JOIN
+    player p
+ON
+    p.user_id = logs.player_user_id
+ORDER BY
+    logs.count DESC
+""", (count,))
+    return cur.fetchall()
+
+
+def explain(conn: "psycopg2.connection", tool: str, step: str, query: str, params, sort_index: str = None) -> dict:
+    """
+    Runs a step under EXPLAIN (ANALYZE, BUFFERS) and rolls it back, so erase steps can be measured one by one.
+    """
+    with conn.cursor() as cur:
+        plan = explain_analyze(cur, query, params)
+    conn.rollback()
+
+    return dict(analyze_step(step, plan, sort_index), tool=tool)
+
+
+def explain_dump_steps(conn: "psycopg2.connection", user_id: str, page_size: int) -> list:
+    print(f"Explaining dump steps for {user_id}...")
+    steps = []
+
+    for table in USER_TABLES:
+        if table.name == "admin_log":
+            steps.append(explain(conn, "dump", "admin_log (first page)", admin_log_page_query(False), (user_id, page_size), ADMIN_LOG_PAGE_INDEX))
+        else:
+            steps.append(explain(conn, "dump", table.name, dump_query(table), (user_id,)))
+
+    return steps
+
+
+def explain_erase_steps(conn: "psycopg2.connection", users: list, chunk_size: int) -> list:
+    print("Explaining erase steps...")
+    with conn.cursor() as cur:
+        load_erase_users(cur, {user_id: name for user_id, name, _ in users})
+        collect_log_keys(cur)
+    conn.commit()
+
+    # admin_log as the first chunk of the user with the most log lines, like erase_user_data.py --analyze.
+    user_id, user_name, _ = users[0]
+    params = {"user_id": user_id, "user_name": user_name, "round_id": -1, "log_id": -1, "chunk_size": chunk_size}
+
+    return [explain(conn, "erase", name, statement, params) for name, _, statement in erase_steps()]
+
+
+def print_steps(steps: list):
+    print(f"{'Tool':<7}{'Step':<28}{'Rows':>10}{'ms':>11}  Seq scans")
+    for step in steps:
+        print(f"{step['tool']:<7}{step['step']:<28}{step['rows']:>10}{step['ms']:>11.1f}  {', '.join(scan['table'] for scan in step['seq_scans'])}")
+
+
+def run_tools(connection_string: str, users: list, args) -> dict:
+    """
+    Runs the actual scripts end to end on the sample users, erasing them last.
+    """
+    runs = {}
+
+    with tempfile.TemporaryDirectory(prefix="ss14-gdpr-dump-") as outdir:
+        user_ids = [user_id for user_id, _, _ in users]
+        runs["dump"] = run_tool("dump_user_data.py", [outdir, *user_ids, "--jobs", str(args.jobs)], connection_string)
+
+        if not args.no_erase:
+            users_file = os.path.join(outdir, "users.csv")
+            with open(users_file, "w", encoding="utf-8") as f:
+                f.writelines(f"{user_id},{name}\n" for user_id, name, _ in users)
+            runs["erase"] = run_tool("erase_user_data.py", ["--users-file", users_file, "--chunk-size", str(args.chunk_size)], connection_string)
+
+    return runs
+
+
+def run_tool(script: str, arguments: list, connection_string: str) -> float:
+    print(f"Running {script}...")
+    start = time.monotonic()
+    result = subprocess.run([sys.executable, os.path.join(TOOLS_DIR, script), *arguments, "--connection-string", connection_string],
+                            capture_output=True, text=True)
+    elapsed = time.monotonic() - start
+
+    if result.returncode != 0:
+        print(result.stdout + result.stderr)
+        raise RuntimeError(f"{script} failed")
+
+    print(f"  {elapsed:.1f}s")
+    return elapsed
+
+
+def compare_baseline(report: dict, baseline_path: str, tolerance: float) -> bool:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(step["tool"], step["step"]): step for step in json.load(f)["steps"]}
+
+    passed = True
+    print(f"Compared to {baseline_path}:")
+    for step in report["steps"]:
+        old = baseline.get((step["tool"], step["step"]))
+        if old is None:
+            continue
+
+        ratio = step["ms"] / max(old["ms"], 0.001)
+        # Sub-millisecond steps are all noise.
+        regressed = ratio > tolerance and step["ms"] - old["ms"] > 1
+        passed &= not regressed
+        print(f"  {step['tool']:<7}{step['step']:<28}{old['ms']:>11.1f} -> {step['ms']:>9.1f} ms{'  REGRESSED' if regressed else ''}")
+
+    return passed
+
+
+if __name__ == "__main__":
+    main()
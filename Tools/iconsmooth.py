@@ -20,67 +20,130 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import argparse
+import json
+import os
 import PIL
 import PIL.Image
-import sys
+import numpy
 import iconsmooth_lib
 
-if len(sys.argv) != 5:
-    print("iconsmooth.py in.png METRICS <" + iconsmooth_lib.all_conv + "> OUTPREFIX")
-    print("OUTPREFIX is something like, say, " + iconsmooth_lib.explain_prefix)
-    print(iconsmooth_lib.explain_mm)
-    raise Exception("see printed help")
+def delay_list(value):
+    try:
+        return [float(delay) for delay in value.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' isn't a comma-separated list of seconds")
+
+parser = argparse.ArgumentParser(
+    description="Converts a smoothing atlas into icon smoothing RSI states.",
+    epilog=iconsmooth_lib.explain_mm + iconsmooth_lib.explain_modes,
+    formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("inputs", nargs="+", metavar="in.png", help="source atlas; give several to use one sheet per animation frame")
+parser.add_argument("metrics", metavar="METRICS", help="tile metrics, see below")
+parser.add_argument("mode", choices=list(iconsmooth_lib.conversion_modes), metavar="<" + iconsmooth_lib.all_conv + ">", help="conversion mode")
+parser.add_argument("out_prefix", metavar="OUTPREFIX", help="something like, say, " + iconsmooth_lib.explain_prefix)
+parser.add_argument("--frames", type=int, default=1, help="split each input into this many animation frames, stacked top to bottom")
+parser.add_argument("--delays", type=delay_list, default="0.1", help="animation frame delays in seconds, comma-separated; one for every frame or one per frame (default: %(default)s)")
+parser.add_argument("--compress-level", type=int, choices=range(10), default=9, metavar="0-9", help="zlib compression level for written PNGs (default: %(default)s)")
+parser.add_argument("--palette", action="store_true", help="write states with at most 256 colors as indexed PNGs (lossless)")
+parser.add_argument("--keep-metadata", action="store_true", help="copy text metadata from the first input into every state instead of stripping it")
+parser.add_argument("--report", action="store_true", help="print how many bytes each state saves compared to default PNG encoding")
+parser.add_argument("--no-cache", action="store_true", help="always regenerate, don't read or write the output cache")
+parser.add_argument("--cache-dir", default=iconsmooth_lib.default_cache_dir(), help="output cache location (default: %(default)s)")
+parser.add_argument("--cache-size", type=int, default=256, help="output cache size limit in MiB (default: %(default)s)")
+parser.add_argument("--cache-link", action="store_true", help="hardlink cached outputs instead of copying them")
+
+args = parser.parse_args()
+
+def load_frames(paths, frames_per_sheet):
+    frames = []
+    for path in paths:
+        sheet = numpy.asarray(PIL.Image.open(path).convert("RGBA"))
+        if sheet.shape[0] % frames_per_sheet != 0:
+            parser.error(f"{path}: height {sheet.shape[0]} doesn't divide into {frames_per_sheet} frames")
+        frames.extend(numpy.split(sheet, frames_per_sheet))
+
+    if any(frame.shape != frames[0].shape for frame in frames):
+        parser.error("all animation frames must be the same size")
+    return numpy.stack(frames)
 
 # Input detail configuration
-input_name = sys.argv[1]
-metric_mode = sys.argv[2]
-conversion_mode = sys.argv[3]
-out_prefix = sys.argv[4]
+input_names = args.inputs
+out_prefix = args.out_prefix
+frame_count = len(input_names) * args.frames
+animated = frame_count > 1
+
+if args.frames < 1:
+    parser.error("--frames must be at least 1")
+if len(args.delays) not in (1, frame_count):
+    parser.error(f"--delays needs 1 or {frame_count} values")
+delays = args.delays * frame_count if len(args.delays) == 1 else args.delays
+
+metadata = None
+if args.keep_metadata:
+    with PIL.Image.open(input_names[0]) as first_input:
+        metadata = {key: value for key, value in first_input.info.items() if isinstance(value, str)}
+png_options = iconsmooth_lib.PngOptions(args.compress_level, args.palette, metadata)
 
 # Metric configuration
-tile_w, tile_h, subtile_w, subtile_h, remtile_w, remtile_h = iconsmooth_lib.parse_metric_mode(metric_mode)
+metrics = iconsmooth_lib.parse_metric_mode(args.metrics)
+tile_w, tile_h = metrics[0], metrics[1]
 
 # Output state configuration
-out_states = iconsmooth_lib.conversion_modes[conversion_mode].states
-
-# Source loading
-src_img = PIL.Image.open(input_name)
-
-input_row = src_img.size[0] // tile_w
-
-tiles = []
-# 48 is the amount of tiles that usually exist, but 56 covers walls with diagonal variants.
-for i in range(56):
-    tile = PIL.Image.new("RGBA", (tile_w, tile_h))
-    tx = i % input_row
-    ty = i // input_row
-    tile.paste(src_img, (tx * -tile_w, ty * -tile_h))
-    # now split that up
-    # note that THIS is where the weird ordering gets put into place
-    tile_a = PIL.Image.new("RGBA", (remtile_w, remtile_h))
-    tile_a.paste(tile,           (-subtile_w, -subtile_h))
-    tile_b = PIL.Image.new("RGBA", (subtile_w, subtile_h))
-    tile_b.paste(tile,           (         0,          0))
-    tile_c = PIL.Image.new("RGBA", (remtile_w, subtile_h))
-    tile_c.paste(tile,           (-subtile_w,          0))
-    tile_d = PIL.Image.new("RGBA", (subtile_w, remtile_h))
-    tile_d.paste(tile,           (         0, -subtile_h))
-    tiles.append([tile_a, tile_b, tile_c, tile_d])
-
-state_size = (tile_w * 2, tile_h * 2)
-
-for state in range(len(out_states)):
-    full = PIL.Image.new("RGBA", state_size)
-    full.paste(tiles[out_states[state][0]][0], (subtile_w, subtile_h))
-    full.paste(tiles[out_states[state][1]][1], (tile_w, 0))
-    full.paste(tiles[out_states[state][2]][2], (subtile_w, tile_h))
-    full.paste(tiles[out_states[state][3]][3], (tile_w, tile_h + subtile_h))
-    full.save(out_prefix + str(state) + ".png")
-
-full_finale = PIL.Image.new("RGBA", (tile_w, tile_h))
-full_finale.paste(tiles[out_states[0][0]][0], (subtile_w, subtile_h))
-full_finale.paste(tiles[out_states[0][1]][1], (0, 0))
-full_finale.paste(tiles[out_states[0][2]][2], (subtile_w, 0))
-full_finale.paste(tiles[out_states[0][3]][3], (0, subtile_h))
-full_finale.save(out_prefix + "full.png")
+mode = iconsmooth_lib.conversion_modes[args.mode]
+suffixes = [str(state) for state in range(iconsmooth_lib.state_count)] + ["full"]
+
+cache = None
+cached = False
+if not args.no_cache:
+    cache = iconsmooth_lib.OutputCache(args.cache_dir, args.cache_size * 1024 * 1024, args.cache_link)
+    input_hash = "+".join(iconsmooth_lib.hash_file(name) for name in input_names)
+    cache_key = cache.key(input_hash, metrics, mode, args.frames, png_options.cache_tag())
+    cached = cache.fetch(cache_key, out_prefix, suffixes)
+
+report = None
+if cached:
+    print(f"{' '.join(input_names)}: unchanged, reused cached output")
+    if args.report:
+        report = cache.report(cache_key)
+        if report is None:
+            print("Cached without --report, no sizes to report; run with --no-cache to get them")
+else:
+    # Source loading
+    src = load_frames(input_names, args.frames)
+
+    # All quadrant remapping, for every frame at once, is a single gather through the mode's precompiled offset tables.
+    state_offsets, full_offsets = mode.offsets(metrics, src.shape[2], src.shape[1])
+
+    states = iconsmooth_lib.render(src, state_offsets)
+    sheets = [iconsmooth_lib.directional_sheet(states[:, state], tile_w, tile_h) for state in range(iconsmooth_lib.state_count)]
+    sheets.append(iconsmooth_lib.rsi_sheet(iconsmooth_lib.render(src, full_offsets)))
+
+    report = {} if args.report else None
+    for suffix, sheet in zip(suffixes, sheets):
+        written = iconsmooth_lib.save_png(sheet, out_prefix + suffix + ".png", png_options)
+        if report is not None:
+            report[suffix] = [written, iconsmooth_lib.default_png_size(sheet)]
+
+    if cache is not None:
+        cache.store(cache_key, out_prefix, suffixes, report)
+
+if report is not None:
+    total_written = 0
+    total_default = 0
+    for suffix in suffixes:
+        written, default = report[suffix]
+        print(f"{out_prefix}{suffix}.png: {written} bytes, saved {default - written} of {default}")
+        total_written += written
+        total_default += default
+    print(f"Total: {total_written} bytes, saved {total_default - total_written} of {total_default}")
 
+if animated:
+    state_base = os.path.basename(out_prefix)
+    meta_states = {state_base + str(state): (4, [delays] * 4) for state in range(iconsmooth_lib.state_count)}
+    meta_states[state_base + "full"] = (1, [delays])
+    if iconsmooth_lib.update_rsi_meta(out_prefix, meta_states):
+        print(f"Updated delays for {len(meta_states)} states in meta.json")
+    else:
+        print("No meta.json next to OUTPREFIX, add these states yourself:")
+        print(json.dumps([{"name": name, "directions": directions, "delays": state_delays} for name, (directions, state_delays) in meta_states.items()], indent="\t"))
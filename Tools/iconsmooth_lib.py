@@ -20,130 +20,368 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import hashlib
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
+import numpy
+import PIL.Image
+import PIL.PngImagePlugin
+import yaml
+
+# Conversion modes are loaded from every .yml/.yaml/.json file in these directories.
+# Each file defines one mode, named after the file:
+#
+# tw: 7       # Width of the source atlas, in tiles
+# th: 7       # Height of the source atlas, in tiles
+# states:     # For each of the 8 output states, the source tile for BR, TL, TR, BL (-1 for unused)
+#   - [  0,  0,  0,  0]
+#   ...
+#
+# Extra directories can be given with ICONSMOOTH_MODES (separated like PATH); later directories override earlier ones.
+modes_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "iconsmooth_modes")
+mode_extensions = (".yml", ".yaml", ".json")
+
+state_count = 8
+quadrant_count = 4
+max_atlas_tiles = 64
+
+# Bump whenever the tool's output changes for the same inputs, so stale cache entries stop matching.
+tool_version = 1
+
 class ConversionMode:
-    def __init__(self, tw, th, states):
+    def __init__(self, name, tw, th, states):
+        self.name = name
         self.tw = tw
         self.th = th
         self.states = states
+        # Precompiled once: source tile per (state, quadrant), -1 for unused.
+        self.source_tiles = numpy.array(states, dtype=numpy.intp).reshape(state_count, quadrant_count)
+        # Identifies the table itself rather than the mode name, for the output cache.
+        self.digest = hashlib.sha256(json.dumps([tw, th, states]).encode()).hexdigest()
+        self._offsets = {}
+
+    def offsets(self, metrics, src_w, src_h):
+        """
+        Flat source pixel offsets for every pixel of every output state and of the "full" state.
+        Offset src_w * src_h refers to a transparent pixel, see render().
+        Cached per metrics and source size, so repeated renders do no index work at all.
+        """
+        key = (metrics, src_w, src_h)
+        if key not in self._offsets:
+            self._offsets[key] = self._build_offsets(metrics, src_w, src_h)
+        return self._offsets[key]
+
+    def _build_offsets(self, metrics, src_w, src_h):
+        tile_w, tile_h = metrics[0], metrics[1]
+        input_row = src_w // tile_w
+        if input_row == 0:
+            raise ValueError(f"source image ({src_w}px wide) is narrower than one {tile_w}px tile")
+        blank = src_w * src_h
+
+        states = numpy.full((state_count, tile_h * 2, tile_w * 2), blank, dtype=numpy.intp)
+        full = numpy.full((tile_h, tile_w), blank, dtype=numpy.intp)
+
+        for quadrant, (sx, sy, w, h, dx, dy, fx, fy) in enumerate(quadrant_layout(metrics)):
+            if w <= 0 or h <= 0:
+                continue
+            tiles = self.source_tiles[:, quadrant]
+            ys, xs = numpy.mgrid[0:h, 0:w]
+            px = ((tiles % input_row) * tile_w + sx)[:, None, None] + xs
+            py = ((tiles // input_row) * tile_h + sy)[:, None, None] + ys
+            # Anything past the edge of the source sheet comes out transparent, same as a PIL paste would.
+            valid = (tiles >= 0)[:, None, None] & (px < src_w) & (py < src_h)
+            quadrant_offsets = numpy.where(valid, py * src_w + px, blank)
+            states[:, dy:dy + h, dx:dx + w] = quadrant_offsets
+            full[fy:fy + h, fx:fx + w] = quadrant_offsets[0]
+
+        return states, full
+
+def quadrant_layout(metrics):
+    """
+    Where each quadrant comes from in a source tile and where it goes in the output states.
+    In BR, TL, TR, BL order: (source x, source y, width, height, state x, state y, full x, full y)
+    Note that THIS is where the weird ordering gets put into place.
+    """
+    tile_w, tile_h, subtile_w, subtile_h, remtile_w, remtile_h = metrics
+    return [
+        (subtile_w, subtile_h, remtile_w, remtile_h, subtile_w, subtile_h,          subtile_w, subtile_h),
+        (        0,         0, subtile_w, subtile_h,    tile_w,         0,                  0,         0),
+        (subtile_w,         0, remtile_w, subtile_h, subtile_w,    tile_h,          subtile_w,         0),
+        (        0, subtile_h, subtile_w, remtile_h,    tile_w, tile_h + subtile_h,         0, subtile_h),
+    ]
+
+def render(src, offsets):
+    """
+    Gathers output pixels from RGBA source frames (frames, height, width, 4) using offsets from ConversionMode.offsets().
+    Every frame goes through the same single gather. A lone (height, width, 4) sheet works too.
+    """
+    frames = src.reshape(-1, src.shape[-3] * src.shape[-2], 4)
+    blank = numpy.zeros((frames.shape[0], 1, 4), dtype=src.dtype)
+    out = numpy.concatenate((frames, blank), axis=1)[:, offsets]
+    return out if src.ndim == 4 else out[0]
+
+def rsi_sheet(icons):
+    """
+    Lays out icons (count, height, width, 4), already in RSI order (directions, then frames), as an RSI state sheet.
+    Icons go left to right, top to bottom, ceil(sqrt(count)) to a row.
+    """
+    count, height, width = icons.shape[:3]
+    columns = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+    padded = numpy.zeros((rows * columns, height, width, 4), dtype=icons.dtype)
+    padded[:count] = icons
+    return padded.reshape(rows, columns, height, width, 4).transpose(0, 2, 1, 3, 4).reshape(rows * height, columns * width, 4)
+
+def directional_sheet(frames, tile_w, tile_h):
+    """
+    Turns rendered states (frames, tile_h * 2, tile_w * 2, 4) into a 4-directional RSI state sheet.
+    A single frame comes out exactly as rendered.
+    """
+    count = frames.shape[0]
+    # The 2x2 cells of a rendered state are the S, N, E, W directions in reading order.
+    icons = frames.reshape(count, 2, tile_h, 2, tile_w, 4).transpose(1, 3, 0, 2, 4, 5)
+    return rsi_sheet(icons.reshape(4 * count, tile_h, tile_w, 4))
+
+def update_rsi_meta(out_prefix, states):
+    """
+    Sets directions and delays for the given states (name: (directions, delays)) in the meta.json next to out_prefix.
+    Returns False if there is no meta.json to update.
+    """
+    meta_path = os.path.join(os.path.dirname(out_prefix) or ".", "meta.json")
+    if not os.path.isfile(meta_path):
+        return False
+
+    with open(meta_path, "r", encoding="utf-8-sig") as f:
+        meta = json.load(f)
+
+    existing = {state["name"]: state for state in meta.setdefault("states", [])}
+    for name, (directions, delays) in states.items():
+        state = existing.get(name)
+        if state is None:
+            state = {"name": name}
+            meta["states"].append(state)
+        state["directions"] = directions
+        state["delays"] = delays
+
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent="\t", ensure_ascii=False)
+        f.write("\n")
+    return True
+
+def validate_conversion_mode(name, data):
+    if not isinstance(data, dict):
+        raise ValueError(f"conversion mode '{name}': expected a mapping with tw, th and states")
+
+    tw = data.get("tw")
+    th = data.get("th")
+    for key, value in (("tw", tw), ("th", th)):
+        if not isinstance(value, int) or isinstance(value, bool) or not 1 <= value <= max_atlas_tiles:
+            raise ValueError(f"conversion mode '{name}': {key} must be an integer between 1 and {max_atlas_tiles}, got {value!r}")
+
+    states = data.get("states")
+    if not isinstance(states, list) or len(states) != state_count:
+        raise ValueError(f"conversion mode '{name}': states must be a list of {state_count} states")
+
+    tile_count = tw * th
+    for i, state in enumerate(states):
+        if not isinstance(state, list) or len(state) != quadrant_count:
+            raise ValueError(f"conversion mode '{name}': state {i} must list {quadrant_count} source tiles (BR, TL, TR, BL)")
+        for tile in state:
+            if not isinstance(tile, int) or isinstance(tile, bool) or not -1 <= tile < tile_count:
+                raise ValueError(f"conversion mode '{name}': state {i} references tile {tile!r}, must be -1 or within the {tw}x{th} atlas")
+
+    return ConversionMode(name, tw, th, states)
+
+def load_conversion_mode(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            data = json.load(f)
+        else:
+            data = yaml.safe_load(f)
+    return validate_conversion_mode(name, data)
 
-conversion_modes = {
-    # TG
-    "tg": ConversionMode(
-        7, 7,
-        [
-            # Each output state gives a source quadrant for BR, TL, TR, BL.
-            # The idea is that each of the 4 directions is a different rotation of the same state.
-            # These states are associated by a bitfield indicating occupance relative to the indicated corner:
-            # 1: Tile anti-clockwise of indicated diagonal occupied.
-            # 2: Tile in indicated diagonal occupied.
-            # 4: Tile clockwise of indicated diagonal occupied.
-
-            # BR, TL, TR, BL
-            [  0,  0,  0,  0], # 0 : Standing / Outer corners
-            [ 12, 12,  3,  3], # 1 : Straight line ; top half horizontal bottom half vertical
-            [  0,  0,  0,  0], # 2 : Standing / Outer corners diagonal
-            [ 12, 12,  3,  3], # 3 : Seems to match 1
-            [  3,  3, 12, 12], # 4 : Straight line ; top half vertical bottom half horizontal
-            [ 15, 15, 15, 15], # 5 : Inner corners
-            [  3,  3, 12, 12], # 6 : Seems to match 4
-            [ 46, 46, 46, 46], # 7 : Full
-        ]
-    ),
-    # TG
-    "tg_shuttle": ConversionMode(
-        7, 9,
-        [
-            # BR, TL, TR, BL
-            [  0,  0,  0,  0],
-            [ 16, 16,  3,  3],
-            [  0,  0,  0,  0],
-            [ 16, 16,  3,  3],
-            [  3,  3, 16, 16],
-            [ 19, 19, 19, 19],
-            [  3,  3, 16, 16],
-            [ 54, 54, 54, 54],
-        ]
-    ),
-    # Citadel Station
-    "citadel": ConversionMode(
-        7, 3,
-        [
-            # BR, TL, TR, BL
-            [  3,  0,  1,  2],
-            [ 11,  8,  5,  6],
-            [  3,  0,  1,  2],
-            [ 11,  8,  5,  6],
-            [  7,  4,  9, 10],
-            [ 15, 12, 13, 14],
-            [  7,  4,  9, 10],
-            [ 19, 16, 17, 18],
-        ]
-    ),
-    # TauCeti Station
-    "tau": ConversionMode(
-        3, 2,
-        [
-            # BR, TL, TR, BL
-            [  0,  0,  0,  0],
-            [  2,  2,  1,  1],
-            [  0,  0,  0,  0],
-            [  2,  2,  1,  1],
-            [  1,  1,  2,  2],
-            [  3,  3,  3,  3],
-            [  1,  1,  2,  2],
-            [  4,  4,  4,  4],
-        ]
-    ),
-    # VXA
-    "vxa": ConversionMode(
-        2, 3,
-        [
-            # 01 # 1: Tile anti-clockwise of indicated diagonal occupied.
-            # 23 # 2: Tile in indicated diagonal occupied.
-            # 45 # 4: Tile clockwise of indicated diagonal occupied.
-            # BR, TL, TR, BL
-            [  5,  2,  3,  4], # 0 X (ST)
-            [  4,  3,  5,  2], # 1
-            [  5,  2,  3,  4], # 2 X (ST)
-            [  4,  3,  5,  2], # 3
-            [  3,  4,  2,  5], # 4
-            [  1,  1,  1,  1], # 5 X (IC)
-            [  3,  4,  2,  5], # 6
-            [  2,  5,  4,  3], # 7 X (F)
-        ]
-    ),
-    # VXA+ - custom extensions to the VXA AT field format to make it map 1:1 with RT subtiles
-    "vxap": ConversionMode(
-        2, 4,
-        [
-            # BR, TL, TR, BL
-            [  5,  2,  3,  4], # 0 X (ST)
-            [  4,  3,  5,  2], # 1
-            [  0,  0,  0,  0], # 2 - diagdup of 0
-            [  6,  6,  7,  7], # 3 - diagdup of 1
-            [  3,  4,  2,  5], # 4
-            [  1,  1,  1,  1], # 5 X (IC)
-            [  7,  7,  6,  6], # 6 - diagdup of 4
-            [  2,  5,  4,  3], # 7 X (F)
-        ]
-    ),
-    # rt_states - debugging!
-    "rt_states": ConversionMode(
-        8, 1,
-        [
-            [  0,  0,  0,  0],
-            [  1,  1,  1,  1],
-            [  2,  2,  2,  2],
-            [  3,  3,  3,  3],
-            [  4,  4,  4,  4],
-            [  5,  5,  5,  5],
-            [  6,  6,  6,  6],
-            [  7,  7,  7,  7],
-        ]
-    ),
-}
-
-all_conv = "tg/citadel/tau/vxa/vxap/rt_states"
+def load_conversion_modes(directories):
+    modes = {}
+    for directory in directories:
+        for file_name in sorted(os.listdir(directory)):
+            if file_name.endswith(mode_extensions):
+                mode = load_conversion_mode(os.path.join(directory, file_name))
+                modes[mode.name] = mode
+    return modes
+
+def mode_directories():
+    extra = os.environ.get("ICONSMOOTH_MODES", "")
+    return [modes_dir] + [d for d in extra.split(os.pathsep) if d]
+
+conversion_modes = load_conversion_modes(mode_directories())
+
+all_conv = "/".join(conversion_modes)
+
+class PngOptions:
+    """
+    How generated states get encoded.
+    palette: store as an indexed image when the state has at most 256 distinct RGBA colors (lossless).
+    metadata: text chunks to write; None strips everything but the pixels.
+    """
+    def __init__(self, compress_level=9, palette=False, metadata=None):
+        self.compress_level = compress_level
+        self.palette = palette
+        self.metadata = metadata
+
+    def cache_tag(self):
+        return [self.compress_level, self.palette, sorted((self.metadata or {}).items())]
+
+def palettize(pixels):
+    """
+    Losslessly converts an RGBA array to a "P" image, or returns None if it has more than 256 colors.
+    """
+    height, width = pixels.shape[:2]
+    packed = numpy.ascontiguousarray(pixels).view(numpy.uint32).reshape(-1)
+    colors, indices = numpy.unique(packed, return_inverse=True)
+    if len(colors) > 256:
+        return None
+    image = PIL.Image.fromarray(indices.astype(numpy.uint8).reshape(height, width), "P")
+    image.putpalette(colors.view(numpy.uint8).tobytes(), rawmode="RGBA")
+    return image
+
+def encode_png(pixels, options):
+    pnginfo = None
+    if options.metadata:
+        pnginfo = PIL.PngImagePlugin.PngInfo()
+        for key, value in options.metadata.items():
+            pnginfo.add_text(key, value)
+
+    candidates = [PIL.Image.fromarray(pixels, "RGBA")]
+    if options.palette:
+        indexed = palettize(pixels)
+        if indexed is not None:
+            candidates.append(indexed)
+
+    # Tiny states can come out bigger indexed than as plain RGBA, so keep whichever is smaller.
+    encoded = []
+    for image in candidates:
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG", compress_level=options.compress_level, pnginfo=pnginfo)
+        encoded.append(buffer.getvalue())
+    return min(encoded, key=len)
+
+def default_png_size(pixels):
+    buffer = io.BytesIO()
+    PIL.Image.fromarray(pixels, "RGBA").save(buffer, "PNG")
+    return buffer.tell()
+
+def save_png(pixels, path, options):
+    """
+    Encodes an RGBA array to path, returning the number of bytes written.
+    """
+    data = encode_png(pixels, options)
+    # Unlink first: the old file may be hardlinked into the output cache, and saving over it would corrupt the entry.
+    if os.path.lexists(path):
+        os.remove(path)
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data)
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "ss14-iconsmooth")
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class OutputCache:
+    """
+    Content-addressed store of previously generated state PNGs.
+    Each entry is a directory named after its key holding one PNG per output suffix, and the --report sizes if
+    they were worked out when it was stored.
+    Entries are evicted least-recently-used first once the cache grows past max_bytes.
+    """
+    def __init__(self, directory, max_bytes, link=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.link = link
+
+    @staticmethod
+    def key(input_hash, metrics, mode, *extra):
+        material = json.dumps([tool_version, input_hash, list(metrics), mode.digest] + list(extra))
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def fetch(self, key, out_prefix, suffixes):
+        entry = os.path.join(self.directory, key)
+        sources = [os.path.join(entry, suffix + ".png") for suffix in suffixes]
+        if not all(os.path.isfile(source) for source in sources):
+            return False
+
+        for suffix, source in zip(suffixes, sources):
+            self._place(source, out_prefix + suffix + ".png")
+
+        # Directory mtime doubles as the last-used time for eviction.
+        os.utime(entry)
+        return True
+
+    def report(self, key):
+        """{suffix: [written, default]} stored with the entry, or None."""
+        try:
+            with open(os.path.join(self.directory, key, "report.json"), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, key, out_prefix, suffixes, report=None):
+        os.makedirs(self.directory, exist_ok=True)
+        entry = os.path.join(self.directory, key)
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self.directory)
+        try:
+            for suffix in suffixes:
+                shutil.copyfile(out_prefix + suffix + ".png", os.path.join(staging, suffix + ".png"))
+            if report is not None:
+                with open(os.path.join(staging, "report.json"), "w") as f:
+                    json.dump(report, f)
+            if os.path.isdir(entry):
+                shutil.rmtree(entry)
+            os.replace(staging, entry)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(path) if f.is_file())
+            entries.append((os.stat(path).st_mtime, size, path))
+            total += size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def _place(self, source, destination):
+        if os.path.lexists(destination):
+            os.remove(destination)
+        if self.link:
+            try:
+                os.link(source, destination)
+                return
+            except OSError:
+                # Different filesystem or no hardlink support, just copy.
+                pass
+        shutil.copyfile(source, destination)
 
 def parse_size(sz):
     if sz.find("x") == -1:
@@ -193,5 +431,12 @@ SUB is either specified as the subtile width/height, or defaults to being half o
 REM is computed from subtracting the subtile size from the tile size.
 """
 
+explain_modes = """
+- Conversion modes -
+Conversion modes are loaded from """ + modes_dir + """
+and from any directories listed in the ICONSMOOTH_MODES environment variable.
+Each .yml/.yaml/.json file there defines one mode named after the file; see tg.yml for the format.
+"""
+
 explain_prefix = "Resources/Textures/Structures/catwalk.rsi/catwalk_"
 
@@ -3,7 +3,19 @@
 # dungeon room pack configs.
 
 import argparse
-import cv2
+import concurrent.futures
+import functools
+import glob
+import hashlib
+import importlib.util
+import json
+import numpy
+import os
+import re
+import struct
+import sys
+import zlib
+from collections import defaultdict
 from dataclasses import dataclass
 
 
@@ -13,6 +25,16 @@ MAX_VALUE = 256
 
 assert(MAX_VALUE % SUBDIVISIONS == 0)
 
+BITMAP_EXTENSIONS = ('.png', '.bmp', '.pgm')
+
+# Default strip size for tiled analysis, in pixels.
+TILE_PIXELS = 1 << 24
+
+# Bitmap hashes from the last batch run, kept in the output directory.
+HASHES_FILE = '.roompack_hashes.json'
+
+BACKENDS = ('auto', 'numpy', 'opencv')
+
 @dataclass
 class Box2:
     left: int
@@ -25,12 +47,142 @@ class RoomPackBitmap:
     width: int
     height: int
     rooms: list
+    bounds: Box2
 
+@dataclass
+class RoomPackIndex:
+    # Pairs of room indices whose interiors intersect.
+    overlaps: list
+    zero_area: list
+    out_of_bounds: list
+    # For every room, the indices of rooms sharing a stretch of edge with it.
+    adjacency: list
 
-def analyze_bitmap(fname, centered = False, offset_x = 0, offset_y = 0):
-    image = cv2.imread(fname, cv2.IMREAD_GRAYSCALE)
 
-    contours = []
+def rgb_to_grey(rgb):
+    """
+    Greyscale conversion matching cv2.imread(IMREAD_GRAYSCALE) on PNGs (libpng's fixed point BT.601 weights),
+    so colored bitmaps land in the same bands whichever way they're read.
+    """
+    rgb = rgb.astype(numpy.uint32)
+    return ((rgb[..., 0] * 9797 + rgb[..., 1] * 19234 + rgb[..., 2] * 3737) >> 15).astype(numpy.uint8)
+
+
+def find_runs(values):
+    """
+    Horizontal runs of equal, non-zero values in raster order, as (rows, starts, ends, values) with exclusive ends.
+    """
+    height, width = values.shape
+
+    change = numpy.ones((height, width), dtype=bool)
+    change[:, 1:] = values[:, 1:] != values[:, :-1]
+    rows, starts = numpy.nonzero(change)
+
+    ends = numpy.empty_like(starts)
+    ends[:-1] = starts[1:]
+    ends[-1:] = width
+    ends[numpy.flatnonzero(rows[1:] != rows[:-1])] = width
+
+    run_values = values[rows, starts]
+    keep = run_values != 0
+    return rows[keep], starts[keep], ends[keep], run_values[keep]
+
+
+def link_runs(rows, starts, ends, values, width, connectivity):
+    """
+    Union-find over runs (in raster order) that touch on consecutive rows and have the same value.
+    Returns every run's root, which is the first run of its component.
+    """
+    run_count = len(starts)
+    row_width = width + 2
+
+    # Runs on consecutive rows touch if they overlap, or also just meet at a corner with 8-connectivity.
+    reach = 1 if connectivity == 8 else 0
+    start_keys = rows * row_width + starts
+    end_keys = rows * row_width + ends
+    above = (rows - 1) * row_width
+    first = numpy.searchsorted(end_keys, above + starts + 1 - reach, side='left')
+    last = numpy.searchsorted(start_keys, above + ends - 1 + reach, side='right')
+    touching = numpy.maximum(last - first, 0)
+
+    runs = numpy.repeat(numpy.arange(run_count), touching)
+    runs_above = numpy.repeat(first - numpy.cumsum(touching) + touching, touching) + numpy.arange(len(runs))
+    same = values[runs] == values[runs_above]
+    runs, runs_above = runs[same], runs_above[same]
+
+    # Hook the larger root under the smaller one, then flatten, until stable.
+    parent = numpy.arange(run_count)
+    while len(runs):
+        roots = parent[runs]
+        roots_above = parent[runs_above]
+        split = roots != roots_above
+        if not split.any():
+            break
+        runs, runs_above = runs[split], runs_above[split]
+        roots, roots_above = roots[split], roots_above[split]
+        numpy.minimum.at(parent, numpy.maximum(roots, roots_above), numpy.minimum(roots, roots_above))
+        while True:
+            flattened = parent[parent]
+            if numpy.array_equal(flattened, parent):
+                break
+            parent = flattened
+
+    return parent
+
+
+class NumpyBackend:
+    """
+    Bitmap loading with only NumPy and Pillow.
+    """
+    name = 'numpy'
+
+    def load_grayscale(self, fname):
+        import PIL.Image
+
+        with PIL.Image.open(fname) as image:
+            if image.mode == 'L':
+                return numpy.asarray(image)
+            if image.mode in ('I;16', 'I;16B', 'I'):
+                # 16-bit greyscale: keep the high byte like OpenCV and PngStrips do, convert() would clip instead.
+                return (numpy.asarray(image) >> 8).astype(numpy.uint8)
+            return rgb_to_grey(numpy.asarray(image.convert('RGB')))
+
+
+class OpenCVBackend:
+    name = 'opencv'
+
+    def __init__(self):
+        import cv2
+        self.cv2 = cv2
+
+    def load_grayscale(self, fname):
+        image = self.cv2.imread(fname, self.cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            raise OSError(f"unable to read bitmap '{fname}'")
+        return image
+
+
+_backends = {}
+
+def get_backend(name = 'auto'):
+    """
+    Backends are created on first use, so OpenCV only gets imported when it's actually going to be used.
+    'auto' picks OpenCV if it's installed and falls back to NumPy otherwise.
+    """
+    if name == 'auto':
+        name = 'opencv' if importlib.util.find_spec('cv2') is not None else 'numpy'
+
+    if name not in _backends:
+        _backends[name] = OpenCVBackend() if name == 'opencv' else NumpyBackend()
+
+    return _backends[name]
+
+
+def band_table():
+    """
+    Lookup table from grey value to band index (1 to SUBDIVISIONS), 0 for pixels that belong to no band.
+    """
+    table = numpy.zeros(256, dtype=numpy.uint8)
 
     for i in range(0, 1 + SUBDIVISIONS):
         lower = MAX_VALUE / SUBDIVISIONS * (i - 1)
@@ -39,42 +191,856 @@ def analyze_bitmap(fname, centered = False, offset_x = 0, offset_y = 0):
         lower = max(MIN_VALUE, lower)
         upper = min(MAX_VALUE - 1, upper)
 
-        image_slice = cv2.inRange(image, lower, upper)
-        image_mask = cv2.threshold(image_slice, 0, 255, cv2.THRESH_TOZERO)[1]
-        new_contours = cv2.findContours(image_mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        if lower <= upper:
+            table[int(lower):int(upper) + 1] = i
 
-        if len(new_contours[0]) == 0:
-            continue
+    return table
+
+
+def run_components(rows, starts, ends, values, width, connectivity):
+    """
+    Components of runs in raster order, numbered in raster order of their first pixel, as arrays of
+    (values, left, top, right, bottom, area, start_x) with exclusive right and bottom. A component starts on its top row.
+    """
+    parent = link_runs(rows, starts, ends, values, width, connectivity)
+
+    # Every root is its component's first run.
+    roots, labels = numpy.unique(parent, return_inverse=True)
+    labels = labels.reshape(-1)
+    count = len(roots)
+
+    left = numpy.full(count, width, dtype=numpy.int64)
+    right = numpy.zeros(count, dtype=numpy.int64)
+    bottom = numpy.zeros(count, dtype=numpy.int64)
+    numpy.minimum.at(left, labels, starts)
+    numpy.maximum.at(right, labels, ends)
+    numpy.maximum.at(bottom, labels, rows + 1)
+    area = numpy.bincount(labels, weights=ends - starts, minlength=count).astype(numpy.int64)
+
+    return values[roots], left, rows[roots].astype(numpy.int64), right, bottom, area, starts[roots].astype(numpy.int64)
+
+
+def band_gaps(rows, starts, ends, values, slots, tops, bottoms, width, y0, y1):
+    """
+    Runs of pixels outside a band, on rows y0 to y1 and within the band's rows tops[band] to bottoms[band], for every
+    band with a slot (slots[band] >= 0), given all runs of those rows. Each band's gaps get their own stretch of
+    width + 1 columns starting at slot * (width + 1), so the gaps of all bands can be labeled in one go without
+    touching each other. Returned in raster order as (rows, starts, ends, values), values being the band.
+    """
+    keep = slots[values] >= 0
+    rows, starts, ends, values = rows[keep], starts[keep], ends[keep], values[keep]
+    band_slots = slots[values]
+
+    order = numpy.lexsort((starts, band_slots, rows))
+    rows, starts, ends, values, band_slots = rows[order], starts[order], ends[order], values[order], band_slots[order]
+
+    # Runs of one band on one row, the gaps being before, between and after them.
+    first = numpy.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (band_slots[1:] != band_slots[:-1])
+    last = numpy.ones(len(rows), dtype=bool)
+    last[:-1] = first[1:]
+
+    between = numpy.flatnonzero(~first[1:])
+    leading = numpy.flatnonzero(first & (starts > 0))
+    trailing = numpy.flatnonzero(last & (ends < width))
+
+    # Rows a band has no runs on are one gap all the way across.
+    slot_bands = numpy.flatnonzero(slots >= 0)
+    present = numpy.zeros((len(slot_bands), y1 - y0), dtype=bool)
+    present[band_slots, rows - y0] = True
+    span = numpy.arange(y0, y1)
+    within = (span >= tops[slot_bands, None]) & (span < bottoms[slot_bands, None])
+    empty_slots, empty_rows = numpy.nonzero(within & ~present)
+
+    zeros = numpy.zeros(len(leading) + len(empty_rows), dtype=starts.dtype)
+    full = numpy.full(len(trailing) + len(empty_rows), width, dtype=ends.dtype)
+
+    gap_rows = numpy.concatenate((rows[between], rows[leading], empty_rows + y0, rows[trailing]))
+    gap_values = numpy.concatenate((values[between], values[leading], slot_bands[empty_slots].astype(values.dtype), values[trailing]))
+    gap_starts = numpy.concatenate((ends[between], zeros, ends[trailing]))
+    gap_ends = numpy.concatenate((starts[between + 1], starts[leading], full))
+
+    offsets = slots[gap_values] * (width + 1)
+    gap_starts, gap_ends = gap_starts + offsets, gap_ends + offsets
 
-        contours += new_contours[0:-1]
+    order = numpy.lexsort((gap_starts, gap_rows))
+    return gap_rows[order], gap_starts[order], gap_ends[order], gap_values[order]
 
-    image_height = len(image)
-    image_width = len(image[0])
+
+def hole_slots(band, top, bottom):
+    """
+    Slots for band_gaps for the bands of the given hollow components, and the rows their holes can be within.
+    A gap reaching the first or last of those rows can't be enclosed by any of them.
+    """
+    slots = numpy.full(1 + SUBDIVISIONS, -1, dtype=numpy.int64)
+    tops = numpy.full(1 + SUBDIVISIONS, sys.maxsize, dtype=numpy.int64)
+    bottoms = numpy.zeros(1 + SUBDIVISIONS, dtype=numpy.int64)
+    numpy.minimum.at(tops, band, top)
+    numpy.maximum.at(bottoms, band, bottom)
+
+    used = numpy.unique(band)
+    slots[used] = numpy.arange(len(used))
+    return slots, tops, bottoms
+
+
+def outer_contours(band, left, top, right, bottom, start_x):
+    """
+    (band, start y, start x, rect) of the outer border of each component, tracing starting at its first pixel.
+    """
+    return list(zip(band.tolist(), top.tolist(), start_x.tolist(),
+                    zip(left.tolist(), top.tolist(), (right - left).tolist(), (bottom - top).tolist())))
+
+
+def enclosed_holes(slots, tops, bottoms, width, band, left, top, right, bottom, start_y, start_x):
+    """
+    Picks the gap components (in band_gaps' columns) that are holes: not reaching a side of the image or the first
+    or last row a hole could be on. Returns (band, start y, start x, rect) for each, like findContours reports holes:
+    the contour runs along the surrounding pixels, so its rect is the gap's rect grown by one, and tracing starts
+    just left of the gap's first pixel.
+    """
+    offsets = slots[band] * (width + 1)
+    left, right, start_x = left - offsets, right - offsets, start_x - offsets
+    holes = numpy.flatnonzero((left > 0) & (right < width) & (top > tops[band]) & (bottom < bottoms[band]))
+
+    return [(band, start_y, start_x - 1, (left - 1, top - 1, right - left + 2, bottom - top + 2))
+            for band, start_y, start_x, left, top, right, bottom
+            in zip(*(array[holes].tolist() for array in (band, start_y, start_x, left, top, right, bottom)))]
+
+
+def make_result(image_width, image_height, rects, centered, offset_x, offset_y):
     rooms = []
 
     if centered:
         offset_x -= image_width // 2
         offset_y -= image_height // 2
 
-    for contour in contours:
-        for subcontour in contour:
-            x, y, w, h = cv2.boundingRect(subcontour)
+    bounds = Box2(offset_x, offset_y, offset_x + image_width, offset_y + image_height)
+
+    for x, y, w, h in rects:
+        box = Box2(offset_x + int(x),
+                   offset_y + int(y),
+                   offset_x + int(x + w),
+                   offset_y + int(y + h))
+
+        rooms.append(box)
+
+    return RoomPackBitmap(image_width, image_height, rooms, bounds)
+
+
+def analyze_bitmap(fname, centered = False, offset_x = 0, offset_y = 0, backend = 'auto', tiled = False, tile_rows = None, raw_size = None):
+    if tiled:
+        return analyze_bitmap_tiled(fname, centered, offset_x, offset_y, tile_rows, raw_size)
+
+    backend = get_backend(backend)
+    bands = band_table()[backend.load_grayscale(fname)]
+    image_height, image_width = bands.shape
+
+    # Label every band in one go: runs of one band, linked into 8-connected components like findContours' outer borders.
+    runs = find_runs(bands)
+    band, left, top, right, bottom, area, start_x = run_components(*runs, image_width, 8)
+    found = outer_contours(band, left, top, right, bottom, start_x)
+
+    # Components that aren't solid rectangles may enclose holes: 4-connected gaps in their band, labeled for all bands at once.
+    hollow = area != (right - left) * (bottom - top)
+    if hollow.any():
+        slots, tops, bottoms = hole_slots(band[hollow], top[hollow], bottom[hollow])
+        gaps = band_gaps(*runs, slots, tops, bottoms, image_width, 0, image_height)
+        gap_width = int(slots.max() + 1) * (image_width + 1)
+        gap_band, gap_left, gap_top, gap_right, gap_bottom, _, gap_start_x = run_components(*gaps, gap_width, 4)
+        found += enclosed_holes(slots, tops, bottoms, image_width, gap_band, gap_left, gap_top, gap_right, gap_bottom, gap_top, gap_start_x)
+
+    # Bands in order, each in reverse raster order of contour starts, like findContours per band.
+    found.sort(key=lambda contour: (contour[0], -contour[1], -contour[2]))
+    rects = [rect for _, _, _, rect in found]
+
+    return make_result(image_width, image_height, rects, centered, offset_x, offset_y)
+
+
+# Pillow modes with 1 to 4 8-bit channels.
+CHANNEL_MODES = {1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA'}
+
+def png_unfilter(lines, previous, bpp):
+    """
+    Reverses the PNG filters of a batch of scanlines, each starting with its filter type, given the decoded line
+    before them. Average and Paeth depend on the byte just decoded, so this is left to Pillow's PNG decoder: the
+    lines go back into a zlib stream after the previous line (unfiltered), stored rather than compressed.
+    Filters only ever combine a byte with the same byte of the previous pixel, so wider pixels are decoded as
+    groups of up to 4 of their bytes.
+    """
+    import PIL.Image
+
+    kinds = lines[:, 0]
+    if kinds.max(initial=0) > 4:
+        raise ValueError(f"unknown PNG filter type {kinds.max()}")
+
+    count = len(lines)
+    pixels = (lines.shape[1] - 1) // bpp
+    data = lines[:, 1:].reshape(count, pixels, bpp)
+    out = numpy.empty((count, pixels, bpp), dtype=numpy.uint8)
+
+    for first in range(0, bpp, 4):
+        channels = min(4, bpp - first)
+        mode = CHANNEL_MODES[channels]
+
+        batch = numpy.empty((count + 1, 1 + pixels * channels), dtype=numpy.uint8)
+        batch[0, 0] = 0
+        batch[0, 1:] = previous.reshape(pixels, bpp)[:, first:first + channels].reshape(-1)
+        batch[1:, 0] = kinds
+        batch[1:, 1:] = data[:, :, first:first + channels].reshape(count, -1)
+
+        image = PIL.Image.frombytes(mode, (pixels, count + 1), zlib.compress(batch, 0), 'zip', mode)
+        out[:, :, first:first + channels] = numpy.asarray(image).reshape(count + 1, pixels, channels)[1:]
+
+    return out.reshape(count, -1)
+
+
+class PngStrips:
+    """
+    Decodes a non-interlaced PNG a strip of rows at a time, converting to grey the same way cv2.imread does,
+    without ever holding the whole image.
+    """
+    SIGNATURE = b'\x89PNG\r\n\x1a\n'
+    CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.palette = None
+
+        with open(fname, 'rb') as f:
+            if f.read(8) != self.SIGNATURE:
+                raise ValueError(f"'{fname}' is not a PNG")
+
+            while True:
+                offset = f.tell()
+                length, kind = struct.unpack('>I4s', f.read(8))
+
+                if kind == b'IDAT':
+                    self.data_offset = offset
+                    break
+
+                data = f.read(length)
+                f.read(4)
+
+                if kind == b'IHDR':
+                    (self.width, self.height, self.depth, self.color,
+                     _, _, interlace) = struct.unpack('>IIBBBBB', data)
+                    if interlace:
+                        raise ValueError(f"'{fname}' is interlaced and can't be read in strips, save it without interlacing")
+                elif kind == b'PLTE':
+                    self.palette = rgb_to_grey(numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, 3))
+                elif kind == b'IEND':
+                    raise ValueError(f"'{fname}' has no image data")
+
+        channels = self.CHANNELS[self.color]
+        self.stride = (self.width * channels * self.depth + 7) // 8
+        self.bpp = max(1, channels * self.depth // 8)
+
+    def __call__(self, rows):
+        decompressor = zlib.decompressobj()
+        pending = bytearray()
+        previous = numpy.zeros(self.stride, dtype=numpy.uint8)
+        line_size = self.stride + 1
+        y = 0
+
+        for compressed in self._idat():
+            while compressed:
+                pending += decompressor.decompress(compressed, 1 << 20)
+                compressed = decompressor.unconsumed_tail
+
+                while y < self.height:
+                    count = min(rows, self.height - y)
+                    if len(pending) < count * line_size:
+                        break
+
+                    lines = numpy.frombuffer(pending[:count * line_size], dtype=numpy.uint8).reshape(count, line_size)
+                    del pending[:count * line_size]
+                    decoded = png_unfilter(lines, previous, self.bpp)
+                    previous = decoded[-1]
+                    yield y, self._to_grey(decoded)
+                    y += count
+
+        if y < self.height:
+            raise ValueError(f"'{self.fname}': image data ends after {y} of {self.height} rows")
+
+    def _idat(self):
+        with open(self.fname, 'rb') as f:
+            f.seek(self.data_offset)
+
+            while True:
+                length, kind = struct.unpack('>I4s', f.read(8))
+                if kind == b'IEND':
+                    return
+
+                if kind != b'IDAT':
+                    f.seek(length + 4, os.SEEK_CUR)
+                    continue
+
+                while length:
+                    piece = f.read(min(length, 1 << 20))
+                    length -= len(piece)
+                    yield piece
+                f.read(4)
+
+    def _to_grey(self, lines):
+        count = len(lines)
+
+        if self.depth < 8:
+            # Unpack 1, 2 or 4 bit samples; grey ones get scaled up to 0-255 like libpng does.
+            bits = numpy.unpackbits(lines, axis=1).reshape(count, -1, self.depth)
+            weights = 1 << numpy.arange(self.depth - 1, -1, -1, dtype=numpy.uint8)
+            samples = (bits * weights).sum(axis=2, dtype=numpy.uint8)[:, :self.width]
+            if self.color == 3:
+                return self.palette[samples]
+            return samples * numpy.uint8(255 // ((1 << self.depth) - 1))
+
+        if self.depth == 16:
+            # Keep the high byte of each sample.
+            lines = lines[:, ::2]
+
+        pixels = lines.reshape(count, self.width, -1)
+
+        if self.color == 3:
+            return self.palette[pixels[..., 0]]
+        if self.color in (2, 6):
+            return rgb_to_grey(pixels[..., :3])
+        return pixels[..., 0].copy()
+
+
+class MappedStrips:
+    """
+    Strips of a binary PGM (P5) or headerless 8-bit raw bitmap, straight from a memory map.
+    """
+    def __init__(self, fname, raw_size = None):
+        if raw_size is not None:
+            self.width, self.height = raw_size
+            offset = 0
+        else:
+            self.width, self.height, offset = self._read_pgm_header(fname)
+
+        self.image = numpy.memmap(fname, dtype=numpy.uint8, mode='r', offset=offset,
+                                  shape=(self.height, self.width))
+
+    def __call__(self, rows):
+        for y in range(0, self.height, rows):
+            yield y, numpy.asarray(self.image[y:y + rows])
+
+    @staticmethod
+    def _read_pgm_header(fname):
+        with open(fname, 'rb') as f:
+            header = f.read(1024)
+
+        fields = []
+        pos = 0
+        while len(fields) < 4:
+            while header[pos:pos + 1].isspace():
+                pos += 1
+            if header[pos:pos + 1] == b'#':
+                pos = header.index(b'\n', pos)
+                continue
+            end = pos
+            while not header[end:end + 1].isspace():
+                end += 1
+            fields.append(header[pos:end])
+            pos = end
+
+        if fields[0] != b'P5' or int(fields[3]) > 255:
+            raise ValueError(f"'{fname}' is not an 8-bit binary PGM")
+
+        # Exactly one whitespace character separates the header from the pixels.
+        return int(fields[1]), int(fields[2]), pos + 1
+
+
+def open_strips(fname, raw_size = None):
+    if raw_size is not None or fname.lower().endswith('.pgm'):
+        return MappedStrips(fname, raw_size)
+    if fname.lower().endswith('.png'):
+        return PngStrips(fname)
+    raise ValueError(f"'{fname}': tiled mode reads .png, .pgm or raw bitmaps")
+
+
+class StripLabeler:
+    """
+    Labels same-band 8-connected (or 4-connected) components strip by strip. Only the last row of runs is carried
+    over to the next strip; components meeting across a strip border are stitched with a union-find over component
+    IDs, and only each component's stats are kept: [band, left, top, right, bottom, area, start], start being its
+    first pixel as y * (width + 1) + x.
+    """
+    def __init__(self, width, connectivity = 8):
+        self.width = width
+        self.connectivity = connectivity
+        self.parent = []
+        self.stats = []
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        self.carry = (empty, empty, empty, empty.astype(numpy.uint8), empty)
+
+    def find(self, component):
+        while self.parent[component] != component:
+            self.parent[component] = self.parent[self.parent[component]]
+            component = self.parent[component]
+        return component
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if b < a:
+            a, b = b, a
+
+        kept, merged = self.stats[a], self.stats[b]
+        self.stats[a] = [kept[0],
+                         min(kept[1], merged[1]), min(kept[2], merged[2]),
+                         max(kept[3], merged[3]), max(kept[4], merged[4]),
+                         kept[5] + merged[5], min(kept[6], merged[6])]
+        self.stats[b] = None
+        self.parent[b] = a
+        return a
+
+    def add_strip(self, y0, bands):
+        rows, starts, ends, values = find_runs(bands)
+        self.add_runs(y0, len(bands), rows + y0, starts, ends, values)
+
+    def add_runs(self, y0, height, rows, starts, ends, values):
+        """
+        Adds the runs of rows y0 to y0 + height, in raster order.
+        """
+        carry_rows, carry_starts, carry_ends, carry_values, carry_ids = self.carry
+        carried = len(carry_starts)
+
+        all_rows = numpy.concatenate((carry_rows, rows))
+        all_starts = numpy.concatenate((carry_starts, starts))
+        all_ends = numpy.concatenate((carry_ends, ends))
+        all_values = numpy.concatenate((carry_values, values))
+        parent = link_runs(all_rows, all_starts, all_ends, all_values, self.width, self.connectivity)
+
+        # Stitch: carried runs that ended up in the same strip component are one component now.
+        root_ids = {}
+        for run in range(carried):
+            root = int(parent[run])
+            component = int(carry_ids[run])
+            root_ids[root] = self.union(root_ids[root], component) if root in root_ids else self.find(component)
+
+        # Strip components not touching the previous strip are new.
+        run_roots = parent[carried:]
+        root_to_id = numpy.zeros(len(parent), dtype=numpy.int64)
+        for root in numpy.unique(run_roots).tolist():
+            if root in root_ids:
+                root_to_id[root] = self.find(root_ids[root])
+            else:
+                root_to_id[root] = len(self.parent)
+                self.parent.append(len(self.parent))
+                self.stats.append([int(all_values[root]), self.width, sys.maxsize, 0, 0, 0, sys.maxsize])
+        ids = root_to_id[run_roots]
+
+        if len(ids):
+            components, inverse = numpy.unique(ids, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            count = len(components)
+
+            left = numpy.full(count, self.width, dtype=numpy.int64)
+            top = numpy.full(count, y0 + height, dtype=numpy.int64)
+            right = numpy.zeros(count, dtype=numpy.int64)
+            bottom = numpy.zeros(count, dtype=numpy.int64)
+            start = numpy.full(count, numpy.iinfo(numpy.int64).max, dtype=numpy.int64)
+            numpy.minimum.at(left, inverse, starts)
+            numpy.minimum.at(top, inverse, rows)
+            numpy.maximum.at(right, inverse, ends)
+            numpy.maximum.at(bottom, inverse, rows + 1)
+            numpy.minimum.at(start, inverse, rows * (self.width + 1) + starts)
+            area = numpy.bincount(inverse, weights=ends - starts, minlength=count)
+
+            for i, component in enumerate(components.tolist()):
+                stats = self.stats[component]
+                stats[1] = min(stats[1], int(left[i]))
+                stats[2] = min(stats[2], int(top[i]))
+                stats[3] = max(stats[3], int(right[i]))
+                stats[4] = max(stats[4], int(bottom[i]))
+                stats[5] += int(area[i])
+                stats[6] = min(stats[6], int(start[i]))
+
+        last = rows == y0 + height - 1
+        self.carry = (rows[last], starts[last], ends[last], values[last], ids[last])
+
+    def components(self):
+        """
+        Stats of every component as arrays: band, left, top, right, bottom, area, start y and start x.
+        """
+        stats = numpy.array([stats for stats in self.stats if stats is not None], dtype=numpy.int64).reshape(-1, 7)
+        band, left, top, right, bottom, area, start = stats.T
+        return band, left, top, right, bottom, area, start // (self.width + 1), start % (self.width + 1)
+
 
-            box = Box2(offset_x + x,
-                       offset_y + y,
-                       offset_x + x + w,
-                       offset_y + y + h)
+def analyze_bitmap_tiled(fname, centered = False, offset_x = 0, offset_y = 0, tile_rows = None, raw_size = None):
+    """
+    Same result as analyze_bitmap, but reads the bitmap a strip of rows at a time so peak memory follows the strip
+    size rather than the image size. If any components aren't solid rectangles, a second pass over the strips
+    labels the gaps in their bands the same way, to find the holes they enclose.
+    """
+    table = band_table()
+    strips = open_strips(fname, raw_size)
+    width = strips.width
 
-            rooms.append(box)
+    if tile_rows is None:
+        tile_rows = max(1, TILE_PIXELS // max(1, width))
 
-    return RoomPackBitmap(image_width, image_height, rooms)
+    labeler = StripLabeler(width)
+    for y0, strip in strips(tile_rows):
+        labeler.add_strip(y0, table[strip])
+
+    band, left, top, right, bottom, area, start_y, start_x = labeler.components()
+    found = outer_contours(band, left, top, right, bottom, start_x)
+
+    hollow = area != (right - left) * (bottom - top)
+    if hollow.any():
+        slots, tops, bottoms = hole_slots(band[hollow], top[hollow], bottom[hollow])
+        gap_labeler = StripLabeler(int(slots.max() + 1) * (width + 1), 4)
+
+        for y0, strip in strips(tile_rows):
+            rows, starts, ends, values = find_runs(table[strip])
+            gaps = band_gaps(rows + y0, starts, ends, values, slots, tops, bottoms, width, y0, y0 + len(strip))
+            gap_labeler.add_runs(y0, len(strip), *gaps)
+
+        gap_band, gap_left, gap_top, gap_right, gap_bottom, _, gap_start_y, gap_start_x = gap_labeler.components()
+        found += enclosed_holes(slots, tops, bottoms, width, gap_band, gap_left, gap_top, gap_right, gap_bottom, gap_start_y, gap_start_x)
+
+    # Bands in order, each in reverse raster order of contour starts, like the untiled path.
+    found.sort(key=lambda contour: (contour[0], -contour[1], -contour[2]))
+    rects = [rect for _, _, _, rect in found]
+
+    return make_result(width, strips.height, rects, centered, offset_x, offset_y)
+
+
+def index_rooms(rooms, bounds):
+    """
+    Finds overlapping, zero-area, out-of-bounds and adjacent rooms.
+    Rooms are bucketed on a grid, so each room is only compared against the few rooms near it.
+    """
+    overlaps = []
+    adjacency = [[] for _ in rooms]
+
+    zero_area = [i for i, room in enumerate(rooms)
+                 if room.right <= room.left or room.top <= room.bottom]
+
+    out_of_bounds = [i for i, room in enumerate(rooms)
+                     if room.left < bounds.left or room.bottom < bounds.bottom
+                     or room.right > bounds.right or room.top > bounds.top]
+
+    # Bucket rooms on a grid about one typical room across. Edges are inclusive so touching rooms share a cell.
+    sizes = sorted(max(room.right - room.left, room.top - room.bottom) for room in rooms)
+    cell = max(1, sizes[len(sizes) // 2]) if sizes else 1
+
+    buckets = defaultdict(list)
+    for i, room in enumerate(rooms):
+        for cell_x in range(room.left // cell, room.right // cell + 1):
+            for cell_y in range(room.bottom // cell, room.top // cell + 1):
+                buckets[cell_x, cell_y].append(i)
+
+    for (cell_x, cell_y), members in buckets.items():
+        for a, i in enumerate(members):
+            room = rooms[i]
+
+            for j in members[a + 1:]:
+                other = rooms[j]
+
+                x_overlap = min(room.right, other.right) - max(room.left, other.left)
+                y_overlap = min(room.top, other.top) - max(room.bottom, other.bottom)
+
+                if x_overlap < 0 or y_overlap < 0:
+                    continue
+
+                # A pair can share several cells; only look at it in the one holding the corner where they start meeting.
+                if (max(room.left, other.left) // cell, max(room.bottom, other.bottom) // cell) != (cell_x, cell_y):
+                    continue
+
+                if x_overlap > 0 and y_overlap > 0:
+                    overlaps.append((min(i, j), max(i, j)))
+                elif x_overlap > 0 or y_overlap > 0:
+                    adjacency[i].append(j)
+                    adjacency[j].append(i)
+
+    overlaps.sort()
+    for neighbours in adjacency:
+        neighbours.sort()
+
+    return RoomPackIndex(overlaps, zero_area, out_of_bounds, adjacency)
+
+
+def merge_fragments(rooms):
+    """
+    Merges rooms that share an entire edge, i.e. whose union is still a rectangle.
+    A room whose grey values straddle two bands comes out as fragments like that.
+    """
+    rooms = [Box2(room.left, room.bottom, room.right, room.top) for room in rooms]
+    merged = True
+
+    while merged:
+        merged = False
+
+        for horizontal in (True, False):
+            # Key each room by the edge a neighbour would have to share with it.
+            if horizontal:
+                starts = {(room.left, room.bottom, room.top): i for i, room in enumerate(rooms)}
+            else:
+                starts = {(room.bottom, room.left, room.right): i for i, room in enumerate(rooms)}
+
+            removed = set()
+            for i, room in enumerate(rooms):
+                if i in removed:
+                    continue
+
+                while True:
+                    key = (room.right, room.bottom, room.top) if horizontal else (room.top, room.left, room.right)
+                    j = starts.get(key)
+                    if j is None or j == i or j in removed:
+                        break
+
+                    other = rooms[j]
+                    if horizontal:
+                        room.right = other.right
+                    else:
+                        room.top = other.top
+                    removed.add(j)
+                    merged = True
+
+            rooms = [room for i, room in enumerate(rooms) if i not in removed]
+
+    return rooms
+
+
+def format_index(rooms, index):
+    lines = []
+
+    def describe(i):
+        room = rooms[i]
+        return f"#{i} ({room.left},{room.bottom},{room.right},{room.top})"
+
+    for i, j in index.overlaps:
+        lines.append(f"overlap: {describe(i)} and {describe(j)}")
+
+    for i in index.zero_area:
+        lines.append(f"zero area: {describe(i)}")
+
+    for i in index.out_of_bounds:
+        lines.append(f"out of bounds: {describe(i)}")
+
+    for i, neighbours in enumerate(index.adjacency):
+        if neighbours:
+            lines.append(f"adjacent: #{i} -> " + ", ".join(f"#{j}" for j in neighbours))
+
+    return lines
+
+
+def postprocess(result, args):
+    """
+    Applies --merge and --check to a result, returning whether the rooms passed the check.
+    """
+    if args.merge:
+        result.rooms = merge_fragments(result.rooms)
+
+    if not args.check:
+        return True
+
+    index = index_rooms(result.rooms, result.bounds)
+
+    for line in format_index(result.rooms, index):
+        print(f"# {line}")
+
+    return not (index.overlaps or index.zero_area or index.out_of_bounds)
+
+
+def collect_bitmaps(patterns):
+    """
+    Expands directories and glob patterns into a list of bitmap paths, in a stable order.
+    """
+    files = []
+
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files += sorted(os.path.join(pattern, name) for name in os.listdir(pattern)
+                            if name.lower().endswith(BITMAP_EXTENSIONS))
+        elif glob.has_magic(pattern):
+            files += sorted(glob.glob(pattern, recursive=True))
+        else:
+            files.append(pattern)
+
+    return list(dict.fromkeys(files))
+
+
+def prototype_id(fname, prefix = ""):
+    """
+    Roompack prototype ID from a bitmap's file name, e.g. large_area_0.png -> LargeArea0.
+    """
+    stem = os.path.splitext(os.path.basename(fname))[0]
+    parts = re.split(r"[^A-Za-z0-9]+", stem)
+    return prefix + "".join(part[:1].upper() + part[1:] for part in parts if part)
+
+
+def format_rooms(result):
+    lines = [f"  size: {result.width},{result.height}"]
+
+    if not result.rooms:
+        lines.append("  rooms: []")
+        return lines
+
+    lines.append("  rooms:")
+    for room in result.rooms:
+        lines.append(f"    - {room.left},{room.bottom},{room.right},{room.top}")
+
+    return lines
+
+
+def format_prototype(proto_id, result):
+    lines = ["- type: dungeonRoomPack", f"  id: {proto_id}"] + format_rooms(result)
+    return "\n".join(lines) + "\n"
+
+
+def hash_bitmap(fname, *settings):
+    h = hashlib.sha256(repr(settings).encode())
+
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def load_hashes(output_dir):
+    try:
+        with open(os.path.join(output_dir, HASHES_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_hashes(output_dir, hashes):
+    with open(os.path.join(output_dir, HASHES_FILE), "w", encoding="utf-8") as f:
+        json.dump(hashes, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def analyze_bitmaps(files, jobs, centered, offset_x, offset_y, backend = 'auto', tiled = False, tile_rows = None, raw_size = None):
+    """
+    Yields (file, RoomPackBitmap) for every file in order, analyzing them in a process pool when there's more than one.
+    """
+    analyze = functools.partial(analyze_bitmap, centered=centered, offset_x=offset_x, offset_y=offset_y,
+                                backend=backend, tiled=tiled, tile_rows=tile_rows, raw_size=raw_size)
+
+    if jobs == 1 or len(files) <= 1:
+        for fname in files:
+            yield fname, analyze(fname)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from zip(files, pool.map(analyze, files))
+
+
+def write_prototypes(files, args):
+    """
+    Batch mode: writes one roompack prototype file per bitmap into the output directory.
+    Bitmaps whose contents and settings haven't changed since the last run are skipped.
+    """
+    os.makedirs(args.output_dir, exist_ok=True)
+    hashes = load_hashes(args.output_dir)
+
+    pending = {}
+    for fname in files:
+        proto_id = prototype_id(fname, args.id_prefix)
+        output = os.path.join(args.output_dir, proto_id + ".yml")
+        # --check is part of it, so packs written without checking aren't skipped by a run that checks.
+        digest = hash_bitmap(fname, proto_id, args.center, args.offset, args.merge, args.check)
+
+        if not args.force and hashes.get(proto_id) == digest and os.path.exists(output):
+            continue
+
+        pending[fname] = (proto_id, output, digest)
+
+    skipped = len(files) - len(pending)
+    failed = 0
+
+    for fname, result in analyze_bitmaps(list(pending), args.jobs, args.center, args.offset[0], args.offset[1], args.backend,
+                                           args.tiled, args.tile_rows, args.raw_size):
+        proto_id, output, digest = pending[fname]
+
+        passed = postprocess(result, args)
+
+        with open(output, "w", encoding="utf-8", newline="\n") as f:
+            f.write(format_prototype(proto_id, result))
+
+        # Only remember packs that passed, so a failed check fails again next run instead of being skipped.
+        if passed:
+            hashes[proto_id] = digest
+        else:
+            hashes.pop(proto_id, None)
+            failed += 1
+
+        print(f"{fname}: {proto_id} ({len(result.rooms)} rooms)")
+
+    save_hashes(args.output_dir, hashes)
+    print(f"Generated {len(pending)} room packs, {skipped} unchanged.")
+
+    if failed:
+        print(f"{failed} room packs have overlapping, empty or out of bounds rooms.")
+
+    return failed == 0
+
+
+def analyze_bitmap_contours(fname):
+    """
+    The original implementation, cv2.findContours on a mask of every band, with the bitmap read by OpenCV.
+    Slow, but the baseline the run-based labeling has to match.
+    """
+    import cv2
+
+    image = cv2.imread(fname, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise OSError(f"unable to read bitmap '{fname}'")
+
+    rects = []
+    for i in range(0, 1 + SUBDIVISIONS):
+        lower = MAX_VALUE / SUBDIVISIONS * (i - 1)
+        upper = MAX_VALUE / SUBDIVISIONS *  i - 1
+
+        lower = max(MIN_VALUE, lower)
+        upper = min(MAX_VALUE - 1, upper)
+
+        image_mask = cv2.threshold(cv2.inRange(image, lower, upper), 0, 255, cv2.THRESH_TOZERO)[1]
+        rects += [cv2.boundingRect(contour) for contour in cv2.findContours(image_mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)[0]]
+
+    return make_result(image.shape[1], image.shape[0], rects, False, 0, 0)
+
+
+def compare_backends(files):
+    """
+    Checks every bitmap against analyze_bitmap_contours: read by each backend and labeled by runs, and in tiled mode
+    where it can read the bitmap. Reports any that disagree and returns whether they all matched.
+    """
+    mismatched = 0
+
+    for fname in files:
+        expected = analyze_bitmap_contours(fname)
+        results = {name: functools.partial(analyze_bitmap, fname, backend=name) for name in ('numpy', 'opencv')}
+        results['tiled'] = functools.partial(analyze_bitmap, fname, tiled=True)
+
+        for name, analyze in results.items():
+            try:
+                actual = analyze()
+            except ValueError as e:
+                print(f"{fname}: skipping {name}, {e}")
+                continue
+
+            if actual != expected:
+                mismatched += 1
+                print(f"{fname}: {name} found {len(actual.rooms)} rooms, findContours found {len(expected.rooms)}")
+
+    print(f"Compared {len(files)} bitmaps, {mismatched} mismatched.")
+    return mismatched == 0
 
 
 def main():
     parser = argparse.ArgumentParser(description='Calculate rooms from a greyscale bitmap')
 
-    parser.add_argument('file', type=str,
-                        help='a greyscale bitmap')
+    parser.add_argument('files', type=str,
+                        nargs='+',
+                        help='greyscale bitmaps, directories of them or glob patterns')
 
     parser.add_argument('--center', action=argparse.BooleanOptionalAction,
                         default=False,
@@ -85,20 +1051,78 @@ def main():
                         default=[0, 0],
                         help='offset the output coordinates')
 
+    parser.add_argument('--output-dir', type=str,
+                        help='write a dungeonRoomPack prototype file per bitmap into this directory')
+
+    parser.add_argument('--id-prefix', type=str,
+                        default='',
+                        help='prefix for prototype IDs derived from file names')
+
+    parser.add_argument('--jobs', type=int,
+                        default=os.cpu_count(),
+                        help='number of bitmaps to analyze in parallel')
+
+    parser.add_argument('--force', action='store_true',
+                        help='regenerate room packs even if their bitmap is unchanged')
+
+    parser.add_argument('--backend', choices=BACKENDS,
+                        default='auto',
+                        help='image backend; auto uses OpenCV if installed, NumPy and Pillow otherwise')
+
+    parser.add_argument('--compare-backends', action='store_true',
+                        help='check that both backends and tiled mode find the same rooms as findContours, the original implementation (needs OpenCV)')
+
+    parser.add_argument('--check', action='store_true',
+                        help='report overlapping, empty, out of bounds and adjacent rooms; fail on any of the first three')
+
+    parser.add_argument('--merge', action='store_true',
+                        help='merge rooms sharing a whole edge, e.g. a room split across two grey bands')
+
+    parser.add_argument('--tiled', action='store_true',
+                        help='stream bitmaps in strips of rows to bound memory use; reads .png, .pgm and raw bitmaps')
+
+    parser.add_argument('--tile-rows', type=int,
+                        help=f'rows per strip in tiled mode (default: {TILE_PIXELS} pixels worth)')
+
+    parser.add_argument('--raw-size', type=int,
+                        nargs=2,
+                        metavar=('WIDTH', 'HEIGHT'),
+                        help='read the bitmaps as headerless 8-bit greyscale of this size; implies --tiled')
+
     args = parser.parse_args()
+    args.tiled |= args.raw_size is not None
 
-    result = analyze_bitmap(args.file, args.center, args.offset[0], args.offset[1])
+    if args.tile_rows is not None and args.tile_rows < 1:
+        parser.error('--tile-rows must be at least 1')
 
+    files = collect_bitmaps(args.files)
 
-    print(f"  size: {result.width},{result.height}")
-    print("  rooms:")
+    if not files:
+        parser.error('no bitmaps found')
 
-    for room in result.rooms:
-        print(f"    - {room.left},{room.bottom},{room.right},{room.top}")
+    if args.compare_backends:
+        exit(0 if compare_backends(files) else 1)
 
-    print("")
-    print(f"Generated {len(result.rooms)} rooms.")
+    if args.output_dir:
+        exit(0 if write_prototypes(files, args) else 1)
+
+    passed = True
+
+    for fname, result in analyze_bitmaps(files, args.jobs, args.center, args.offset[0], args.offset[1], args.backend,
+                                           args.tiled, args.tile_rows, args.raw_size):
+        if len(files) > 1:
+            print(f"# {fname}")
+
+        passed &= postprocess(result, args)
+
+        for line in format_rooms(result):
+            print(line)
+
+        print("")
+        print(f"Generated {len(result.rooms)} rooms.")
+
+    if not passed:
+        exit(1)
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Benchmark for make_roompack.py.
+# Generates bitmaps with rooms spread over many grey bands, some of them hollow or nested, and times the untiled
+# and tiled analysis against the original per-band findContours implementation, checking they find the same rooms.
+# Every bitmap is also saved as 16-bit greyscale and checked through each loader, timed separately.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy
+import PIL.Image
+import make_roompack
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark make_roompack.py on generated bitmaps.")
+    parser.add_argument("--size", type=int, nargs=2, default=[3000, 3000], metavar=("WIDTH", "HEIGHT"), help="Size of the generated bitmaps")
+    parser.add_argument("--rooms", type=int, default=2000, help="Number of rooms per bitmap")
+    parser.add_argument("--bands", type=int, default=make_roompack.SUBDIVISIONS, help="Number of grey bands the rooms are spread over")
+    parser.add_argument("--hollow", type=float, default=0.2, help="Fraction of rooms that are only walls, some with another room inside")
+    parser.add_argument("--bitmaps", type=int, default=3, help="Number of bitmaps to generate")
+    parser.add_argument("--tile-rows", type=int, default=256, help="Rows per strip for the tiled run")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--no-reference", action="store_true", help="Don't run the findContours implementation or the OpenCV backend, e.g. without OpenCV")
+
+    args = parser.parse_args()
+
+    rng = numpy.random.default_rng(args.seed)
+    timings = {}
+    mismatched = 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(args.bitmaps):
+            bitmap = generate_bitmap(rng, args.size[0], args.size[1], args.rooms, args.bands, args.hollow)
+            fname = os.path.join(directory, f"bitmap_{i}.png")
+            PIL.Image.fromarray(bitmap).save(fname)
+            # Same bands in the high byte, noise in the low one, which has to be ignored.
+            fname_16 = os.path.join(directory, f"bitmap_{i}_16.png")
+            PIL.Image.fromarray(bitmap.astype(numpy.uint16) << 8 | rng.integers(0, 256, bitmap.shape, dtype=numpy.uint16)).save(fname_16)
+
+            results = {}
+            for suffix, path in (("", fname), (" 16-bit", fname_16)):
+                if not args.no_reference:
+                    results["findContours" + suffix] = timed(timings, "findContours" + suffix, lambda: make_roompack.analyze_bitmap_contours(path))
+                    results["opencv" + suffix] = timed(timings, "opencv" + suffix, lambda: make_roompack.analyze_bitmap(path, backend='opencv'))
+                results["untiled" + suffix] = timed(timings, "untiled" + suffix, lambda: make_roompack.analyze_bitmap(path, backend='numpy'))
+                results["tiled" + suffix] = timed(timings, "tiled" + suffix, lambda: make_roompack.analyze_bitmap(path, tiled=True, tile_rows=args.tile_rows))
+
+            expected = next(iter(results.values()))
+            for name, result in results.items():
+                if result != expected:
+                    mismatched += 1
+                    print(f"{fname}: {name} found {len(result.rooms)} rooms, expected {len(expected.rooms)}")
+
+            print(f"bitmap {i}: {len(expected.rooms)} rooms")
+
+    for name, elapsed in timings.items():
+        print(f"{name:>19}: {sum(elapsed) / len(elapsed):.3f}s per bitmap")
+
+    if mismatched:
+        print(f"{mismatched} results mismatched.")
+        sys.exit(1)
+
+
+def generate_bitmap(rng, width: int, height: int, rooms: int, bands: int, hollow: float) -> numpy.ndarray:
+    """
+    Random rooms, each filled with a grey from one of the bands. Later rooms are painted over earlier ones.
+    """
+    step = make_roompack.MAX_VALUE // make_roompack.SUBDIVISIONS
+    greys = numpy.linspace(1, make_roompack.SUBDIVISIONS - 1, bands).astype(int) * step
+    image = numpy.zeros((height, width), dtype=numpy.uint8)
+    side = max(4, int((width * height / rooms) ** 0.5))
+
+    for _ in range(rooms):
+        w, h = rng.integers(3, 2 * side, size=2)
+        x, y = rng.integers(0, max(1, width - w)), rng.integers(0, max(1, height - h))
+        grey = rng.choice(greys)
+        image[y:y + h, x:x + w] = grey
+
+        if rng.random() < hollow and w > 4 and h > 4:
+            wall = rng.integers(1, max(2, min(w, h) // 4))
+            image[y + wall:y + h - wall, x + wall:x + w - wall] = 0
+            inner_w, inner_h = w - 2 * wall - 2, h - 2 * wall - 2
+            if inner_w > 0 and inner_h > 0 and rng.random() < 0.5:
+                # A room inside, sometimes in the same band.
+                image[y + wall + 1:y + wall + 1 + inner_h, x + wall + 1:x + wall + 1 + inner_w] = grey if rng.random() < 0.5 else rng.choice(greys)
+
+    return image
+
+
+def timed(timings: dict, name: str, action):
+    start = time.perf_counter()
+    result = action()
+    timings.setdefault(name, []).append(time.perf_counter() - start)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,84 @@
+import json
 import os
 import requests
 import yaml
 import re
 from datetime import datetime
+from changelog_lib import load_yaml, user_cache_dir
 
 # GitHub API setup
 GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
 REPO = os.environ.get("GITHUB_REPOSITORY", "LateStation14/Late-station-14")
 HEADERS = {"Authorization": f"token {GITHUB_TOKEN}", "Accept": "application/vnd.github.v3+json"}
 CHANGELOG_PATH = "Resources/Changelog/LateStation.yml"  # Updated to match exact case
-
-def get_merged_prs(since_time=None):
-    """Fetch merged PRs since the last run."""
-    url = f"https://api.github.com/repos/{REPO}/pulls?state=closed&sort=updated&direction=desc"
-    response = requests.get(url, headers=HEADERS)
+# ETags and contents of the PR list pages fetched last time, so unchanged pages come back as cheap 304s
+CACHE_PATH = os.environ.get("CHANGELOG_CACHE_PATH") or os.path.join(user_cache_dir(), "update_changelog.json")
+PER_PAGE = 100
+# Bytes read from the end of the changelog at a time when looking for its last entry
+TAIL_BLOCK_SIZE = 16 * 1024
+
+# The only PR fields used, to keep the cache small
+PR_FIELDS = ("number", "merged_at", "updated_at", "body", "user", "html_url")
+
+def load_cache():
+    """Load the page cache, or start an empty one."""
+    if not os.path.exists(CACHE_PATH):
+        return {}
+    with open(CACHE_PATH, "r") as f:
+        return json.load(f)
+
+def save_cache(cache):
+    """Save the page cache."""
+    os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+    with open(CACHE_PATH, "w") as f:
+        json.dump(cache, f)
+
+def get_page(session, url, cache):
+    """Fetch one page of PRs, or reuse the cached one if GitHub says it hasn't changed. Returns (PRs, next page URL)."""
+    cached = cache.get(url)
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = session.get(url, headers=headers)
+    if response.status_code == 304:
+        return cached["prs"], cached["next"]
     response.raise_for_status()
-    prs = response.json()
+
+    prs = [{field: pr[field] for field in PR_FIELDS} for pr in response.json()]
+    next_url = response.links.get("next", {}).get("url")
+    cache[url] = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "prs": prs,
+        "next": next_url,
+    }
+    return prs, next_url
+
+def get_merged_prs(session, since_time=None):
+    """Fetch merged PRs since the last run, oldest first."""
+    cache = load_cache()
+    url = f"https://api.github.com/repos/{REPO}/pulls?state=closed&sort=updated&direction=desc&per_page={PER_PAGE}"
+    prs = []
+
+    # Follow the pages until they're past since_time. PRs are updated when merged, so everything on
+    # later pages was last updated, and so merged, before it.
+    while url:
+        page, url = get_page(session, url, cache)
+        prs += page
+        if since_time and page and page[-1]["updated_at"] < since_time:
+            break
+
+    save_cache(cache)
 
     # Filter for merged PRs
     merged_prs = [pr for pr in prs if pr["merged_at"] is not None]
     if since_time:
         merged_prs = [pr for pr in merged_prs if pr["merged_at"] > since_time]
-    return merged_prs
+    return sorted(merged_prs, key=lambda pr: pr["merged_at"])
 
 def parse_changelog(pr_body):
     """Parse the Changelog section from the PR body."""
@@ -59,14 +116,53 @@ def load_changelog():
         with open(CHANGELOG_PATH, "w") as f:
             yaml.safe_dump(default_changelog, f, default_flow_style=False, sort_keys=False)
         return default_changelog
-    with open(CHANGELOG_PATH, "r") as f:
-        return yaml.safe_load(f)
+    with open(CHANGELOG_PATH, "rb") as f:
+        return load_yaml(f)
 
 def save_changelog(data):
     """Save the updated changelog YAML."""
     with open(CHANGELOG_PATH, "w") as f:
         yaml.safe_dump(data, f, default_flow_style=False, sort_keys=False)
 
+def read_last_entry(path):
+    """
+    Read the last entry by scanning back from the end of the file, so the cost doesn't grow with the changelog.
+    Returns None if new entries can't just be appended, like when Entries isn't the last key or is written as [].
+    """
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        block_size = TAIL_BLOCK_SIZE
+        while True:
+            start = max(size - block_size, 0)
+            f.seek(start)
+            lines = f.read().split(b"\n")
+            if start > 0:
+                lines = lines[1:]  # Probably cut off halfway
+
+            # The last unindented line starts the last entry, if the file ends in the Entries list
+            last = next((i for i in range(len(lines) - 1, -1, -1) if lines[i] and not lines[i][:1].isspace()), None)
+            if last is not None:
+                break
+            if start == 0:
+                return None
+            block_size *= 4
+
+    if not lines[last].startswith(b"- "):
+        return None
+    return load_yaml(b"\n".join(lines[last:]))[0]
+
+def append_entries(path, entries):
+    """Append entries to the end of the changelog's Entries list, leaving the rest of the file as is."""
+    if not entries:
+        return
+    with open(path, "rb+") as f:
+        # Make sure the new entries start on a line of their own
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        f.write(yaml.safe_dump(entries, default_flow_style=False, sort_keys=False).encode("utf-8"))
+
 def get_next_id(entries):
     """Get the next available ID."""
     if not entries:
@@ -74,20 +170,30 @@ def get_next_id(entries):
     return max(entry["id"] for entry in entries) + 1
 
 def main():
-    # Load existing changelog (or create it)
-    changelog = load_changelog()
-    entries = changelog.get("Entries", [])
-
-    # Get the latest entry time to fetch PRs since then
-    last_time = max((entry["time"] for entry in entries), default=None) if entries else None
+    # Entries are appended in order, so the last one has the highest ID and latest time
+    last_entry = read_last_entry(CHANGELOG_PATH) if os.path.exists(CHANGELOG_PATH) else None
+    if last_entry:
+        changelog = None
+        next_id = last_entry["id"] + 1
+        last_time = last_entry["time"]
+    else:
+        # Load existing changelog (or create it)
+        changelog = load_changelog()
+        entries = changelog.get("Entries") or []
+        next_id = get_next_id(entries)
+
+        # Get the latest entry time to fetch PRs since then
+        last_time = max((entry["time"] for entry in entries), default=None) if entries else None
 
     # Fetch merged PRs
-    prs = get_merged_prs(since_time=last_time)
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    prs = get_merged_prs(session, since_time=last_time)
     if not prs:
         print("No new merged PRs found.")
         return
 
-    next_id = get_next_id(entries)
+    new_entries = []
 
     # Process each PR
     for pr in prs:
@@ -103,13 +209,16 @@ def main():
             "url": pr["html_url"],
             "changes": changes
         }
-        entries.append(entry)
+        new_entries.append(entry)
         next_id += 1
         print(f"Added entry for PR #{pr['number']} by {pr['user']['login']}")
 
     # Update changelog
-    changelog["Entries"] = entries
-    save_changelog(changelog)
+    if changelog is None:
+        append_entries(CHANGELOG_PATH, new_entries)
+    else:
+        changelog["Entries"] = entries + new_entries
+        save_changelog(changelog)
     print(f"Updated changelog with {len(prs)} new entries.")
 
 if __name__ == "__main__":
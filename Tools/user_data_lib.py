@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+
+# Shared between dump_user_data.py and erase_user_data.py: which tables hold data about a user, and how to get at it.
+# Both tools generate their SQL from USER_TABLES, so a table added here is dumped and erased alike.
+
+import csv
+import io
+import json
+from dataclasses import dataclass
+
+LATEST_DB_MIGRATION = "20250314222016_ConstructionFavorites"
+
+# Created by erase_user_data.py to keep track of how far along admin_log pseudonymization is.
+ERASE_PROGRESS_TABLE = "erase_admin_log_progress"
+
+# --analyze flags sequential scans reading more rows than this per loop.
+LARGE_TABLE_ROWS = 10000
+
+# Not in the game's schema. Without it, admin_log pages are found through the player_user_id index alone, so every
+# page reads and sorts all of the user's admin_log_player rows and a whole dump costs pages x rows. With it, each
+# page is read straight off the index in key order. Create it by hand before dumping users with a lot of logs;
+# --analyze suggests it when a page had to sort.
+ADMIN_LOG_PAGE_INDEX = 'CREATE INDEX CONCURRENTLY "IX_admin_log_player_player_user_id_round_id_log_id" ON admin_log_player (player_user_id, round_id, log_id);'
+
+@dataclass(frozen=True)
+class ChildTable:
+    """
+    Rows of another table nested into each dumped row, matched on table.key = parent.parent_key.
+    Deleting the parent row cascades to these, so erasing doesn't need to know about them.
+    """
+    name: str
+    table: str
+    key: str
+    parent_key: str
+    # Columns left out of the nested rows, usually the key pointing back at the parent.
+    drop: tuple = ()
+    # Nest a single row (or null) instead of an array.
+    single: bool = False
+    children: tuple = ()
+
+
+@dataclass(frozen=True)
+class UserTable:
+    """
+    A table with rows keyed on a user ID.
+    """
+    name: str
+    key: str
+    drop: tuple = ()
+    children: tuple = ()
+    # "delete" the user's rows, or leave them be with None.
+    erase: str = "delete"
+    # Dumped and erased by hand-written code in the tools instead of generated SQL.
+    custom: bool = False
+
+
+USER_TABLES = [
+    UserTable("admin", "user_id", drop=("admin_rank_id",), children=(
+        ChildTable("admin_rank", "admin_rank", "admin_rank_id", "admin_rank_id", single=True),
+        ChildTable("admin_flags", "admin_flag", "admin_id", "user_id", drop=("admin_id",)),
+    )),
+    # Paged on export, pseudonymized rather than deleted on erasure.
+    UserTable("admin_log", "player_user_id", custom=True),
+    # Not deleted directly; their rows reference player and are cascaded away with it.
+    UserTable("admin_messages", "player_user_id", erase=None),
+    UserTable("admin_notes", "player_user_id", erase=None),
+    UserTable("admin_watchlists", "player_user_id", erase=None),
+    UserTable("assigned_user_id", "user_id"),
+    UserTable("blacklist", "user_id"),
+    UserTable("connection_log", "user_id", children=(
+        ChildTable("ban_hits", "server_ban_hit", "connection_id", "connection_log_id"),
+    )),
+    UserTable("play_time", "player_id"),
+    UserTable("player", "user_id", children=(
+        ChildTable("player_rounds", "player_round", "players_id", "player_id", drop=("players_id",)),
+    )),
+    UserTable("preference", "user_id", children=(
+        ChildTable("profiles", "profile", "preference_id", "preference_id", drop=("preference_id",), children=(
+            ChildTable("jobs", "job", "profile_id", "profile_id", drop=("profile_id",)),
+            ChildTable("antags", "antag", "profile_id", "profile_id", drop=("profile_id",)),
+            ChildTable("traits", "trait", "profile_id", "profile_id", drop=("profile_id",)),
+        )),
+    )),
+    UserTable("role_whitelists", "player_user_id"),
+    UserTable("server_ban", "player_user_id", children=(
+        ChildTable("unban", "server_unban", "ban_id", "server_ban_id", drop=("ban_id",), single=True),
+    )),
+    UserTable("server_ban_exemption", "user_id"),
+    UserTable("server_role_ban", "player_user_id", children=(
+        ChildTable("unban", "server_role_unban", "ban_id", "server_role_ban_id", drop=("ban_id",), single=True),
+    )),
+    UserTable("uploaded_resource_log", "user_id"),
+    UserTable("whitelist", "user_id"),
+]
+
+# UUID columns that point at the admin who did something rather than whom it is about.
+ADMIN_REFERENCE_COLUMNS = {
+    ("admin_messages", "created_by_id"),
+    ("admin_messages", "deleted_by_id"),
+    ("admin_messages", "last_edited_by_id"),
+    ("admin_notes", "created_by_id"),
+    ("admin_notes", "deleted_by_id"),
+    ("admin_notes", "last_edited_by_id"),
+    ("admin_watchlists", "created_by_id"),
+    ("admin_watchlists", "deleted_by_id"),
+    ("admin_watchlists", "last_edited_by_id"),
+    ("server_ban", "banning_admin"),
+    ("server_ban", "last_edited_by_id"),
+    ("server_role_ban", "banning_admin"),
+    ("server_role_ban", "last_edited_by_id"),
+    ("server_role_unban", "unbanning_admin"),
+    ("server_unban", "unbanning_admin"),
+}
+
+
+def json_strip(expression: str, drop: tuple) -> str:
+    if not drop:
+        return expression
+    columns = ", ".join(f"'{column}'" for column in drop)
+    return f"({expression} - ARRAY[{columns}]::text[])"
+
+
+def select_rows(source: str, children: tuple, where: str, indent: int) -> str:
+    """
+    SELECT of source's rows, with every child table nested into them as a JSON column.
+    """
+    pad = "    " * indent
+    columns = ["*"] + [nested_column(child, source, indent + 1) for child in children]
+
+    return (f"{pad}SELECT\n{pad}    " + f",\n{pad}    ".join(columns) +
+            f"\n{pad}FROM\n{pad}    {source}\n{pad}WHERE\n{pad}    {where}")
+
+
+def nested_column(child: ChildTable, parent: str, indent: int) -> str:
+    pad = "    " * indent
+    row = json_strip(f"to_jsonb({child.name}_sq)", child.drop)
+    value = row if child.single else f"COALESCE(jsonb_agg({row}), '[]')"
+    rows = select_rows(child.table, child.children, f"{child.table}.{child.key} = {parent}.{child.parent_key}", indent + 1)
+
+    return f"(SELECT {value} FROM (\n{rows}\n{pad}) {child.name}_sq)\n{pad}as {child.name}"
+
+
+def dump_query(table: UserTable) -> str:
+    """
+    Query returning the user's rows of a table as one JSON document (text) per row, taking the user ID as its parameter.
+    """
+    rows = select_rows(table.name, table.children, f"{table.key} = %s", 1)
+
+    # #>> '{}' is to turn it into a string.
+    return f"""
+SELECT
+    {json_strip("to_jsonb(data)", table.drop)} #>> '{{}}'
+FROM (
+{rows}
+) as data
+"""
+
+
+def admin_log_page_query(resume: bool) -> str:
+    """
+    One keyset page of a user's admin_log, as (JSON document, round_id, log_id) rows. Takes the user ID, then
+    the last round_id and log_id of the previous page when resuming, then the page size.
+    Only cheap per page with ADMIN_LOG_PAGE_INDEX.
+    """
+    after = "AND (alp.round_id, alp.log_id) > (%s, %s)" if resume else ""
+
+    return f"""
+SELECT
+    (to_jsonb(data) - ARRAY['admin_log_id', 'page_round_id', 'page_log_id']) #>> '{{}}',
+    page_round_id,
+    page_log_id
+FROM (
+    SELECT
+        *,
+        alp.round_id AS page_round_id,
+        alp.log_id AS page_log_id
+    FROM
+        admin_log_player alp
+    INNER JOIN
+        admin_log al
+    ON
+        al.admin_log_id = alp.log_id AND al.round_id = alp.round_id
+    WHERE
+        player_user_id = %s {after}
+    ORDER BY
+        alp.round_id, alp.log_id
+    LIMIT %s
+) as data
+"""
+
+
+def load_erase_users(cur: "psycopg2.cursor", users: dict):
+    """
+    COPYs the users to erase (user ID to user name) into the erase_users temporary table, so every erase step is
+    one statement joining against it, however many users there are.
+    """
+    cur.execute("CREATE TEMPORARY TABLE erase_users (user_id uuid PRIMARY KEY, user_name text NOT NULL)")
+
+    data = io.StringIO()
+    csv.writer(data).writerows(users.items())
+    data.seek(0)
+    cur.copy_expert("COPY erase_users (user_id, user_name) FROM STDIN WITH (FORMAT csv)", data)
+    cur.execute("ANALYZE erase_users")
+
+
+def collect_log_keys(cur: "psycopg2.cursor"):
+    """
+    Every admin_log line of the users in erase_users, into the erase_log_keys temporary table, indexed to page
+    through them cheaply. admin_log is also verified against it: once the players are deleted, admin_log_player
+    no longer says which lines were theirs.
+    """
+    cur.execute("""
+CREATE TEMPORARY TABLE erase_log_keys AS
+SELECT
+    lp.player_user_id AS user_id,
+    lp.round_id,
+    lp.log_id
+FROM
+    admin_log_player lp
+INNER JOIN
+    erase_users e
+ON
+    e.user_id = lp.player_user_id
+""")
+    cur.execute("ALTER TABLE erase_log_keys ADD PRIMARY KEY (user_id, round_id, log_id)")
+    cur.execute("ANALYZE erase_log_keys")
+
+
+def name_pattern(name: str) -> str:
+    """
+    SQL regex matching the user name in the SQL expression name as a whole word of an admin log message, so a short
+    name isn't found inside other players' names or inside user IDs. Anything but letters, digits and underscores in
+    the name is escaped.
+    """
+    return rf"""('(?<![[:alnum:]_])' || regexp_replace({name}, '([^[:alnum:]_])', '\\\1', 'g') || '(?![[:alnum:]_])')"""
+
+
+def erase_steps() -> list:
+    """
+    (name, count query, statement) of every step, for the users in erase_users and their log lines in
+    erase_log_keys. The count queries and DELETEs take no parameters. admin_log's statement pseudonymizes one chunk
+    of one user's lines, taking user_id, user_name, the round_id and log_id to continue after, and chunk_size; it
+    returns the last key of the chunk and how many lines it changed, or no row once the user is done. Its count is
+    of the lines still naming the user, outside of the user's own ID.
+    """
+    steps = [(
+        "admin_log",
+        f"""
+SELECT
+    count(*)
+FROM
+    admin_log l
+INNER JOIN
+    erase_log_keys k
+ON
+    k.round_id = l.round_id AND k.log_id = l.admin_log_id
+INNER JOIN
+    erase_users e
+ON
+    e.user_id = k.user_id
+WHERE
+    replace(l.message, e.user_id::text, '') ~ {name_pattern("e.user_name")}
+""",
+        f"""
+WITH chunk AS (
+    SELECT
+        round_id, log_id
+    FROM
+        erase_log_keys
+    WHERE
+        user_id = %(user_id)s AND (round_id, log_id) > (%(round_id)s, %(log_id)s)
+    ORDER BY
+        round_id, log_id
+    LIMIT %(chunk_size)s
+), updated AS (
+    UPDATE
+        admin_log l
+    SET
+        message = regexp_replace(message, {name_pattern("%(user_name)s")}, %(user_id)s::text, 'g')
+    FROM
+        chunk
+    WHERE
+        chunk.round_id = l.round_id AND chunk.log_id = l.admin_log_id
+    RETURNING 1
+)
+SELECT
+    round_id, log_id, (SELECT count(*) FROM updated)
+FROM
+    chunk
+ORDER BY
+    round_id DESC, log_id DESC
+LIMIT 1
+""",
+    )]
+
+    for table in USER_TABLES:
+        if table.erase == "delete" and not table.custom:
+            join = f"erase_users WHERE {table.name}.{table.key} = erase_users.user_id"
+            steps.append((table.name, f"SELECT count(*) FROM {table.name}, {join}", f"DELETE FROM {table.name} USING {join}"))
+
+    return steps
+
+
+def erase_query() -> str:
+    """
+    The DELETEs of erase_steps as one batch of statements.
+    """
+    return ";\n".join(statement for name, _, statement in erase_steps() if name != "admin_log")
+
+
+def lookup_columns() -> dict:
+    """
+    The column every table in the registry is looked up by, for a user or a parent row.
+    """
+    columns = {"admin_log_player": "player_user_id"}
+
+    def add_children(children):
+        for child in children:
+            columns[child.table] = child.key
+            add_children(child.children)
+
+    for table in USER_TABLES:
+        if not table.custom:
+            columns[table.name] = table.key
+        add_children(table.children)
+
+    return columns
+
+
+def explain_analyze(cur: "psycopg2.cursor", query: str, params) -> dict:
+    """
+    Runs a query under EXPLAIN (ANALYZE, BUFFERS) and returns its plan. This really executes it, so roll back after
+    anything that writes.
+    """
+    cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", params)
+    return cur.fetchone()[0][0]
+
+
+def seq_scans(node: dict) -> list:
+    """
+    (table, rows read per loop, loops) of every sequential scan in a plan.
+    """
+    scans = []
+    if node["Node Type"] == "Seq Scan":
+        scans.append((node["Relation Name"], node["Actual Rows"] + node.get("Rows Removed by Filter", 0), node["Actual Loops"]))
+
+    for child in node.get("Plans", []):
+        scans += seq_scans(child)
+
+    return scans
+
+
+def sorts(node: dict) -> list:
+    """
+    Rows fed into every sort in a plan.
+    """
+    found = []
+    if node["Node Type"] == "Sort":
+        found.append(sum(child["Actual Rows"] * child["Actual Loops"] for child in node.get("Plans", [])))
+
+    for child in node.get("Plans", []):
+        found += sorts(child)
+
+    return found
+
+
+def analyze_step(name: str, plan: dict, sort_index: str = None) -> dict:
+    """
+    Report entry of one step's EXPLAIN (ANALYZE, BUFFERS) plan, with an index suggested for every table it read
+    from start to end that is big enough to matter. sort_index is suggested if the plan sorts, for keyset pages
+    that should come off an index in order.
+    """
+    columns = lookup_columns()
+    flagged = []
+    indexes = []
+    sorted_rows = sorts(plan["Plan"])
+
+    if sort_index and sorted_rows:
+        indexes.append(sort_index)
+
+    for table, rows, loops in seq_scans(plan["Plan"]):
+        if rows < LARGE_TABLE_ROWS:
+            continue
+        flagged.append({"table": table, "rows": rows, "loops": loops})
+        if table in columns:
+            indexes.append(f'CREATE INDEX CONCURRENTLY "IX_{table}_{columns[table]}" ON {table} ({columns[table]});')
+
+    return {
+        "step": name,
+        "ms": plan["Execution Time"],
+        "rows": plan["Plan"]["Actual Rows"],
+        "shared_hit_blocks": plan["Plan"].get("Shared Hit Blocks", 0),
+        "shared_read_blocks": plan["Plan"].get("Shared Read Blocks", 0),
+        # Foreign key cascades run as triggers and don't show up in the plan, only their time does.
+        "triggers": [{"name": trigger["Trigger Name"], "ms": trigger["Time"], "calls": trigger["Calls"]} for trigger in plan.get("Triggers", [])],
+        "seq_scans": flagged,
+        "sorted_rows": sorted_rows,
+        "suggested_indexes": list(dict.fromkeys(indexes)),
+        "plan": plan,
+    }
+
+
+def write_analysis(path: str, steps: list, info: dict):
+    """
+    Prints a summary of the analyzed steps and writes them to a JSON report.
+    """
+    print(f"{'Step':<32}{'Rows':>10}{'ms':>11}  Sequential scans")
+    for step in steps:
+        scans = ", ".join(f"{scan['table']} ({scan['rows']} rows x{scan['loops']})" for scan in step["seq_scans"])
+        print(f"{step['step']:<32}{step['rows']:>10}{step['ms']:>11.1f}  {scans}")
+
+    indexes = list(dict.fromkeys(index for step in steps for index in step["suggested_indexes"]))
+    if indexes:
+        print("Suggested indexes:")
+        for index in indexes:
+            print(f"  {index}")
+
+    report = dict(info, large_table_rows=LARGE_TABLE_ROWS, suggested_indexes=indexes, steps=steps)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"Analysis written to {path}")
+
+
+def registry_columns() -> tuple:
+    """
+    The tables the registry knows of, and the (table, column) pairs it accounts for.
+    """
+    tables = set()
+    columns = set(ADMIN_REFERENCE_COLUMNS)
+
+    def add_children(children):
+        for child in children:
+            tables.add(child.table)
+            columns.add((child.table, child.key))
+            add_children(child.children)
+
+    for table in USER_TABLES:
+        tables.add(table.name)
+        columns.add((table.name, table.key))
+        add_children(table.children)
+
+    # admin_log rows are linked to users through admin_log_player.
+    tables.add("admin_log_player")
+    columns.add(("admin_log_player", "player_user_id"))
+    columns.add((ERASE_PROGRESS_TABLE, "user_id"))
+
+    return tables, columns
+
+
+def check_schema(cur: "psycopg2.cursor", ignore_mismatch: bool) -> str:
+    """
+    Checks the schema version, and that every UUID column in the database is one the registry accounts for,
+    so a migration adding a user-linked table fails here instead of silently being left out. Returns the migration ID.
+    """
+    cur.execute("""
+SELECT
+    (SELECT "MigrationId" FROM "__EFMigrationsHistory" ORDER BY "MigrationId" DESC LIMIT 1),
+    ARRAY(SELECT table_name::text FROM information_schema.tables WHERE table_schema = current_schema()),
+    ARRAY(SELECT table_name || '.' || column_name FROM information_schema.columns
+          WHERE table_schema = current_schema() AND data_type = 'uuid')
+""")
+    schema_version, db_tables, db_uuid_columns = cur.fetchone()
+    if schema_version == None:
+        print("Unable to read database schema version.")
+        exit(1)
+
+    tables, columns = registry_columns()
+    problems = []
+
+    if schema_version != LATEST_DB_MIGRATION:
+        problems.append(f"Unsupport schema version of DB: '{schema_version}'. Supported: {LATEST_DB_MIGRATION}")
+
+    for table in sorted(tables - set(db_tables)):
+        problems.append(f"Table '{table}' is missing from the DB.")
+
+    for column in sorted(db_uuid_columns):
+        if tuple(column.split(".", 1)) not in columns:
+            problems.append(f"Column '{column}' may hold user IDs but isn't covered by the user table registry.")
+
+    for problem in problems:
+        print(problem)
+
+    if problems and not ignore_mismatch:
+        exit(1)
+
+    return schema_version